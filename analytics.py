@@ -0,0 +1,336 @@
+# analytics.py
+"""
+Длительность этапов заявки по отметкам STATUS_FLOW: прибытие → осмотр → решение →
+ремонт/эвакуация → движение возобновлено, в разрезе марки и типа происшествия.
+
+Считать это на лету по status_history медленно, поэтому StageRollup ведёт две таблицы:
+- ticket_stage_durations — длительность каждого этапа каждой заявки;
+- stage_duration_hourly — по часу окончания этапа, этапу, марке и типу: число, сумма и
+  гистограмма (BUCKETS). Перцентили за любой период собираются из гистограмм за
+  миллисекунды (StageRollup.report, /api/analytics/stages в http_api.py).
+
+Фоновая задача обрабатывает только новые строки status_history (водяной знак — id
+последней обработанной строки): для затронутых заявок пересчитывает этапы по status_done
+и переносит разницу в почасовые агрегаты. Несколько инстансов могут запускать задачу
+одновременно — пачку берёт тот, кто заблокировал строку водяного знака.
+"""
+from __future__ import annotations
+import asyncio
+import bisect
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import asyncpg
+
+from cluster import SCHEMA_LOCK
+
+logger = logging.getLogger(__name__)
+
+# этап → (отметки начала, отметки конца); время — самая ранняя из имеющихся отметок.
+# Ключи — из STATUS_FLOW в regular_bot.py
+STAGES: Tuple[Tuple[str, Tuple[str, ...], Tuple[str, ...]], ...] = (
+    ("arrive_inspect", ("arrive",), ("inspect",)),
+    ("inspect_decision", ("inspect",), ("decision",)),
+    ("decision_fix", ("decision",), ("repair", "evacuation")),
+    ("fix_resume", ("repair", "evacuation"), ("resume",)),
+    ("total", ("arrive",), ("resume",)),
+)
+STAGE_NAMES = tuple(name for name, _s, _e in STAGES)
+
+# верхние границы корзин гистограммы, сек; последняя корзина — всё, что дольше суток
+BUCKETS = (
+    60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 5400,
+    7200, 10800, 14400, 21600, 28800, 43200, 86400,
+)
+GROUPS = ("brand", "incident_type")
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS ticket_stage_durations (
+  ticket_id      TEXT NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
+  stage          TEXT NOT NULL,
+  brand          TEXT NOT NULL,
+  incident_type  TEXT NOT NULL,
+  started_at     TIMESTAMPTZ NOT NULL,
+  ended_at       TIMESTAMPTZ NOT NULL,
+  seconds        DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (ticket_id, stage)
+);
+CREATE TABLE IF NOT EXISTS stage_duration_hourly (
+  hour           TIMESTAMPTZ NOT NULL,
+  stage          TEXT NOT NULL,
+  brand          TEXT NOT NULL,
+  incident_type  TEXT NOT NULL,
+  n              BIGINT NOT NULL,
+  sum_sec        DOUBLE PRECISION NOT NULL,
+  buckets        BIGINT[] NOT NULL,
+  PRIMARY KEY (hour, stage, brand, incident_type)
+);
+CREATE TABLE IF NOT EXISTS stage_rollup_state (
+  id               SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  last_history_id  BIGINT NOT NULL
+);
+INSERT INTO stage_rollup_state(id, last_history_id) VALUES (1, 0) ON CONFLICT DO NOTHING;
+"""
+
+# (stage, brand, incident_type, started_at, ended_at, seconds)
+StageRow = Tuple[str, str, str, datetime, datetime, float]
+
+
+def stage_durations(done: Mapping[str, datetime]) -> Dict[str, Tuple[datetime, datetime]]:
+    """Этапы, у которых есть обе отметки и конец не раньше начала."""
+    out = {}
+    for name, starts, ends in STAGES:
+        start = min((done[k] for k in starts if k in done), default=None)
+        end = min((done[k] for k in ends if k in done), default=None)
+        if start is not None and end is not None and end >= start:
+            out[name] = (start, end)
+    return out
+
+
+def bucket_index(seconds: float) -> int:
+    return bisect.bisect_left(BUCKETS, seconds)
+
+
+def percentile(buckets: Sequence[int], q: float) -> Optional[float]:
+    """Оценка q-перцентиля (0..1) по гистограмме: линейно внутри корзины; хвост — нижней границей."""
+    total = sum(buckets)
+    if total <= 0:
+        return None
+    rank = q * total
+    seen = 0
+    for i, c in enumerate(buckets):
+        if c and seen + c >= rank:
+            lo = BUCKETS[i - 1] if i else 0
+            if i >= len(BUCKETS):
+                return float(lo)
+            return lo + (BUCKETS[i] - lo) * max(rank - seen, 0) / c
+        seen += c
+    return float(BUCKETS[-1])
+
+
+def _hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+class StageRollup:
+    def __init__(
+        self,
+        pool: Callable[[], Optional[asyncpg.Pool]],
+        *,
+        interval_sec: float = 60.0,
+        batch: int = 1000,
+        settle_sec: float = 30.0,
+    ):
+        self._pool = pool
+        self._interval = interval_sec
+        self._batch = batch
+        # строки моложе settle_sec не трогаем: id BIGSERIAL выдаётся до коммита, и строка
+        # с меньшим id может стать видна позже — водяной знак проскочил бы мимо неё
+        self._settle = settle_sec
+        self._schema_ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="stage-rollup")
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                n = await self.run_once()
+                if n:
+                    logger.info("Аналитика этапов: обработано %s строк status_history", n)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Аналитика этапов: ошибка пересчёта")
+            await asyncio.sleep(self._interval)
+
+    async def _ensure_schema(self, con: asyncpg.Connection) -> None:
+        if not self._schema_ready:
+            async with con.transaction():
+                await con.execute("SELECT pg_advisory_xact_lock($1, $2)", *SCHEMA_LOCK)
+                await con.execute(_DDL)
+            self._schema_ready = True
+
+    def _acquire(self):
+        pool = self._pool()
+        if pool is None:
+            raise ConnectionError("пул Postgres ещё не создан")
+        return pool.acquire()
+
+    async def run_once(self) -> int:
+        """Догоняет status_history пачками; возвращает число обработанных строк."""
+        total = 0
+        while True:
+            n, more = await self._step()
+            total += n
+            if not more:
+                return total
+
+    async def _step(self) -> Tuple[int, bool]:
+        async with self._acquire() as con:
+            await self._ensure_schema(con)
+            async with con.transaction():
+                mark = await con.fetchval(
+                    "SELECT last_history_id FROM stage_rollup_state WHERE id = 1 FOR UPDATE SKIP LOCKED"
+                )
+                if mark is None:
+                    return 0, False  # пачку сейчас обрабатывает другой инстанс
+                rows = await con.fetch(
+                    """
+                    SELECT id, ticket_id, ts > now() - make_interval(secs => $3) AS fresh
+                      FROM status_history WHERE id > $1 ORDER BY id LIMIT $2
+                    """,
+                    mark, self._batch, self._settle,
+                )
+                settled = []
+                for r in rows:
+                    if r["fresh"]:
+                        break
+                    settled.append(r)
+                if not settled:
+                    return 0, False
+                await self._recompute(con, sorted({r["ticket_id"] for r in settled}))
+                await con.execute(
+                    "UPDATE stage_rollup_state SET last_history_id = $1 WHERE id = 1", settled[-1]["id"]
+                )
+        return len(settled), len(settled) == self._batch
+
+    async def _recompute(self, con: asyncpg.Connection, ticket_ids: List[str]) -> None:
+        old = await con.fetch(
+            """
+            SELECT ticket_id, stage, brand, incident_type, started_at, ended_at, seconds
+              FROM ticket_stage_durations WHERE ticket_id = ANY($1::text[])
+            """,
+            ticket_ids,
+        )
+        marks = await con.fetch(
+            """
+            SELECT t.id, COALESCE(t.brand, '') AS brand, COALESCE(t.incident_type, '') AS incident_type,
+                   d.status_key, d.ts
+              FROM tickets t JOIN status_done d ON d.ticket_id = t.id
+             WHERE t.id = ANY($1::text[])
+            """,
+            ticket_ids,
+        )
+        done: Dict[str, Dict[str, datetime]] = {}
+        attrs: Dict[str, Tuple[str, str]] = {}
+        for r in marks:
+            done.setdefault(r["id"], {})[r["status_key"]] = r["ts"]
+            attrs[r["id"]] = (r["brand"], r["incident_type"])
+
+        before: Dict[Tuple[str, str], StageRow] = {
+            (r["ticket_id"], r["stage"]): (r["stage"], r["brand"], r["incident_type"], r["started_at"], r["ended_at"], r["seconds"])
+            for r in old
+        }
+        after: Dict[Tuple[str, str], StageRow] = {}
+        for tid, stamps in done.items():
+            brand, itype = attrs[tid]
+            for stage, (start, end) in stage_durations(stamps).items():
+                after[(tid, stage)] = (stage, brand, itype, start, end, (end - start).total_seconds())
+
+        # в почасовые агрегаты — только разница: убрать прежнее значение этапа, добавить новое
+        deltas: Dict[Tuple[datetime, str, str, str, int], List[float]] = {}
+        for key in before.keys() | after.keys():
+            if before.get(key) == after.get(key):
+                continue
+            for row, sign in ((before.get(key), -1), (after.get(key), 1)):
+                if row is None:
+                    continue
+                stage, brand, itype, _start, end, seconds = row
+                d = deltas.setdefault((_hour(end), stage, brand, itype, bucket_index(seconds)), [0, 0.0])
+                d[0] += sign
+                d[1] += sign * seconds
+        if not deltas:
+            return
+
+        await con.execute("DELETE FROM ticket_stage_durations WHERE ticket_id = ANY($1::text[])", ticket_ids)
+        await con.executemany(
+            """
+            INSERT INTO ticket_stage_durations(ticket_id, stage, brand, incident_type, started_at, ended_at, seconds)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            """,
+            [(tid, *row) for (tid, _stage), row in after.items()],
+        )
+        empty = [0] * (len(BUCKETS) + 1)
+        await con.executemany(
+            """
+            INSERT INTO stage_duration_hourly AS h(hour, stage, brand, incident_type, n, sum_sec, buckets)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (hour, stage, brand, incident_type) DO UPDATE
+               SET n = h.n + EXCLUDED.n,
+                   sum_sec = h.sum_sec + EXCLUDED.sum_sec,
+                   buckets[$8] = h.buckets[$8] + $5
+            """,
+            [
+                (hour, stage, brand, itype, n, s, empty[:idx] + [n] + empty[idx + 1:], idx + 1)
+                for (hour, stage, brand, itype, idx), (n, s) in deltas.items()
+                if n or s
+            ],
+        )
+
+    async def report(
+        self,
+        since: datetime,
+        until: datetime,
+        *,
+        by: Iterable[str] = GROUPS,
+        stage: Optional[str] = None,
+        brand: Optional[str] = None,
+        incident_type: Optional[str] = None,
+        quantiles: Sequence[float] = (0.5, 0.9, 0.95),
+    ) -> List[Dict[str, Any]]:
+        """Число, среднее и перцентили (сек) по этапам за [since, until) по часу окончания этапа."""
+        group = [g for g in GROUPS if g in set(by)]
+        cols = "".join(f", {g}" for g in group)
+        where = """
+            hour >= $1 AND hour < $2
+            AND ($3::text IS NULL OR stage = $3)
+            AND ($4::text IS NULL OR brand = $4)
+            AND ($5::text IS NULL OR incident_type = $5)
+        """
+        args = (since, until, stage, brand, incident_type)
+        async with self._acquire() as con:
+            await self._ensure_schema(con)
+            totals = await con.fetch(
+                # sum(BIGINT) в Postgres — numeric, asyncpg отдаёт Decimal: приводим к bigint
+                f"SELECT stage{cols}, sum(n)::bigint AS n, sum(sum_sec) AS sum_sec FROM stage_duration_hourly"
+                f" WHERE {where} GROUP BY stage{cols}",
+                *args,
+            )
+            cells = await con.fetch(
+                f"SELECT stage{cols}, b.i, sum(b.c)::bigint AS c"
+                f" FROM stage_duration_hourly, unnest(buckets) WITH ORDINALITY AS b(c, i)"
+                f" WHERE {where} GROUP BY stage{cols}, b.i",
+                *args,
+            )
+        hist: Dict[tuple, List[int]] = {}
+        for r in cells:
+            key = (r["stage"], *(r[g] for g in group))
+            hist.setdefault(key, [0] * (len(BUCKETS) + 1))[r["i"] - 1] = int(r["c"])
+
+        order = {name: i for i, name in enumerate(STAGE_NAMES)}
+        out = []
+        for r in totals:
+            if not r["n"]:
+                continue
+            buckets = hist.get((r["stage"], *(r[g] for g in group)), [0] * (len(BUCKETS) + 1))
+            item: Dict[str, Any] = {"stage": r["stage"]}
+            item.update({g: r[g] or None for g in group})
+            item["count"] = int(r["n"])
+            item["mean_sec"] = round(float(r["sum_sec"]) / int(r["n"]), 1)
+            for q in quantiles:
+                v = percentile(buckets, q)
+                item[f"p{q * 100:g}_sec"] = None if v is None else round(v, 1)
+            item["buckets"] = dict(zip([*map(str, BUCKETS), "inf"], buckets))
+            out.append(item)
+        out.sort(key=lambda it: (order.get(it["stage"], 99), *(it.get(g) or "" for g in group)))
+        return out
@@ -1,40 +1,135 @@
 # runner.py
-import os
+import signal
 import asyncio
+import contextlib
+import logging
 
-from userbot import build_chat_factory, Settings as UBSettings
-from chat_factory_adapter import ChatFactoryAdapter
-from regular_bot import build_application  # ваш файл regular_bot.py
+import metrics
+from config import load_settings
+from regular_bot import (  # ваш файл regular_bot.py
+    build_application,
+    close_jira_http,
+    on_shutdown,
+    on_startup,
+    pg_listener,
+    stage_rollup,
+    start_receiving,
+    stop_receiving,
+    store,
+)
 
-async def main():
-    # Настройки userbot из .env
-    ub_settings = UBSettings(
-        API_ID=int(os.environ["API_ID"]),
-        API_HASH=os.environ["API_HASH"],
-        USERBOT_SESSION=os.environ["USERBOT_SESSION"],
-        MANAGED_BOT_USERNAME=os.environ["MANAGED_BOT_USERNAME"],  # например "@my_ptb_bot"
+logger = logging.getLogger("runner")
+
+settings = load_settings()
+
+
+def _instrument_userbot(chat_factory_cls) -> None:
+    # задержки вызовов фабрики групп — в ra_userbot_call_seconds на /metrics
+    metrics.instrument_methods(
+        chat_factory_cls,
+        metrics.USERBOT_SECONDS,
+        names=("create_chat", "take_chat", "create_channel", "resolve_bot", "rename_chat"),
     )
 
-    # 1) строим фабрику Telethon
-    telethon_factory = await build_chat_factory(ub_settings)
 
-    # 2) адаптируем интерфейс под regular_bot.py
-    adapter = ChatFactoryAdapter(telethon_factory, ub_settings.MANAGED_BOT_USERNAME)
+async def _start_api() -> tuple:
+    # FastAPI и uvicorn импортируются только здесь: импорт regular_bot их не тянет
+    import uvicorn
+    from http_api import api
+
+    class _ApiServer(uvicorn.Server):
+        # сигналы ловит раннер и гасит всё по порядку — uvicorn свои обработчики не ставит
+        def install_signal_handlers(self) -> None:  # uvicorn < 0.29
+            pass
+
+        @contextlib.contextmanager
+        def capture_signals(self):  # uvicorn >= 0.29
+            yield
+
+    server = _ApiServer(uvicorn.Config(api, host=settings.API_HOST, port=settings.API_PORT, lifespan="off", log_level="info"))
+    task = asyncio.create_task(server.serve(), name="uvicorn")
+    while not server.started:
+        if task.done():
+            await task  # пробросит ошибку старта (например, занят порт)
+            raise RuntimeError("uvicorn завершился при старте")
+        await asyncio.sleep(0.05)
+    return server, task
 
-    # 3) собираем PTB-приложение, прокидывая фабрику ДО initialize()
-    app = build_application(chat_factory=adapter)
 
-    # 4) старт PTB v20-совместимый
-    await app.initialize()
-    await app.start()
-    await app.updater.start_polling()
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
 
+    telethon_factory = None
+    app = None
+    http_api = None
+    api_server = api_task = None
     try:
-        await asyncio.Event().wait()
+        # 1) общий пул Postgres
+        await store.init()
+
+        # 2) фабрика Telethon (если включён юзербот) и адаптер под regular_bot.py
+        adapter = None
+        if settings.USE_USERBOT:
+            # Telethon грузим, только если юзербот включён
+            from userbot import ChatFactory, build_chat_factory, Settings as UBSettings
+            from chat_factory_adapter import ChatFactoryAdapter
+
+            _instrument_userbot(ChatFactory)
+            ub_settings = UBSettings(
+                API_ID=settings.API_ID,
+                API_HASH=settings.API_HASH,
+                USERBOT_SESSION=settings.USERBOT_SESSION,
+                MANAGED_BOT_USERNAME=settings.MANAGED_BOT_USERNAME,
+                CHAT_POOL_SIZE=settings.CHAT_POOL_SIZE,
+                ENTITY_CACHE_PATH=settings.ENTITY_CACHE_PATH,
+                USERBOT_SESSIONS=settings.USERBOT_SESSIONS,
+            )
+            telethon_factory = await build_chat_factory(ub_settings, db=store.pool)
+            adapter = ChatFactoryAdapter(telethon_factory, ub_settings.MANAGED_BOT_USERNAME)
+
+        # 3) PTB-приложение, фабрика прокидывается ДО initialize()
+        app = build_application(chat_factory=adapter)
+        await app.initialize()
+        await app.start()
+        # подписку дашборда регистрируем до on_startup — он запускает pg_listener
+        import http_api
+        http_api.dashboard.attach(pg_listener, store.fetch_dashboard)
+        http_api.stage_rollup = stage_rollup
+        await on_startup(app)
+
+        # 4) HTTP API в том же event loop — использует тот же Bot и тот же пул
+        await http_api.start(app)
+        api_server, api_task = await _start_api()
+
+        # 5) только теперь начинаем принимать апдейты
+        await start_receiving(app)
+        logger.info("✅ Бот, API%s запущены", " и юзербот" if telethon_factory else "")
+
+        await stop.wait()
+        logger.info("⏹ Получен сигнал остановки, завершаем работу")
     finally:
-        await app.updater.stop()
-        await app.stop()
-        await telethon_factory.aclose()
+        # порядок обратный: сперва перестаём принимать новое, потом дорабатываем начатое
+        if app is not None and app.running:
+            await stop_receiving(app)
+        if api_server is not None:
+            http_api.close_streams()
+            api_server.should_exit = True
+            await asyncio.gather(api_task, return_exceptions=True)
+        if http_api is not None:
+            await http_api.stop()
+        if app is not None:
+            if app.running:
+                await on_shutdown(app)
+                await app.stop()
+            await app.shutdown()
+        if telethon_factory is not None:
+            await telethon_factory.aclose()
+        await close_jira_http()
+        await store.close()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=settings.LOG_LEVEL)
     asyncio.run(main())
@@ -1,13 +1,60 @@
 # chat_factory_adapter.py
+import asyncio
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Optional
+
+
+@dataclass
+class GroupResult:
+    title: str
+    chat_id: Optional[int] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
 class ChatFactoryAdapter:
     """
     Приводит вашу userbot-фабрику к интерфейсу, которого ждёт regular_bot.py:
-    ожидается метод: create_group_with_bot(title: str) -> int
+    ожидается метод: create_group_with_bot(title: str, *, timeout: Optional[float] = None) -> int
     """
     def __init__(self, telethon_factory, bot_username: str):
         self._factory = telethon_factory
         self._bot_username = bot_username
 
-    async def create_group_with_bot(self, title: str) -> int:
-        # делегируем в userbot.ChatFactory.create_chat(...)
-        return await self._factory.create_chat(title=title, bot_username=self._bot_username)
+    async def create_group_with_bot(self, title: str, *, timeout: Optional[float] = None) -> int:
+        # делегируем в userbot.ChatFactory.take_chat(...): из резерва, если он включён;
+        # timeout — сколько ждать FloodWait, дальше SchedulerBackoff
+        return await self._factory.take_chat(title=title, bot_username=self._bot_username, timeout=timeout)
+
+    async def create_groups_with_bot(self, titles: Iterable[str], *, concurrency: int = 4) -> AsyncIterator[GroupResult]:
+        """
+        Создаёт группы пачкой, не больше concurrency одновременно (темп и FloodWait
+        держит планировщик фабрики). Результаты отдаются по мере готовности — ранние
+        группы можно использовать, пока создаются остальные. Ошибка одной группы
+        приходит в её GroupResult.error и не прерывает остальные.
+        """
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(title: str) -> GroupResult:
+            async with sem:
+                try:
+                    return GroupResult(title, chat_id=await self.create_group_with_bot(title))
+                except Exception as e:
+                    return GroupResult(title, error=e)
+
+        tasks = [asyncio.create_task(one(t)) for t in titles]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            # потребитель бросил итерацию — не оставляем висящих созданий
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def backoff_seconds(self) -> float:
+        # сколько создание группы сейчас будет ждать FloodWait — чтобы вызывающий мог не ждать
+        return self._factory.creation_backoff()
@@ -0,0 +1,526 @@
+# cluster.py
+"""
+Несколько инстансов бота на одной базе (CLUSTER_MODE=1).
+
+- Лидер. Инстанс, взявший advisory lock LEADER_LOCK, один опрашивает getUpdates и кладёт
+  апдейты в таблицу inbound_updates с номером шарда (id пользователя % shards), в той же
+  транзакции сохраняет offset и шлёт NOTIFY inbound_updates. Новый лидер продолжает с
+  сохранённого offset, так что апдейты не теряются и не дублируются при смене лидера.
+- Шарды. Каждый инстанс держит session-level advisory lock'и (SHARD_NS, шард) на своё
+  соединение и обрабатывает только апдейты своих шардов: у пользователя один обработчик,
+  его апдейты идут строго по очереди. Черновик в user_data — только в памяти владельца:
+  после переезда шарда кнопки отправленной заявки собирают её из базы
+  (regular_bot.restore_draft), незаконченная анкета начинается заново.
+  Раз в heartbeat инстанс отмечается в cluster_members и доводит число своих шардов до
+  ceil(shards / живых инстансов): лишние отпускает (дождавшись своей очереди), свободные
+  забирает. Упал инстанс — Postgres снял его lock'и, шарды разбирают остальные.
+- Забор апдейтов — DELETE ... RETURNING с SKIP LOCKED: строку получает ровно один инстанс.
+- Инвалидация кэшей. publish(kind, key) копит ключи и шлёт их пачкой в NOTIFY ra_invalidate;
+  остальные инстансы вызывают обработчики, зарегистрированные on_invalidate(kind, fn).
+
+Вебхуки за балансировщиком сюда не входят: лидер — единственная точка приёма апдейтов.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import asyncpg
+from telegram import Update
+from telegram.error import TelegramError
+
+import metrics
+from pg_notify import PgListener
+
+logger = logging.getLogger(__name__)
+
+# ключи advisory lock'ов в форме (int4, int4): "RA" и номер
+SHARD_NS = 0x5241
+LEADER_LOCK = (0x5241 + 1, 0)
+# транзакционный: под ним инстансы по очереди создают схему (Store.init, _DDL модулей)
+SCHEMA_LOCK = (0x5241 + 2, 0)
+
+INBOUND_CHANNEL = "inbound_updates"
+INVALIDATE_CHANNEL = "ra_invalidate"
+# лимит payload NOTIFY — 8000 байт
+_NOTIFY_MAX = 7500
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS inbound_updates (
+  update_id   BIGINT PRIMARY KEY,
+  shard       INT NOT NULL,
+  payload     JSONB NOT NULL,
+  created_at  TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+CREATE INDEX IF NOT EXISTS inbound_updates_shard ON inbound_updates(shard, update_id);
+CREATE TABLE IF NOT EXISTS cluster_members (
+  instance_id TEXT PRIMARY KEY,
+  seen_at     TIMESTAMPTZ NOT NULL,
+  leader      BOOLEAN NOT NULL DEFAULT FALSE,
+  shards      INT[] NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS cluster_state (
+  key    TEXT PRIMARY KEY,
+  value  BIGINT NOT NULL
+);
+"""
+
+
+def default_instance_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def routing_key(raw: Dict[str, Any]) -> int:
+    """id пользователя апдейта; для апдейтов без пользователя — чат, в крайнем случае update_id."""
+    for key, obj in raw.items():
+        if isinstance(obj, dict):
+            user = obj.get("from") or obj.get("user")
+            if isinstance(user, dict) and "id" in user:
+                return int(user["id"])
+            chat = obj.get("chat")
+            if isinstance(chat, dict) and "id" in chat:
+                return int(chat["id"])
+    return int(raw.get("update_id", 0))
+
+
+def shard_of(raw: Dict[str, Any], shards: int) -> int:
+    return routing_key(raw) % shards
+
+
+class Cluster:
+    def __init__(
+        self,
+        dsn: str,
+        *,
+        listener: PgListener,
+        instance_id: str = "",
+        shards: int = 64,
+        heartbeat_sec: float = 5.0,
+        batch: int = 100,
+        per_shard_queue: int = 50,
+        poll_timeout: int = 30,
+    ):
+        self._dsn = dsn
+        self.instance_id = instance_id or default_instance_id()
+        self.shards = shards
+        self._heartbeat_sec = heartbeat_sec
+        self._batch = batch
+        self._per_shard_queue = per_shard_queue
+        self._poll_timeout = poll_timeout
+        self._app = None
+        self._con: Optional[asyncpg.Connection] = None     # lock'и, heartbeat, запись апдейтов лидером
+        self._con_lock = asyncio.Lock()
+        self._claim_con: Optional[asyncpg.Connection] = None
+        # забор апдейтов и отказ от шардов не пересекаются: забранное всегда попадает в живую очередь
+        self._claim_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self.leader = False
+        self.owned: Set[int] = set()
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # шарды, от которых отказываемся: очередь дорабатывается, lock ещё наш — чужим не отдан
+        self._draining: Set[int] = set()
+        self._releasing: Dict[int, asyncio.Task] = {}
+        self._closing = False
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._pending: Set[Tuple[str, str]] = set()
+        self._pending_event = asyncio.Event()
+        listener.add(INBOUND_CHANNEL, lambda _payload: self._wake.set())
+        listener.add(INVALIDATE_CHANNEL, self._on_invalidate)
+        listener.on_reconnect(self._wake.set)
+
+    # ---- инвалидация кэшей
+
+    def on_invalidate(self, kind: str, handler: Callable[[str], None]) -> None:
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind: str, key: Any) -> None:
+        """Не ждёт базы: ключи уходят пачкой из фоновой задачи."""
+        self._pending.add((kind, str(key)))
+        self._pending_event.set()
+
+    def _on_invalidate(self, payload: str) -> None:
+        msg = json.loads(payload)
+        if msg.get("from") == self.instance_id:
+            return
+        for kind, key in msg.get("items", ()):
+            for handler in self._handlers.get(kind, ()):
+                try:
+                    handler(key)
+                except Exception:
+                    logger.exception("Cluster: ошибка обработчика инвалидации %s", kind)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._pending_event.wait()
+            await asyncio.sleep(0.05)  # копим пачку
+            await self._flush()
+
+    async def _flush(self) -> None:
+        self._pending_event.clear()
+        items, self._pending = list(self._pending), set()
+        try:
+            for payload in self._chunks(items):
+                await self._execute("SELECT pg_notify($1, $2)", INVALIDATE_CHANNEL, payload)
+        except Exception as e:
+            logger.warning("Cluster: инвалидация не отправлена (%s ключей): %s", len(items), e)
+
+    def _chunks(self, items: List[Tuple[str, str]]):
+        head = len(json.dumps({"from": self.instance_id, "items": []}))
+        chunk: List[Tuple[str, str]] = []
+        size = head
+        for it in items:
+            n = len(json.dumps(it)) + 2  # запятая и пробел между элементами
+            if chunk and size + n > _NOTIFY_MAX:
+                yield json.dumps({"from": self.instance_id, "items": chunk})
+                chunk, size = [], head
+            chunk.append(it)
+            size += n
+        if chunk:
+            yield json.dumps({"from": self.instance_id, "items": chunk})
+
+    # ---- жизненный цикл
+
+    def start(self, app) -> None:
+        """Вместо app.updater.start_polling(): апдейты приходят через inbound_updates."""
+        if self._task is not None:
+            return
+        self._app = app
+        self._task = asyncio.create_task(self._run(), name="cluster")
+        self._consumer = asyncio.create_task(self._consume(), name="cluster-consumer")
+        self._flusher = asyncio.create_task(self._flush_loop(), name="cluster-invalidate")
+
+    async def aclose(self) -> None:
+        """
+        Порядок важен: перестаём забирать апдейты, дорабатываем очереди и только потом
+        закрываем соединение с lock'ами. Иначе шарды достанутся другому инстансу, пока мы
+        ещё обрабатываем старые апдейты тех же пользователей.
+        """
+        self._closing = True
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+            if self._pending:
+                await self._flush()
+        if self._consumer is not None:
+            # под _claim_lock: не обрываем забор посреди DELETE ... RETURNING
+            async with self._claim_lock:
+                self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+            self._consumer = None
+        poller = self._poller
+        self._set_leader(False)
+        if poller is not None:
+            await asyncio.gather(poller, return_exceptions=True)
+        # забранное из таблицы дорабатываем: второй раз его никто не получит
+        await asyncio.gather(*self._releasing.values(), return_exceptions=True)
+        for shard in list(self._workers):
+            await self._stop_worker(shard, drain=True)
+        try:
+            # остальные пересчитают доли сразу, не дожидаясь, пока запись устареет
+            await self._execute("DELETE FROM cluster_members WHERE instance_id = $1", self.instance_id)
+        except Exception:
+            pass
+        if self._task is not None:
+            # соединение закрывается в finally у _run — вместе с ним уходят lock'и
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._claim_con is not None and not self._claim_con.is_closed():
+            await self._claim_con.close()
+        self._claim_con = None
+
+    async def _execute(self, query: str, *args) -> Any:
+        async with self._con_lock:
+            if self._con is None or self._con.is_closed():
+                raise ConnectionError("нет соединения с Postgres")
+            return await self._con.fetch(query, *args)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self._con = await asyncpg.connect(self._dsn)
+                async with self._con.transaction():
+                    await self._con.execute("SELECT pg_advisory_xact_lock($1, $2)", *SCHEMA_LOCK)
+                    await self._con.execute(_DDL)
+                logger.info("Cluster: инстанс %s, шардов %s", self.instance_id, self.shards)
+                while True:
+                    await self._heartbeat()
+                    await asyncio.sleep(self._heartbeat_sec)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cluster: связь с Postgres потеряна (%s), lock'и сняты", e)
+            finally:
+                # lock'и жили на этом соединении — с ним ушли и лидерство, и шарды
+                await self._lose_all()
+                if self._con is not None and not self._con.is_closed():
+                    self._con.terminate()
+                self._con = None
+            await asyncio.sleep(self._heartbeat_sec)
+
+    async def _lose_all(self) -> None:
+        self._set_leader(False)
+        async with self._claim_lock:
+            lost, self.owned = self.owned, set()
+            self._draining |= lost
+        # уже забранное доработаем, новое по этим шардам больше не берём; lock'ов уже нет
+        for shard in lost:
+            self._start_release(shard, unlock=False)
+        self._report()
+
+    async def _heartbeat(self) -> None:
+        if self._closing:
+            # останавливаемся: шарды не берём, lock'и держим до закрытия соединения
+            return
+        stale = self._heartbeat_sec * 3
+        rows = await self._execute(
+            """
+            WITH me AS (
+              INSERT INTO cluster_members(instance_id, seen_at, leader, shards)
+              VALUES ($1, now(), $2, $3)
+              ON CONFLICT (instance_id) DO UPDATE SET seen_at = now(), leader = $2, shards = $3
+            ), gone AS (
+              DELETE FROM cluster_members WHERE seen_at < now() - make_interval(secs => $4)
+            )
+            SELECT count(*) + 1 AS live FROM cluster_members
+             WHERE instance_id <> $1 AND seen_at >= now() - make_interval(secs => $4)
+            """,
+            self.instance_id, self.leader, sorted(self.owned), stale,
+        )
+        live = rows[0]["live"]
+        if not self.leader:
+            got = await self._execute("SELECT pg_try_advisory_lock($1, $2) AS ok", *LEADER_LOCK)
+            if got[0]["ok"]:
+                self._set_leader(True)
+        await self._rebalance(math.ceil(self.shards / live))
+
+    async def _rebalance(self, target: int) -> None:
+        if len(self.owned) > target:
+            # отпускаем с конца; очередь дорабатывается в фоне, heartbeat тем временем идёт
+            async with self._claim_lock:
+                extra = sorted(self.owned)[target:]
+                self.owned.difference_update(extra)
+                self._draining.update(extra)
+            for shard in extra:
+                self._start_release(shard, unlock=True)
+            self._report()
+            return
+        need = target - len(self.owned)
+        if need <= 0:
+            return
+        held = await self._execute(
+            """
+            SELECT objid::int AS shard FROM pg_locks
+             WHERE locktype = 'advisory' AND classid = $1 AND objsubid = 2 AND granted
+               AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+            """,
+            SHARD_NS,
+        )
+        busy = {r["shard"] for r in held} | self._draining
+        # начинаем с разных мест, чтобы инстансы не толкались за одни и те же шарды
+        start = zlib.crc32(self.instance_id.encode()) % self.shards
+        candidates = [(start + i) % self.shards for i in range(self.shards)]
+        taken = []
+        for shard in candidates:
+            if need <= 0:
+                break
+            if shard in busy or shard in self.owned:
+                continue
+            got = await self._execute("SELECT pg_try_advisory_lock($1, $2) AS ok", SHARD_NS, shard)
+            if got[0]["ok"]:
+                self.owned.add(shard)
+                taken.append(shard)
+                need -= 1
+        if taken:
+            logger.info("Cluster: взяты шарды %s (всего %s)", taken, len(self.owned))
+            self._report()
+            self._wake.set()
+
+    def _set_leader(self, leader: bool) -> None:
+        if leader == self.leader:
+            return
+        self.leader = leader
+        if leader:
+            logger.info("Cluster: %s стал лидером, опрашиваем getUpdates", self.instance_id)
+            self._poller = asyncio.create_task(self._poll(), name="cluster-poller")
+        else:
+            if self._poller is not None:
+                logger.warning("Cluster: %s больше не лидер", self.instance_id)
+                self._poller.cancel()
+                self._poller = None
+        self._report()
+
+    def _report(self) -> None:
+        metrics.CLUSTER_LEADER.set(1 if self.leader else 0)
+        metrics.CLUSTER_SHARDS.set(len(self.owned))
+
+    # ---- лидер: getUpdates → inbound_updates
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                rows = await self._execute("SELECT value FROM cluster_state WHERE key = 'telegram_offset'")
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cluster: не удалось прочитать offset: %s", e)
+                await asyncio.sleep(1.0)
+        offset = rows[0]["value"] + 1 if rows else None
+        bot = self._app.bot
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=self._poll_timeout, allowed_updates=Update.ALL_TYPES,
+                )
+            except TelegramError as e:
+                # в том числе Conflict: прежний лидер ещё держит long polling
+                logger.warning("Cluster: getUpdates: %s", e)
+                await asyncio.sleep(1.0)
+                continue
+            if not updates:
+                continue
+            rows = []
+            for u in updates:
+                raw = u.to_dict()
+                rows.append((u.update_id, shard_of(raw, self.shards), json.dumps(raw, ensure_ascii=False)))
+            while True:
+                try:
+                    await self._enqueue(rows)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # offset не двигаем: те же апдейты запишем после переподключения
+                    logger.warning("Cluster: не удалось записать %s апдейтов: %s", len(rows), e)
+                    await asyncio.sleep(1.0)
+            offset = rows[-1][0] + 1
+
+    async def _enqueue(self, rows: List[Tuple[int, int, str]]) -> None:
+        async with self._con_lock:
+            con = self._con
+            if con is None or con.is_closed():
+                raise ConnectionError("нет соединения с Postgres")
+            async with con.transaction():
+                await con.executemany(
+                    "INSERT INTO inbound_updates(update_id, shard, payload) VALUES ($1, $2, $3::jsonb) ON CONFLICT DO NOTHING",
+                    rows,
+                )
+                await con.execute(
+                    """
+                    INSERT INTO cluster_state(key, value) VALUES ('telegram_offset', $1)
+                    ON CONFLICT (key) DO UPDATE SET value = GREATEST(cluster_state.value, EXCLUDED.value)
+                    """,
+                    rows[-1][0],
+                )
+                await con.execute("SELECT pg_notify($1, '')", INBOUND_CHANNEL)
+
+    # ---- все: inbound_updates своих шардов → app.process_update
+
+    async def _consume(self) -> None:
+        while True:
+            self._wake.clear()
+            open_shards = [s for s in self.owned if self._queue(s).qsize() < self._per_shard_queue]
+            claimed = 0
+            if open_shards:
+                try:
+                    async with self._claim_lock:
+                        claimed = await self._claim([s for s in open_shards if s in self.owned])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Cluster: не удалось забрать апдейты: %s", e)
+                    if self._claim_con is not None:
+                        self._claim_con.terminate()
+                    self._claim_con = None
+                    await asyncio.sleep(1.0)
+                    continue
+            if claimed >= self._batch:
+                continue
+            try:
+                # NOTIFY будит сразу; таймаут — на случай пропущенного уведомления
+                await asyncio.wait_for(self._wake.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self, shards: List[int]) -> int:
+        if self._claim_con is None or self._claim_con.is_closed():
+            self._claim_con = await asyncpg.connect(self._dsn)
+        rows = await self._claim_con.fetch(
+            """
+            DELETE FROM inbound_updates WHERE update_id IN (
+              SELECT update_id FROM inbound_updates
+               WHERE shard = ANY($1::int[])
+               ORDER BY update_id
+               LIMIT $2
+               FOR UPDATE SKIP LOCKED
+            )
+            RETURNING update_id, shard, payload::text AS payload,
+                      extract(epoch FROM clock_timestamp() - created_at) AS lag
+            """,
+            shards, self._batch,
+        )
+        for r in sorted(rows, key=lambda r: r["update_id"]):
+            metrics.INBOUND_LAG.observe(float(r["lag"]))
+            self._queue(r["shard"]).put_nowait(r["payload"])
+            if r["shard"] not in self._workers:
+                self._workers[r["shard"]] = asyncio.create_task(self._work(r["shard"]), name=f"cluster-shard-{r['shard']}")
+        return len(rows)
+
+    def _queue(self, shard: int) -> asyncio.Queue:
+        q = self._queues.get(shard)
+        if q is None:
+            q = self._queues[shard] = asyncio.Queue()
+        return q
+
+    async def _work(self, shard: int) -> None:
+        q = self._queue(shard)
+        app = self._app
+        while True:
+            payload = await q.get()
+            try:
+                await app.process_update(Update.de_json(json.loads(payload), app.bot))
+            except Exception:
+                logger.exception("Cluster: ошибка обработки апдейта шарда %s", shard)
+            finally:
+                q.task_done()
+
+    async def _stop_worker(self, shard: int, *, drain: bool) -> None:
+        q = self._queues.get(shard)
+        if drain and q is not None:
+            await q.join()
+        task = self._workers.pop(shard, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self._queues.pop(shard, None)
+
+    def _start_release(self, shard: int, *, unlock: bool) -> None:
+        if shard not in self._releasing:
+            self._releasing[shard] = asyncio.create_task(self._release(shard, unlock), name=f"cluster-release-{shard}")
+
+    async def _release(self, shard: int, unlock: bool) -> None:
+        """Дорабатывает очередь шарда, затем отпускает lock: новый владелец не обгонит старые апдейты."""
+        try:
+            await self._stop_worker(shard, drain=True)
+            if unlock:
+                try:
+                    await self._execute("SELECT pg_advisory_unlock($1, $2)", SHARD_NS, shard)
+                except Exception as e:
+                    # соединение потеряно — lock снят вместе с ним
+                    logger.warning("Cluster: не удалось отпустить шард %s: %s", shard, e)
+        finally:
+            # из _draining — только после unlock: иначе _rebalance взял бы lock повторно (он реентерабелен)
+            self._draining.discard(shard)
+            self._releasing.pop(shard, None)
@@ -1,26 +1,176 @@
-# config.py (при первом запуске)
+# config.py
+"""
+Настройки бота, API и юзербота: одна типизированная модель, читается и проверяется один раз.
+
+Источник — переменные окружения поверх файла .env (сам .env в os.environ не копируется).
+Пустая переменная равна отсутствующей: действует значение по умолчанию.
+"""
 from __future__ import annotations
 import os
-from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List, Optional
+
+from dotenv import dotenv_values
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+
 
 class Settings(BaseModel):
-    BOT_TOKEN: str = Field(...)
-    MANAGED_BOT_USERNAME: str = Field(...)
-    API_ID: int = Field(...)
-    API_HASH: str = Field(...)
-    USERBOT_SESSION: str = Field("") 
-
-def load_settings() -> Settings:
-    raw = {
-        "BOT_TOKEN": os.getenv("BOT_TOKEN", ""),
-        "MANAGED_BOT_USERNAME": os.getenv("MANAGED_BOT_USERNAME", ""),
-        "API_ID": os.getenv("API_ID", ""),
-        "API_HASH": os.getenv("API_HASH", ""),
-        "USERBOT_SESSION": os.getenv("USERBOT_SESSION", ""),
-    }
-    try:
-        if raw.get("API_ID"):
-            raw["API_ID"] = int(raw["API_ID"])
-        return Settings(**raw)
-    except (ValidationError, ValueError) as e:
-        raise SystemExit(f"Config error: {e}")
+    # --- Telegram / Postgres
+    BOT_TOKEN: str = Field(..., min_length=1)
+    DATABASE_URL: str = Field(..., min_length=1)
+    LOG_LEVEL: str = "INFO"
+
+    # --- HTTP API (app.py)
+    API_HOST: str = "0.0.0.0"
+    API_PORT: int = Field(8000, ge=1, le=65535)
+    # админ-эндпоинты /admin/*: токен в заголовке X-Admin-Token; пусто — выключены
+    ADMIN_TOKEN: str = ""
+    # блокировка event loop'а дольше этого (мс) попадает в отчёт /admin/loop со стеком
+    LOOP_LAG_THRESHOLD_MS: float = Field(100.0, gt=0)
+
+    # --- Диспетчерские
+    # чат для диспетчера (куда шлём при «Требуется эвакуатор»)
+    DISPATCH_CHAT_ID: int = 0
+    # региональные диспетчерские: JSON-список правил, см. regular_bot.parse_dispatch_routes
+    DISPATCH_ROUTES: str = ""
+
+    # --- Уведомления из WebApp: размер очереди, число параллельных отправок, максимум событий в батче
+    WEBAPP_QUEUE_SIZE: int = Field(10000, ge=0)
+    WEBAPP_SEND_CONCURRENCY: int = Field(8, ge=1)
+    WEBAPP_BATCH_MAX: int = Field(500, ge=1)
+
+    # --- Реестр парка: CSV (plate,kind[,brand,active]) и/или таблица fleet_vehicles, период обновления
+    FLEET_CSV_PATH: str = ""
+    FLEET_FROM_DB: bool = False
+    FLEET_REFRESH_SEC: float = Field(300.0, gt=0)
+
+    # --- Диагностика
+    # апдейты дольше этого (мс) пишутся в лог ra.slow_update с разбором по участкам; 0 — выключено
+    TRACE_SLOW_MS: float = Field(0.0, ge=0)
+    # запись обезличенных апдейтов для scripts/replay_updates.py (gzip JSONL); пусто — не пишем
+    UPDATE_CAPTURE_PATH: str = ""
+    UPDATE_CAPTURE_SALT: str = ""
+
+    # --- Дашборд диспетчеров (SSE /api/dashboard/stream); без токена эндпоинт выключен
+    DASHBOARD_TOKEN: str = ""
+    DASHBOARD_WINDOW_HOURS: float = Field(72.0, gt=0)  # старше — не показываем, даже если не закрыта
+    DASHBOARD_CLIENT_QUEUE: int = Field(1000, ge=10)   # столько кадров ждёт медленного клиента
+
+    # --- Аналитика длительности этапов (analytics.py); 0 — фоновый пересчёт выключен
+    ANALYTICS_INTERVAL_SEC: float = Field(60.0, ge=0)
+    ANALYTICS_SETTLE_SEC: float = Field(30.0, ge=0)
+
+    # --- Несколько инстансов (cluster.py): лидер опрашивает Telegram, апдейты шардируются по пользователю
+    CLUSTER_MODE: bool = False
+    CLUSTER_INSTANCE_ID: str = ""  # по умолчанию <hostname>-<pid>
+    CLUSTER_SHARDS: int = Field(64, ge=1, le=4096)  # менять только при остановленном кластере
+    CLUSTER_HEARTBEAT_SEC: float = Field(5.0, gt=0)
+
+    # --- Группа инцидента: не создаём, если юзербот в FloodWait дольше этого (сек)
+    INCIDENT_CHAT_MAX_WAIT_SEC: float = Field(20.0, ge=0)
+    # пауза (сек) после последнего нажатия статуса, после которой перерисовываем клавиатуру
+    STATUS_EDIT_DEBOUNCE_SEC: float = Field(0.8, ge=0)
+    # инвайт-ссылки диспетчерских: срок жизни и за сколько до истечения перевыпускать (сек)
+    INVITE_LINK_TTL_SEC: int = Field(86400, ge=0)
+    INVITE_LINK_REFRESH_SEC: int = Field(600, ge=0)
+
+    # --- Jira
+    JIRA_BASE_URL: str = ""
+    JIRA_EMAIL: str = ""
+    JIRA_API_TOKEN: str = ""
+    JIRA_PROJECT_KEY: str = ""  # ключ проекта (например, RA)
+    JIRA_ISSUE_TYPE_MAIN_ID: str = ""
+    JIRA_ISSUE_TYPE_MAIN: str = "Task"
+    JIRA_SUBTASK_TYPE_ID: str = ""            # например "10000"
+    JIRA_SUBTASK_TYPE: str = "Sub-task"       # или "Подзадача" в русской локали
+    JIRA_LINK_TYPE: str = "Relates"
+
+    # кастомные поля: id поля и его вид ("select" | "text" | "adf" | "date" | "time" | "datetime")
+    JIRA_CF_INCIDENT_TYPE: Optional[str] = None
+    JIRA_CF_INCIDENT_TYPE_KIND: str = "select"
+    JIRA_CF_BRAND: Optional[str] = None
+    JIRA_CF_BRAND_KIND: str = "select"
+    JIRA_CF_PLATE_VATS: Optional[str] = None
+    JIRA_CF_PLATE_VATS_KIND: str = "text"
+    JIRA_CF_PLATE_REF: Optional[str] = None
+    JIRA_CF_PLATE_REF_KIND: str = "text"
+    JIRA_CF_LOCATION: Optional[str] = None
+    JIRA_CF_LOCATION_KIND: str = "text"
+    JIRA_CF_PROBLEM_DESC: Optional[str] = None
+    JIRA_CF_PROBLEM_DESC_KIND: str = "text"
+    JIRA_CF_NOTES: Optional[str] = None
+    JIRA_CF_NOTES_KIND: str = "text"
+    JIRA_CF_INCIDENT_DATE: Optional[str] = None
+    JIRA_CF_INCIDENT_DATE_KIND: str = "date"   # "date"|"text"
+    JIRA_CF_INCIDENT_TIME: Optional[str] = None
+    JIRA_CF_INCIDENT_TIME_KIND: str = "time"   # "time"|"datetime"|"text"
+    JIRA_CF_FLAG_REQUIRE_MECH: Optional[str] = None
+    JIRA_CF_FLAG_REQUIRE_MECH_KIND: str = "select"
+    JIRA_CF_FLAG_PROBLEM_SOLVED: Optional[str] = None
+    JIRA_CF_FLAG_PROBLEM_SOLVED_KIND: str = "select"
+    JIRA_CF_FLAG_REQUIRE_RA: Optional[str] = None
+    JIRA_CF_FLAG_REQUIRE_RA_KIND: str = "select"
+
+    JIRA_OPT_YES: str = "Да"
+    JIRA_OPT_NO: str = "Нет"
+    # подписи select для наших кодов
+    JIRA_OPT_INCIDENT_TYPE__DTP: str = "ДТП"
+    JIRA_OPT_INCIDENT_TYPE__BREAK: str = "Поломка"
+    JIRA_OPT_BRAND__KIA_CEED: str = "Kia Ceed"
+    JIRA_OPT_BRAND__SITRAK: str = "Sitrak"
+    # маппинг без перезапуска (jira_mapping.py): JSON-файл и/или таблица jira_mapping поверх значений выше
+    JIRA_MAPPING_PATH: str = ""
+    JIRA_MAPPING_FROM_DB: bool = False
+    JIRA_MAPPING_POLL_SEC: float = Field(30.0, gt=0)
+
+    # --- Юзербот (app.py, USE_USERBOT=1)
+    USE_USERBOT: bool = False
+    MANAGED_BOT_USERNAME: str = ""  # например "@my_ptb_bot"
+    API_ID: Optional[int] = None
+    API_HASH: str = ""
+    USERBOT_SESSION: str = ""
+    USERBOT_SESSIONS: List[str] = Field(default_factory=list)  # через запятую: несколько аккаунтов
+    CHAT_POOL_SIZE: int = Field(0, ge=0)
+    ENTITY_CACHE_PATH: str = ""
+
+    @field_validator("JIRA_BASE_URL")
+    @classmethod
+    def _strip_slash(cls, v: str) -> str:
+        return v.rstrip("/")
+
+    @field_validator("USERBOT_SESSIONS", mode="before")
+    @classmethod
+    def _split_sessions(cls, v):
+        if isinstance(v, str):
+            return [x.strip() for x in v.split(",") if x.strip()]
+        return v
+
+    @model_validator(mode="after")
+    def _userbot_complete(self) -> "Settings":
+        if self.USE_USERBOT:
+            missing = [k for k in ("MANAGED_BOT_USERNAME", "API_ID", "API_HASH") if not getattr(self, k)]
+            if not (self.USERBOT_SESSION or self.USERBOT_SESSIONS):
+                missing.append("USERBOT_SESSION")
+            if missing:
+                raise ValueError(f"USE_USERBOT=1, но не заданы: {', '.join(missing)}")
+        return self
+
+
+# .env рядом с модулями бота, как искал load_dotenv() раньше
+_ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+_settings: Optional[Settings] = None
+
+
+def load_settings(env_file: Optional[str] = _ENV_FILE) -> Settings:
+    """Читает и проверяет настройки при первом вызове; дальше возвращает тот же объект."""
+    global _settings
+    if _settings is None:
+        raw: Dict[str, str] = {}
+        if env_file and os.path.exists(env_file):
+            raw.update({k: v for k, v in dotenv_values(env_file).items() if v is not None})
+        raw.update(os.environ)
+        data = {k: v for k, v in raw.items() if k in Settings.model_fields and v.strip() != ""}
+        try:
+            _settings = Settings(**data)
+        except ValidationError as e:
+            raise SystemExit(f"Config error: {e}")
+    return _settings
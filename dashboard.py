@@ -0,0 +1,192 @@
+# dashboard.py
+"""
+Живая лента открытых заявок для дашбордов диспетчеров (SSE, см. /api/dashboard/stream в http_api.py).
+
+Источник — NOTIFY ticket_dashboard: триггеры в Store.init шлют полную строку заявки
+(ticket_dashboard_row) при отметке статуса, закрытии и сохранении ключей Jira.
+
+DashboardFeed один раз читает снимок открытых заявок и дальше держит его в памяти по
+уведомлениям. Новый клиент получает снимок из памяти (событие snapshot), затем только
+изменения: ticket — заявка появилась или изменилась, closed — убрать с доски. Сколько бы
+дашбордов ни было подключено, таблицу tickets никто из них не опрашивает.
+
+Уведомления за время обрыва LISTEN потеряны — после переподключения снимок перечитывается
+и рассылается всем заново. Клиент, который не успевает читать, отключается: EventSource
+переподключится сам и начнёт с нового снимка.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+import metrics
+from pg_notify import PgListener
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "ticket_dashboard"
+
+FetchSnapshot = Callable[[datetime], Awaitable[List[Dict[str, Any]]]]
+
+
+def _frame(event: str, data: Any, seq: int) -> str:
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class DashboardFeed:
+    def __init__(self, *, window_hours: float = 72.0, client_queue: int = 1000, heartbeat_sec: float = 15.0):
+        self._window = timedelta(hours=window_hours)
+        self._client_queue = client_queue
+        self._heartbeat_sec = heartbeat_sec
+        self._fetch: Optional[FetchSnapshot] = None
+        self._tickets: Dict[str, Dict[str, Any]] = {}
+        self._clients: Set[asyncio.Queue] = set()
+        self._loaded = False
+        self._loading: Optional[asyncio.Task] = None
+        # уведомления, пришедшие во время чтения снимка: применяются поверх него по порядку
+        self._buffer: Optional[List[Dict[str, Any]]] = None
+        self.seq = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._fetch is not None
+
+    @property
+    def clients(self) -> int:
+        return len(self._clients)
+
+    def attach(self, listener: PgListener, fetch_snapshot: FetchSnapshot) -> None:
+        """Подписка на NOTIFY; вызывать до listener.start()."""
+        self._fetch = fetch_snapshot
+        listener.add(CHANNEL, self._on_notify)
+        listener.on_reconnect(self._on_reconnect)
+
+    async def ready(self) -> None:
+        """Снимок в памяти (первый вызов читает его из базы); ошибка базы пробрасывается."""
+        if self._loaded:
+            return
+        if self._loading is None:
+            self._loading = asyncio.create_task(self._load(), name="dashboard-snapshot")
+        await asyncio.shield(self._loading)
+
+    def close(self) -> None:
+        """Завершает все потоки: иначе uvicorn при остановке ждёт их вечно."""
+        for q in list(self._clients):
+            self._disconnect(q)
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Кадры SSE для одного клиента; перед вызовом — await ready()."""
+        q: asyncio.Queue = asyncio.Queue(self._client_queue)
+        self._clients.add(q)
+        metrics.DASHBOARD_CLIENTS.set(len(self._clients))
+        # снимок и подписка без await между ними: ни одно изменение не потеряется и не задвоится
+        first = self._snapshot_frame()
+        try:
+            yield first
+            while True:
+                try:
+                    frame = await asyncio.wait_for(q.get(), self._heartbeat_sec)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"  # прокси не закрывают «молчащее» соединение
+                    continue
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self._clients.discard(q)
+            metrics.DASHBOARD_CLIENTS.set(len(self._clients))
+
+    # ---- состояние
+
+    async def _load(self) -> None:
+        self._buffer = []
+        try:
+            rows = await self._fetch(datetime.now(timezone.utc) - self._window)  # type: ignore[misc]
+            self._tickets = {}
+            for row in rows:
+                self._apply(row, broadcast=False)
+            for row in self._buffer:
+                self._apply(row, broadcast=False)
+            self._loaded = True
+            logger.info("Дашборд: снимок — %s открытых заявок", len(self._tickets))
+        finally:
+            self._buffer = None
+            self._loading = None
+
+    def _on_notify(self, payload: str) -> None:
+        try:
+            row = json.loads(payload)
+        except ValueError:
+            logger.warning("Дашборд: битое уведомление %r", payload[:200])
+            return
+        if self._buffer is not None:
+            self._buffer.append(row)
+        elif self._loaded:
+            self._apply(row, broadcast=True)
+
+    def _on_reconnect(self) -> None:
+        if not self._loaded:
+            return
+        self._loaded = False
+        if not self._clients:
+            self._tickets = {}  # перечитаем при первом подключении
+            return
+        asyncio.create_task(self._resync(), name="dashboard-resync")
+
+    async def _resync(self) -> None:
+        try:
+            await self.ready()
+        except Exception as e:
+            # снимок не перечитали — отключаем клиентов: переподключившись, они повторят попытку
+            logger.warning("Дашборд: не удалось перечитать снимок: %s", e)
+            self.close()
+            return
+        self._broadcast(lambda seq: self._snapshot_frame(seq))
+
+    def _visible(self, row: Dict[str, Any]) -> bool:
+        # на доске — отправленные заявки (ключ Jira или хотя бы один статус) за окно window_hours
+        if row.get("closed_at") or not (row.get("jira_main") or row.get("status")):
+            return False
+        try:
+            created = datetime.fromisoformat(row["created_at"])
+        except (KeyError, TypeError, ValueError):
+            return True
+        return created >= datetime.now(timezone.utc) - self._window
+
+    def _apply(self, row: Dict[str, Any], *, broadcast: bool) -> None:
+        ticket_id = row.get("id")
+        if not ticket_id:
+            return
+        if self._visible(row):
+            self._tickets[ticket_id] = row
+            if broadcast:
+                self._broadcast(lambda seq: _frame("ticket", row, seq))
+        elif self._tickets.pop(ticket_id, None) is not None and broadcast:
+            self._broadcast(lambda seq: _frame("closed", {"id": ticket_id}, seq))
+
+    def _snapshot_frame(self, seq: Optional[int] = None) -> str:
+        tickets = sorted(self._tickets.values(), key=lambda r: r.get("created_at") or "")
+        return _frame("snapshot", {"tickets": tickets}, self.seq if seq is None else seq)
+
+    # ---- рассылка
+
+    def _broadcast(self, build: Callable[[int], str]) -> None:
+        self.seq += 1
+        if not self._clients:
+            return
+        frame = build(self.seq)  # кадр собирается один раз на всех клиентов
+        for q in list(self._clients):
+            try:
+                q.put_nowait(frame)
+            except asyncio.QueueFull:
+                logger.info("Дашборд: клиент не успевает читать — отключаем")
+                self._disconnect(q)
+
+    def _disconnect(self, q: asyncio.Queue) -> None:
+        self._clients.discard(q)
+        while not q.empty():
+            q.get_nowait()
+        q.put_nowait(None)
+        metrics.DASHBOARD_CLIENTS.set(len(self._clients))
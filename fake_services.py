@@ -0,0 +1,228 @@
+# fake_services.py
+"""
+In-memory замены внешних сервисов regular_bot.py для нагрузочных прогонов без сети:
+
+- FakeBotRequest — BaseRequest для PTB: отвечает на вызовы Bot API правдоподобными
+  объектами (Message, True), с настраиваемой задержкой; считает вызовы по методам;
+- MemoryStore — тот же интерфейс, что у Store, данные в словарях;
+- jira_transport() — httpx.MockTransport, изображающий Jira REST API v3
+  (создание задач/сабтасков, правка полей, связи, метаданные).
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import random
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1000001, "is_bot": True, "first_name": "RA", "username": "ra_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class _Latency:
+    def __init__(self, latency: float, jitter: float, seed: Optional[int]):
+        self._latency = latency
+        self._jitter = jitter
+        self._rng = random.Random(seed)
+
+    async def sleep(self) -> None:
+        if self._latency or self._jitter:
+            await asyncio.sleep(max(0.0, self._latency + self._rng.uniform(-self._jitter, self._jitter)))
+
+
+# =========================
+# Bot API
+# =========================
+
+class FakeBotRequest(BaseRequest):
+    """latency/jitter — задержка ответа Bot API в секундах."""
+
+    def __init__(self, *, latency: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None):
+        self._delay = _Latency(latency, jitter, seed)
+        self._message_ids = itertools.count(1)
+        self.calls: Dict[str, int] = {}
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data is not None else {}
+        await self._delay.sleep()
+        result = self._result(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _result(self, api_method: str, params: Dict[str, Any]) -> Any:
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            if "inline_message_id" in params:
+                return True
+            return self._message(params)
+        if api_method == "createChatInviteLink":
+            return {"invite_link": f"https://t.me/+fake{next(self._message_ids)}", "creator": BOT_USER,
+                    "creates_join_request": False, "is_primary": False, "is_revoked": False}
+        return True
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id", 0))
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(datetime.now(timezone.utc).timestamp()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if "reply_markup" in params:
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+
+# =========================
+# Store
+# =========================
+
+class MemoryStore:
+    """Store без Postgres: тот же набор методов, строки — в словарях. db_latency — имитация round-trip."""
+
+    def __init__(self, *, db_latency: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None):
+        self._delay = _Latency(db_latency, jitter, seed)
+        self.pool = None
+        self.tickets: Dict[str, Dict[str, Any]] = {}
+        self.status_done: Dict[Tuple[str, str], datetime] = {}
+        self.status_history: List[Tuple[str, str, datetime]] = []
+        self.input_history: List[Tuple[str, str, Optional[str], datetime]] = []
+        self.dispatch_deliveries: List[tuple] = []
+        self.invite_links: Dict[int, Tuple[str, Optional[datetime]]] = {}
+
+    async def init(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def create_ticket(self, t) -> None:
+        await self._delay.sleep()
+        row = asdict(t)
+        row.pop("status_done_at", None)
+        self.tickets[t.id] = row
+
+    async def save_field(self, ticket_id: str, field: str, value: Any) -> None:
+        await self._delay.sleep()
+        if ticket_id in self.tickets:
+            self.tickets[ticket_id][field] = value
+
+    async def set_status_done(self, ticket_id: str, key: str, ts: datetime) -> None:
+        await self._delay.sleep()
+        self.status_done.setdefault((ticket_id, key), ts)
+        self.status_history.append((ticket_id, key, ts))
+
+    async def close_ticket(self, ticket_id: str, closed_ts: datetime) -> None:
+        await self.save_field(ticket_id, "closed_at", closed_ts)
+
+    async def fetch_ticket(self, ticket_id: str) -> Optional[Tuple[Dict[str, Any], Dict[str, datetime]]]:
+        await self._delay.sleep()
+        row = self.tickets.get(ticket_id)
+        if row is None:
+            return None
+        # как из Postgres: created_at — datetime, а не строка из asdict
+        row = {**row, "created_at": datetime.fromisoformat(row["created_at"])}
+        return row, {k: ts for (tid, k), ts in self.status_done.items() if tid == ticket_id}
+
+    async def log_input(self, ticket_id: str, field_key: str, value_text: Optional[str], ts: datetime) -> None:
+        await self._delay.sleep()
+        self.input_history.append((ticket_id, field_key, value_text, ts))
+
+    async def log_dispatch_deliveries(self, rows: List[tuple]) -> None:
+        if rows:
+            await self._delay.sleep()
+            self.dispatch_deliveries.extend(rows)
+
+    async def fetch_fleet_changes(self, since: Optional[datetime]) -> List[tuple]:
+        return []
+
+    async def fetch_jira_mapping(self) -> Optional[Tuple[Dict[str, Any], datetime]]:
+        return None
+
+    async def get_invite_link(self, chat_id: int) -> Optional[Tuple[str, Optional[datetime]]]:
+        await self._delay.sleep()
+        return self.invite_links.get(chat_id)
+
+    async def save_invite_link(
+        self, chat_id: int, link: str, expire_at: Optional[datetime], ts: datetime, *, stale_before: datetime
+    ) -> Tuple[str, Optional[datetime]]:
+        await self._delay.sleep()
+        cur = self.invite_links.get(chat_id)
+        if cur is None or (cur[1] is not None and cur[1] <= stale_before):
+            self.invite_links[chat_id] = cur = (link, expire_at)
+        return cur
+
+    async def delete_invite_link(self, chat_id: int, link: Optional[str] = None) -> None:
+        cur = self.invite_links.get(chat_id)
+        if cur is not None and (link is None or cur[0] == link):
+            del self.invite_links[chat_id]
+
+
+# =========================
+# Jira
+# =========================
+
+def jira_transport(
+    *, latency: float = 0.0, jitter: float = 0.0, project_key: str = "RA", seed: Optional[int] = None,
+    calls: Optional[Dict[str, int]] = None,
+) -> httpx.MockTransport:
+    """
+    MockTransport для jira_http(): POST issue → 201 с новым ключом, PUT issue → 204,
+    issueLink/remotelink → 201, GET issue/issuetype/createmeta — минимальные ответы.
+    calls (если передан) заполняется счётчиками "<METHOD> <ресурс>".
+    """
+    delay = _Latency(latency, jitter, seed)
+    seq = itertools.count(1)
+    counts = calls if calls is not None else {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await delay.sleep()
+        path = request.url.path.split("/rest/api/3/", 1)[-1]
+        resource = path.split("/", 1)[0] if not path.endswith("remotelink") else "remotelink"
+        key = f"{request.method} {resource}"
+        counts[key] = counts.get(key, 0) + 1
+        if request.method == "POST" and path == "issue":
+            n = next(seq)
+            return httpx.Response(201, json={"id": str(10000 + n), "key": f"{project_key}-{n}"})
+        if request.method == "PUT" and path.startswith("issue/"):
+            return httpx.Response(204)
+        if request.method == "POST" and (path == "issueLink" or path.endswith("/remotelink")):
+            return httpx.Response(201, json={})
+        if request.method == "GET" and path == "issuetype":
+            return httpx.Response(200, json=[{"id": "10001", "name": "Task", "subtask": False},
+                                             {"id": "10003", "name": "Sub-task", "subtask": True}])
+        if request.method == "GET" and path == "issue/createmeta":
+            return httpx.Response(200, json={"projects": [{"key": project_key, "issuetypes": [{"id": "10003", "fields": {}}]}]})
+        if request.method == "GET" and path.startswith("issue/"):
+            issue_key = path.split("/", 1)[1]
+            return httpx.Response(200, json={"id": "10000", "key": issue_key, "fields": {"project": {"key": project_key}}})
+        return httpx.Response(404, json={"errorMessages": [f"fake jira: {request.method} {path} не поддерживается"]})
+
+    return httpx.MockTransport(handler)
@@ -0,0 +1,220 @@
+# fake_telethon.py
+"""
+In-memory замена TelegramClient для прогонов userbot.py / chat_factory_adapter.py без живого аккаунта.
+
+Поддерживает то, чем пользуется ChatFactory: channels.CreateChannel / InviteToChannel /
+EditAdmin / EditTitle, Ping, get_me / get_input_entity / get_entity и семантику
+utils.get_peer_id (возвращаются настоящие types.Channel). Задержка настраивается,
+FloodWait и RPC-ошибки внедряются по правилам.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from telethon import errors, types, utils
+
+from request_scheduler import RequestScheduler
+
+
+@dataclass
+class FaultRule:
+    """Каждый every-й вызов семейства (или с вероятностью rate) падает с make_error(request)."""
+    make_error: Callable[[Any], BaseException]
+    every: int = 0
+    rate: float = 0.0
+    times: Optional[int] = None  # сколько раз сработать (None — без ограничения)
+    _calls: int = field(default=0, repr=False)
+
+    def fire(self, rng: random.Random) -> bool:
+        if self.times is not None and self.times <= 0:
+            return False
+        self._calls += 1
+        hit = (self.every and self._calls % self.every == 0) or (self.rate and rng.random() < self.rate)
+        if hit and self.times is not None:
+            self.times -= 1
+        return bool(hit)
+
+
+def flood_wait(seconds: int) -> Callable[[Any], BaseException]:
+    return lambda request: errors.FloodWaitError(request=request, capture=seconds)
+
+
+def rpc_error(cls: type = errors.ChannelInvalidError) -> Callable[[Any], BaseException]:
+    return lambda request: cls(request=request)
+
+
+@dataclass
+class _FakeChannel:
+    id: int
+    access_hash: int
+    title: str
+    members: Set[int] = field(default_factory=set)
+    admins: Set[int] = field(default_factory=set)
+
+
+class FakeTelegramClient:
+    """
+    latency/jitter — задержка каждого запроса в секундах (равномерно latency ± jitter).
+    bots — username'ы ботов, которые резолвятся через get_input_entity.
+    """
+    _ids = itertools.count(1_000_000)
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        bots: tuple = ("ra_bot",),
+        seed: Optional[int] = None,
+    ):
+        self.flood_sleep_threshold = 60
+        self._latency = latency
+        self._jitter = jitter
+        self._rng = random.Random(seed)
+        self._connected = False
+        self.authorized = True
+        self.me = types.User(id=next(self._ids), is_self=True, access_hash=self._rng.getrandbits(63))
+        self._users: Dict[str, types.User] = {}
+        for name in bots:
+            self.add_user(name, bot=True)
+        self.channels: Dict[int, _FakeChannel] = {}
+        self.faults: Dict[str, List[FaultRule]] = {}
+        self.calls: Dict[str, int] = {}
+
+    # --- настройка ---
+
+    def add_user(self, username: str, *, bot: bool = False) -> types.User:
+        user = types.User(id=next(self._ids), bot=bot, username=username, access_hash=self._rng.getrandbits(63))
+        self._users[username.lower()] = user
+        return user
+
+    def inject(self, family: str, rule: FaultRule) -> None:
+        """family — как в RequestScheduler.family_of, например "channels.CreateChannel"."""
+        self.faults.setdefault(family, []).append(rule)
+
+    # --- соединение ---
+
+    async def connect(self) -> None:
+        await self._sleep()
+        self._connected = True
+
+    async def disconnect(self) -> None:
+        self._connected = False
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def is_user_authorized(self) -> bool:
+        return self.authorized
+
+    # --- сущности ---
+
+    async def get_me(self, input_peer: bool = False):
+        await self._enter("users.GetUsers", None)
+        return utils.get_input_peer(self.me, allow_self=False) if input_peer else self.me
+
+    async def get_entity(self, entity):
+        await self._enter("contacts.ResolveUsername", None)
+        return self._user_by_name(entity)
+
+    async def get_input_entity(self, entity):
+        if isinstance(entity, (types.InputPeerUser, types.InputPeerChannel)):
+            return entity
+        await self._enter("contacts.ResolveUsername", None)
+        return utils.get_input_peer(self._user_by_name(entity))
+
+    def _user_by_name(self, entity) -> types.User:
+        name = str(entity).lstrip("@").lower()
+        user = self._users.get(name)
+        if user is None:
+            raise ValueError(f'No user has "{name}" as username')
+        return user
+
+    # --- запросы ---
+
+    async def __call__(self, request, ordered: bool = False, flood_sleep_threshold: Optional[int] = None):
+        family = RequestScheduler.family_of(request)
+        await self._enter(family, request)
+        handler = getattr(self, f"_on_{type(request).__name__}", None)
+        if handler is None:
+            raise NotImplementedError(f"FakeTelegramClient: {type(request).__name__} не поддерживается")
+        return handler(request)
+
+    async def _enter(self, family: str, request) -> None:
+        if not self._connected:
+            raise ConnectionError("Cannot send requests while disconnected")
+        self.calls[family] = self.calls.get(family, 0) + 1
+        await self._sleep()
+        for rule in self.faults.get(family, ()):
+            if rule.fire(self._rng):
+                raise rule.make_error(request)
+
+    async def _sleep(self) -> None:
+        if self._latency or self._jitter:
+            await asyncio.sleep(max(0.0, self._latency + self._rng.uniform(-self._jitter, self._jitter)))
+
+    def _updates(self, chats=()) -> types.Updates:
+        return types.Updates(updates=[], users=[], chats=list(chats), date=datetime.now(timezone.utc), seq=0)
+
+    def _as_channel(self, ch: _FakeChannel) -> types.Channel:
+        return types.Channel(
+            id=ch.id, title=ch.title, photo=types.ChatPhotoEmpty(), date=datetime.now(timezone.utc),
+            creator=True, megagroup=True, access_hash=ch.access_hash,
+        )
+
+    def _channel(self, request, ref) -> _FakeChannel:
+        peer = utils.get_input_channel(ref)
+        ch = self.channels.get(peer.channel_id)
+        if ch is None or ch.access_hash != peer.access_hash:
+            raise errors.ChannelInvalidError(request=request)
+        return ch
+
+    def _user_id(self, request, ref) -> int:
+        peer = utils.get_input_user(ref)
+        for user in self._users.values():
+            if user.id == peer.user_id:
+                if user.access_hash != peer.access_hash:
+                    raise errors.UserIdInvalidError(request=request)
+                return user.id
+        raise errors.UserIdInvalidError(request=request)
+
+    def _on_CreateChannelRequest(self, request):
+        ch = _FakeChannel(id=next(self._ids), access_hash=self._rng.getrandbits(63), title=request.title)
+        ch.members.add(self.me.id)
+        self.channels[ch.id] = ch
+        return self._updates([self._as_channel(ch)])
+
+    def _on_InviteToChannelRequest(self, request):
+        ch = self._channel(request, request.channel)
+        for u in request.users:
+            ch.members.add(self._user_id(request, u))
+        return types.messages.InvitedUsers(updates=self._updates(), missing_invitees=[])
+
+    def _on_EditAdminRequest(self, request):
+        ch = self._channel(request, request.channel)
+        uid = self._user_id(request, request.user_id)
+        if uid not in ch.members:
+            raise errors.UserNotParticipantError(request=request)
+        ch.admins.add(uid)
+        return self._updates([self._as_channel(ch)])
+
+    def _on_EditTitleRequest(self, request):
+        ch = self._channel(request, request.channel)
+        ch.title = request.title
+        return self._updates([self._as_channel(ch)])
+
+    def _on_DeleteChannelRequest(self, request):
+        ch = self._channel(request, request.channel)
+        del self.channels[ch.id]
+        return self._updates()
+
+    def _on_GetChannelsRequest(self, request):
+        return types.messages.Chats(chats=[self._as_channel(self._channel(request, ref)) for ref in request.id])
+
+    def _on_PingRequest(self, request):
+        return types.Pong(msg_id=0, ping_id=request.ping_id)
+
@@ -0,0 +1,233 @@
+# fleet_registry.py
+from __future__ import annotations
+import asyncio
+import csv
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("vats", "ref")
+
+# (plate, kind, brand, active, updated_at)
+FleetRow = Tuple[str, str, Optional[str], bool, datetime]
+
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна с отсечкой: если оно больше limit, возвращает limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        best = i
+        for j, cb in enumerate(b, 1):
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            cur.append(v)
+            if v < best:
+                best = v
+        if best > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+class BKTree:
+    """BK-дерево по расстоянию Левенштейна: поиск кандидатов в радиусе 1–2 без перебора всего парка."""
+    # порог для расчёта расстояния при вставке: больше реальной длины номеров
+    _INSERT_LIMIT = 32
+
+    def __init__(self, words: Iterable[str] = ()):
+        self._root: Optional[Tuple[str, Dict[int, tuple]]] = None
+        for w in words:
+            self.add(w)
+
+    def add(self, word: str) -> None:
+        if self._root is None:
+            self._root = (word, {})
+            return
+        node = self._root
+        while True:
+            d = levenshtein(word, node[0], self._INSERT_LIMIT)
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                return
+            node = child
+
+    def search(self, word: str, max_dist: int) -> List[Tuple[int, str]]:
+        if self._root is None:
+            return []
+        out: List[Tuple[int, str]] = []
+        stack = [self._root]
+        while stack:
+            w, children = stack.pop()
+            d = levenshtein(word, w, self._INSERT_LIMIT)
+            if d <= max_dist:
+                out.append((d, w))
+            for k in range(d - max_dist, d + max_dist + 1):
+                child = children.get(k)
+                if child is not None:
+                    stack.append(child)
+        out.sort()
+        return out
+
+
+@dataclass
+class _KindIndex:
+    plates: Set[str] = field(default_factory=set)
+    tree: BKTree = field(default_factory=BKTree)
+    brands: Dict[str, str] = field(default_factory=dict)  # только номера с указанной маркой
+
+    def add(self, plate: str, brand: Optional[str] = None) -> None:
+        if plate not in self.plates:
+            self.plates.add(plate)
+            self.tree.add(plate)
+        if brand:
+            self.brands[plate] = brand
+        else:
+            self.brands.pop(plate, None)
+
+    def discard(self, plate: str) -> None:
+        # из BK-дерева не удаляем: выдачу фильтруем по plates
+        self.plates.discard(plate)
+        self.brands.pop(plate, None)
+
+
+class FleetRegistry:
+    """
+    Реестр парка: госномера ВАТС и рефов/пп в памяти — точный поиск по компактной форме
+    и кандидаты на расстоянии 1–2 для подсказок. Источник — CSV (FLEET_CSV_PATH) и/или
+    таблица fleet_vehicles. Обновление фоновое: CSV пересобирается в потоке при смене mtime
+    и подменяется целиком, из Postgres подтягиваются только строки с updated_at новее
+    последней увиденной.
+
+    CSV: колонки plate, kind (vats|ref), опционально brand и active (1/0).
+    """
+    def __init__(
+        self,
+        *,
+        csv_path: str = "",
+        fetch_changes: Optional[Callable[[Optional[datetime]], Awaitable[List[FleetRow]]]] = None,
+        normalize: Callable[[str, str, Optional[str]], Optional[str]],
+        refresh_sec: float = 300.0,
+    ):
+        self._csv_path = csv_path
+        self._csv_mtime: Optional[float] = None
+        self._fetch_changes = fetch_changes
+        self._normalize = normalize
+        self._refresh_sec = refresh_sec
+        self._csv: Dict[str, _KindIndex] = {k: _KindIndex() for k in KINDS}
+        self._db: Dict[str, _KindIndex] = {k: _KindIndex() for k in KINDS}
+        self._db_since: Optional[datetime] = None
+        self._db_loaded = False
+        # True, когда хотя бы один источник прочитан: до этого пустой индекс — не «номера нет в парке»
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._csv_path or self._fetch_changes)
+
+    @property
+    def enabled(self) -> bool:
+        return self._loaded
+
+    def contains(self, kind: str, plate: str) -> bool:
+        return plate in self._csv[kind].plates or plate in self._db[kind].plates
+
+    def suggest(
+        self, kind: str, plate: str, *, brand: Optional[str] = None, max_dist: int = 2, limit: int = 3
+    ) -> List[str]:
+        """Похожие номера; с brand — без номеров, за которыми в реестре числится другая марка."""
+        seen: Dict[str, int] = {}
+        for idx in (self._csv[kind], self._db[kind]):
+            for d, w in idx.tree.search(plate, max_dist):
+                if brand and idx.brands.get(w, brand) != brand:
+                    continue
+                if w in idx.plates and d < seen.get(w, max_dist + 1):
+                    seen[w] = d
+        return [w for w, _ in sorted(seen.items(), key=lambda x: (x[1], x[0]))][:limit]
+
+    def size(self) -> int:
+        return sum(len(set(self._csv[k].plates) | self._db[k].plates) for k in KINDS)
+
+    def start(self) -> None:
+        if self.configured and self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="fleet-registry")
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self) -> None:
+        try:
+            if self._csv_path:
+                await self._refresh_csv()
+            if self._fetch_changes is not None:
+                await self._refresh_db()
+                self._db_loaded = True
+        finally:
+            if not self._loaded and (self._csv_mtime is not None or self._db_loaded):
+                self._loaded = True
+                logger.info("Реестр парка загружен: %s номеров", self.size())
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Реестр парка: ошибка обновления")
+            await asyncio.sleep(self._refresh_sec)
+
+    async def _refresh_csv(self) -> None:
+        try:
+            mtime = os.stat(self._csv_path).st_mtime
+        except OSError as e:
+            logger.warning("Реестр парка: %s недоступен: %s", self._csv_path, e)
+            return
+        if mtime == self._csv_mtime:
+            return
+        # сборка индекса — в потоке, обработчики тем временем читают старый
+        self._csv = await asyncio.to_thread(self._build_from_csv, self._csv_path)
+        self._csv_mtime = mtime
+
+    def _build_from_csv(self, path: str) -> Dict[str, _KindIndex]:
+        index = {k: _KindIndex() for k in KINDS}
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                kind = (row.get("kind") or "").strip().lower()
+                if kind not in index or (row.get("active") or "1").strip() in ("0", "false", "no"):
+                    continue
+                brand = (row.get("brand") or "").strip() or None
+                plate = self._normalize(row.get("plate") or "", kind, brand)
+                if plate:
+                    index[kind].add(plate, brand)
+        return index
+
+    async def _refresh_db(self) -> None:
+        rows = await self._fetch_changes(self._db_since)  # type: ignore[misc]
+        for raw, kind, brand, active, updated_at in rows:
+            if kind not in self._db:
+                continue
+            # номер в таблице может быть записан как угодно — приводим к той же форме, что и CSV
+            plate = self._normalize(raw or "", kind, brand)
+            if not plate:
+                logger.warning("Реестр парка: номер %r (%s) из fleet_vehicles не распознан", raw, kind)
+            elif active:
+                self._db[kind].add(plate, brand)
+            else:
+                self._db[kind].discard(plate)
+            if self._db_since is None or updated_at > self._db_since:
+                self._db_since = updated_at
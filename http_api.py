@@ -0,0 +1,248 @@
+# http_api.py
+"""
+HTTP API рядом с ботом (поднимает app.py): уведомления из Telegram WebApp, /metrics,
+лента дашборда диспетчеров /api/dashboard/stream (SSE), перцентили длительности этапов
+/api/analytics/stages и админ-эндпоинты профилирования /admin/* (заголовок X-Admin-Token).
+
+Вынесено из regular_bot.py, чтобы импорт бота не тянул FastAPI: модуль импортируется
+только там, где API действительно запускается.
+"""
+from __future__ import annotations
+import asyncio
+import hmac
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from telegram.error import TelegramError
+
+import metrics
+import profiling
+from analytics import GROUPS, STAGE_NAMES, StageRollup
+from config import load_settings
+from dashboard import DashboardFeed
+
+logger = logging.getLogger(__name__)
+settings = load_settings()
+
+
+class WebAppEvent(BaseModel):
+    user_id: Optional[int] = None
+    action: Optional[str] = None
+
+class WebAppBatch(BaseModel):
+    events: List[WebAppEvent] = Field(..., max_length=settings.WEBAPP_BATCH_MAX)
+
+class WebAppSender:
+    """
+    Очередь уведомлений из WebApp и фоновые воркеры, которые шлют их через бота Application
+    (тот же инициализированный Bot и пул соединений). HTTP-запрос не ждёт Telegram.
+    """
+    def __init__(self, *, maxsize: int, concurrency: int) -> None:
+        self._queue: asyncio.Queue[WebAppEvent] = asyncio.Queue(maxsize=maxsize)
+        self._concurrency = concurrency
+        self._workers: List[asyncio.Task] = []
+        self._bot = None
+
+    def start(self, bot) -> None:
+        if self._workers:
+            return
+        self._bot = bot
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"webapp-sender-{i}") for i in range(self._concurrency)
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        # сначала даём дослать то, что уже приняли
+        if self._workers:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ WebAppSender: не дослано %s уведомлений", self._queue.qsize())
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def offer(self, events: List[WebAppEvent]) -> int:
+        """Ставит события в очередь целиком или не ставит ничего (если не хватает места)."""
+        events = [e for e in events if e.user_id]
+        if self._queue.maxsize and self._queue.qsize() + len(events) > self._queue.maxsize:
+            raise asyncio.QueueFull
+        for e in events:
+            self._queue.put_nowait(e)
+        return len(events)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self) -> None:
+        while True:
+            event = await self._queue.get()
+            try:
+                msg = f"📩 Пользователь нажал кнопку в WebApp! (действие: {event.action})"
+                await self._bot.send_message(chat_id=event.user_id, text=msg)
+            except TelegramError as e:
+                logger.warning("⚠️ WebApp-уведомление для %s не отправлено: %s", event.user_id, e)
+            except Exception:
+                logger.exception("WebAppSender: ошибка отправки")
+            finally:
+                self._queue.task_done()
+
+webapp_sender = WebAppSender(maxsize=settings.WEBAPP_QUEUE_SIZE, concurrency=settings.WEBAPP_SEND_CONCURRENCY)
+loop_monitor = profiling.LoopMonitor(threshold=settings.LOOP_LAG_THRESHOLD_MS / 1000, on_lag=metrics.LOOP_LAG.observe)
+profiler = profiling.StackSampler()
+# подключает app.py: dashboard.attach(pg_listener, store.fetch_dashboard) до запуска pg_listener
+dashboard = DashboardFeed(
+    window_hours=settings.DASHBOARD_WINDOW_HOURS, client_queue=settings.DASHBOARD_CLIENT_QUEUE,
+)
+# подключает app.py: http_api.stage_rollup = regular_bot.stage_rollup
+stage_rollup: Optional[StageRollup] = None
+
+
+async def start(app) -> None:
+    """Фоновые службы API; вызывается после regular_bot.on_startup(app)."""
+    webapp_sender.start(app.bot)
+    if settings.ADMIN_TOKEN:
+        loop_monitor.start()
+
+def close_streams() -> None:
+    """Закрывает SSE-потоки; вызывается до остановки uvicorn, иначе он ждёт их вечно."""
+    dashboard.close()
+
+async def stop() -> None:
+    """Досылает уведомления WebApp; вызывается до regular_bot.on_shutdown(app)."""
+    await webapp_sender.stop()
+    await loop_monitor.aclose()
+    profiler.stop()
+
+
+api = FastAPI()
+
+def _enqueue_webapp(events: List[WebAppEvent]) -> Dict[str, Any]:
+    try:
+        queued = webapp_sender.offer(events)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="queue is full, retry later")
+    return {"status": "accepted", "queued": queued}
+
+@api.post("/api/from_webapp", status_code=202)
+async def from_webapp(event: WebAppEvent):
+    """
+    Этот маршрут принимает данные из твоего React-приложения (WebApp),
+    ставит уведомление пользователю в очередь и сразу отвечает 202.
+    """
+    return _enqueue_webapp([event])
+
+@api.post("/api/from_webapp/batch", status_code=202)
+async def from_webapp_batch(batch: WebAppBatch):
+    """Пакетный вариант: много событий WebApp за один запрос."""
+    return _enqueue_webapp(batch.events)
+
+@api.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+# ---- дашборд диспетчеров
+
+def require_dashboard(token: str = Query(default=""), x_dashboard_token: str = Header(default="")) -> None:
+    if not settings.DASHBOARD_TOKEN:
+        raise HTTPException(status_code=404)
+    # EventSource в браузере не умеет заголовки — токен можно передать в ?token=
+    given = x_dashboard_token or token
+    if not hmac.compare_digest(given.encode(), settings.DASHBOARD_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="bad dashboard token")
+
+@api.get("/api/dashboard/stream", dependencies=[Depends(require_dashboard)])
+async def dashboard_stream():
+    """
+    SSE: сначала snapshot со всеми открытыми заявками, затем ticket (заявка изменилась)
+    и closed (убрать с доски). Снимок отдаётся из памяти, а не запросом на каждого клиента.
+    """
+    if not dashboard.enabled:
+        raise HTTPException(status_code=404)
+    try:
+        await dashboard.ready()
+    except Exception as e:
+        logger.warning("Дашборд: снимок не прочитан: %s", e)
+        raise HTTPException(status_code=503, detail="snapshot is unavailable, retry later")
+    return StreamingResponse(
+        dashboard.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api.get("/api/analytics/stages", dependencies=[Depends(require_dashboard)])
+async def analytics_stages(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    by: List[str] = Query(default=list(GROUPS)),
+    stage: Optional[str] = None,
+    brand: Optional[str] = None,
+    incident_type: Optional[str] = None,
+    q: List[float] = Query(default=[0.5, 0.9, 0.95]),
+):
+    """
+    Длительность этапов (сек) по почасовым гистограммам: число, среднее, перцентили q.
+    Период — по часу окончания этапа, по умолчанию последние 7 суток; by — разрезы из brand, incident_type.
+    """
+    if stage_rollup is None:
+        raise HTTPException(status_code=404)
+    if stage is not None and stage not in STAGE_NAMES:
+        raise HTTPException(status_code=422, detail=f"stage must be one of {list(STAGE_NAMES)}")
+    if any(g not in GROUPS for g in by) or any(not 0 < x < 1 for x in q):
+        raise HTTPException(status_code=422, detail=f"by must be from {list(GROUPS)}, q in (0, 1)")
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=7)
+    try:
+        rows = await stage_rollup.report(
+            since, until, by=by, stage=stage, brand=brand, incident_type=incident_type, quantiles=q,
+        )
+    except (OSError, asyncpg.PostgresError) as e:
+        logger.warning("Аналитика этапов: отчёт не построен: %s", e)
+        raise HTTPException(status_code=503, detail="database is unavailable, retry later")
+    return {"since": since, "until": until, "stages": rows}
+
+# ---- админка: профилирование
+
+def require_admin(x_admin_token: str = Header(default="")) -> None:
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    if not hmac.compare_digest(x_admin_token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="bad admin token")
+
+@api.post("/admin/profile/start", dependencies=[Depends(require_admin)])
+async def admin_profile_start(
+    seconds: float = Query(30.0, gt=0, le=600),
+    interval_ms: float = Query(5.0, ge=1, le=1000),
+):
+    """Запускает сэмплирующий профайлер потока event loop'а; сам остановится через seconds."""
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="profiler is already running")
+    profiler.interval = interval_ms / 1000
+    profiler.start(max_seconds=seconds)
+    return {"status": "started", "seconds": seconds, "interval_ms": interval_ms}
+
+@api.post("/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def admin_profile_stop():
+    """Останавливает профайлер и отдаёт collapsed stacks (flamegraph.pl, speedscope)."""
+    await asyncio.to_thread(profiler.stop)
+    return Response(
+        content=profiler.collapsed(),
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Profile-Samples": str(profiler.samples)},
+    )
+
+@api.get("/admin/loop", dependencies=[Depends(require_admin)])
+async def admin_loop():
+    """Задержка event loop'а, блокировки со стеком и суммарно по задачам."""
+    return loop_monitor.report()
+
+@api.get("/admin/tasks", dependencies=[Depends(require_admin)])
+async def admin_tasks():
+    return profiling.pending_tasks()
@@ -0,0 +1,296 @@
+# jira_mapping.py
+"""
+Маппинг анкеты на Jira без перезапуска: id кастомных полей и их виды, подписи опций select,
+варианты выбора в анкете (типы происшествий, марки ВАТС).
+
+JiraMapping — неизменяемый снимок. JiraMappingReloader держит текущий снимок в атрибуте
+current и подменяет его целиком, когда меняется источник, — хэндлеры читают
+reloader.current без блокировок, а собранный снимок не меняется у них под руками.
+
+Слои (каждый следующий перекрывает предыдущий):
+1) переменные окружения JIRA_CF_* / JIRA_OPT_* (config.Settings);
+2) JSON-файл JIRA_MAPPING_PATH — перечитывается при смене mtime, удалённый файл снимает слой;
+3) документ в таблице jira_mapping — перечитывается по NOTIFY jira_mapping (триггер
+   на таблице) и раз в poll_sec на случай пропущенного уведомления.
+
+Формат документа (все ключи необязательны):
+{
+  "fields": {"brand": {"id": "customfield_10011", "kind": "select"}, "notes": {"id": null}},
+  "yes": "Да", "no": "Нет",
+  "choices": {
+    "brand": [{"code": "SITRAK", "label": "Sitrak", "option": "Sitrak"},
+              {"code": "SHACMAN", "label": "Shacman"}]
+  }
+}
+choices заменяет список вариантов шага целиком; option — подпись опции в Jira (по умолчанию label).
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# логическое имя поля → имя переменной окружения (id в JIRA_CF_<X>, вид в JIRA_CF_<X>_KIND)
+FIELD_ENV = {
+    "incident_type": "JIRA_CF_INCIDENT_TYPE",
+    "brand": "JIRA_CF_BRAND",
+    "plate_vats": "JIRA_CF_PLATE_VATS",
+    "plate_ref": "JIRA_CF_PLATE_REF",
+    "location": "JIRA_CF_LOCATION",
+    "problem_desc": "JIRA_CF_PROBLEM_DESC",
+    "notes": "JIRA_CF_NOTES",
+    "incident_date": "JIRA_CF_INCIDENT_DATE",
+    "incident_time": "JIRA_CF_INCIDENT_TIME",
+    "flag_require_mech": "JIRA_CF_FLAG_REQUIRE_MECH",
+    "flag_problem_solved": "JIRA_CF_FLAG_PROBLEM_SOLVED",
+    "flag_require_ra": "JIRA_CF_FLAG_REQUIRE_RA",
+}
+KINDS = frozenset({"select", "text", "adf", "date", "time", "datetime"})
+
+# варианты анкеты по умолчанию: (подпись в боте, код); подпись опции Jira — из JIRA_OPT_*
+DEFAULT_CHOICES = {
+    "incident_type": (("ДТП", "DTP"), ("Поломка", "BREAK")),
+    "brand": (("Kia Ceed", "KIA_CEED"), ("Sitrak", "SITRAK")),
+}
+
+
+@dataclass(frozen=True)
+class FieldSpec:
+    id: Optional[str]
+    kind: str
+
+
+@dataclass(frozen=True)
+class Choice:
+    code: str
+    label: str   # подпись кнопки и в сводке
+    option: str  # значение опции select в Jira
+
+
+@dataclass(frozen=True)
+class JiraMapping:
+    fields: Mapping[str, FieldSpec]
+    choices: Mapping[str, Tuple[Choice, ...]]
+    opt_yes: str = "Да"
+    opt_no: str = "Нет"
+    version: str = "env"
+    _by_code: Mapping[str, Mapping[str, Choice]] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "fields", MappingProxyType(dict(self.fields)))
+        object.__setattr__(self, "choices", MappingProxyType(dict(self.choices)))
+        object.__setattr__(self, "_by_code", MappingProxyType({
+            step: MappingProxyType({c.code: c for c in items}) for step, items in self.choices.items()
+        }))
+
+    def spec(self, name: str) -> FieldSpec:
+        return self.fields.get(name) or FieldSpec(None, "text")
+
+    def has_choice(self, step: str, code: str) -> bool:
+        return code in self._by_code.get(step, {})
+
+    def label(self, step: str, code: str) -> str:
+        c = self._by_code.get(step, {}).get(code)
+        return c.label if c else code
+
+    def option(self, step: str, code: str) -> str:
+        c = self._by_code.get(step, {}).get(code)
+        return c.option if c else code
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "fields": {k: {"id": v.id, "kind": v.kind} for k, v in self.fields.items()},
+            "yes": self.opt_yes,
+            "no": self.opt_no,
+            "choices": {
+                step: [{"code": c.code, "label": c.label, "option": c.option} for c in items]
+                for step, items in self.choices.items()
+            },
+        }
+
+
+def from_settings(settings: Any) -> JiraMapping:
+    fields = {
+        name: FieldSpec(getattr(settings, env) or None, getattr(settings, env + "_KIND"))
+        for name, env in FIELD_ENV.items()
+    }
+    options = {
+        "incident_type": {"DTP": settings.JIRA_OPT_INCIDENT_TYPE__DTP, "BREAK": settings.JIRA_OPT_INCIDENT_TYPE__BREAK},
+        "brand": {"KIA_CEED": settings.JIRA_OPT_BRAND__KIA_CEED, "SITRAK": settings.JIRA_OPT_BRAND__SITRAK},
+    }
+    choices = {
+        step: tuple(Choice(code, label, options[step].get(code, label)) for label, code in items)
+        for step, items in DEFAULT_CHOICES.items()
+    }
+    return JiraMapping(fields, choices, settings.JIRA_OPT_YES, settings.JIRA_OPT_NO)
+
+
+def overlay(base: JiraMapping, doc: Mapping[str, Any], version: str) -> JiraMapping:
+    """Новый снимок: base, перекрытый документом doc. ValueError — документ не годится."""
+    if not isinstance(doc, Mapping):
+        raise ValueError("документ маппинга должен быть JSON-объектом")
+    fields = dict(base.fields)
+    for name, spec in (doc.get("fields") or {}).items():
+        if name not in FIELD_ENV:
+            raise ValueError(f"неизвестное поле {name!r}")
+        if not isinstance(spec, Mapping):
+            raise ValueError(f"fields.{name}: ожидается объект")
+        cur = fields.get(name) or FieldSpec(None, "text")
+        kind = spec.get("kind", cur.kind)
+        if kind not in KINDS:
+            raise ValueError(f"fields.{name}.kind: {kind!r} не из {sorted(KINDS)}")
+        fields[name] = FieldSpec(spec["id"] if "id" in spec else cur.id, kind)
+
+    choices = dict(base.choices)
+    for step, items in (doc.get("choices") or {}).items():
+        if step not in DEFAULT_CHOICES:
+            raise ValueError(f"неизвестный шаг анкеты {step!r}")
+        parsed = []
+        for it in items or ():
+            code, label = str(it.get("code") or "").strip(), str(it.get("label") or "").strip()
+            # код уходит в callback_data "set|<шаг>|<код>" — лимит Telegram 64 байта
+            if not code or not label or "|" in code or len(code.encode()) > 40:
+                raise ValueError(f"choices.{step}: некорректный вариант {it!r}")
+            parsed.append(Choice(code, label, str(it.get("option") or label)))
+        if not parsed:
+            raise ValueError(f"choices.{step}: пустой список")
+        if len({c.code for c in parsed}) != len(parsed):
+            raise ValueError(f"choices.{step}: повторяются коды")
+        choices[step] = tuple(parsed)
+
+    return JiraMapping(
+        fields, choices, str(doc.get("yes") or base.opt_yes), str(doc.get("no") or base.opt_no), version,
+    )
+
+
+def _digest(doc: Any) -> str:
+    return hashlib.sha1(json.dumps(doc, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:12]
+
+
+class JiraMappingReloader:
+    """
+    Текущий снимок — в current. Снимок пересобирается, только если поменялся файл (mtime)
+    или документ в таблице (updated_at); ошибка в источнике оставляет прежний снимок.
+    wake() — внеочередная проверка (обработчик NOTIFY).
+    """
+    def __init__(
+        self,
+        base: JiraMapping,
+        *,
+        path: str = "",
+        fetch_doc: Optional[Callable[[], Awaitable[Optional[Tuple[Dict[str, Any], datetime]]]]] = None,
+        poll_sec: float = 30.0,
+    ):
+        self._base = base
+        self._path = path
+        self._fetch_doc = fetch_doc
+        self._poll_sec = poll_sec
+        self._file: Tuple[Optional[float], Optional[Dict[str, Any]]] = (None, None)
+        self._db: Tuple[Optional[datetime], Optional[Dict[str, Any]]] = (None, None)
+        # последняя просмотренная версия источника, в том числе отвергнутая: ошибку пишем в лог один раз
+        self._file_seen: Optional[float] = None
+        self._db_seen: Optional[datetime] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.current: JiraMapping = base
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._path or self._fetch_doc)
+
+    def wake(self, _payload: str = "") -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self.configured and self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="jira-mapping")
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self) -> bool:
+        """True — снимок подменён."""
+        changed = False
+        # источники независимы: битый файл не мешает подхватить таблицу, и наоборот
+        for name, enabled, step in (
+            ("файл", bool(self._path), self._refresh_file),
+            ("таблица jira_mapping", self._fetch_doc is not None, self._refresh_db),
+        ):
+            if not enabled:
+                continue
+            try:
+                changed |= await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Маппинг Jira (%s): %s — остаётся версия %s", name, e, self.current.version)
+        if not changed:
+            return False
+        snapshot = self._base
+        for doc in (self._file[1], self._db[1]):
+            if doc is not None:
+                snapshot = overlay(snapshot, doc, _digest([self._file[1], self._db[1]]))
+        self.current = snapshot
+        logger.info("Маппинг Jira обновлён: версия %s", snapshot.version)
+        return True
+
+    async def _loop(self) -> None:
+        while True:
+            self._wake.clear()
+            await self.refresh()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._poll_sec)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refresh_file(self) -> bool:
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError as e:
+            if self._file_seen != -1.0:
+                logger.warning("Маппинг Jira: %s недоступен: %s", self._path, e)
+            self._file_seen = -1.0
+            # файл удалили — его слой снимаем, как и удалённую строку в таблице
+            if self._file[1] is None:
+                return False
+            self._file = (None, None)
+            return True
+        if mtime == self._file_seen:
+            return False
+        self._file_seen = mtime
+        doc = await asyncio.to_thread(self._read_json, self._path)
+        overlay(self._base, doc, "check")  # проверка до подмены: битый файл не ломает текущий снимок
+        self._file = (mtime, doc)
+        return True
+
+    @staticmethod
+    def _read_json(path: str) -> Dict[str, Any]:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    async def _refresh_db(self) -> bool:
+        row = await self._fetch_doc()  # type: ignore[misc]
+        if row is None:
+            self._db_seen = None
+            if self._db[1] is None:
+                return False
+            self._db = (None, None)
+            return True
+        doc, updated_at = row
+        if updated_at == self._db_seen:
+            return False
+        self._db_seen = updated_at
+        overlay(self._base, doc, "check")
+        self._db = (updated_at, doc)
+        return True
@@ -0,0 +1,128 @@
+# metrics.py
+"""
+Метрики Prometheus: задержки хэндлеров PTB, запросов Jira, методов Store и вызовов
+userbot-фабрики, плюс gauge'и состояния (пул asyncpg, очередь апдейтов, черновики).
+Отдаются на /metrics FastAPI-приложения (см. http_api.api).
+"""
+from __future__ import annotations
+import functools
+import inspect
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+
+_SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+_DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+HANDLER_SECONDS = Histogram(
+    "ra_handler_seconds", "Время обработки апдейта хэндлером PTB", ["handler", "action"],
+)
+JIRA_SECONDS = Histogram(
+    "ra_jira_request_seconds", "Запросы к Jira REST API", ["op", "status"], buckets=_SLOW_BUCKETS,
+)
+STORE_SECONDS = Histogram(
+    "ra_store_seconds", "Методы Store (Postgres)", ["method", "outcome"], buckets=_DB_BUCKETS,
+)
+USERBOT_SECONDS = Histogram(
+    "ra_userbot_call_seconds", "Вызовы userbot-фабрики групп", ["call", "outcome"], buckets=_SLOW_BUCKETS,
+)
+LOOP_LAG = Histogram(
+    "ra_event_loop_lag_seconds", "Задержка пульса event loop'а (profiling.LoopMonitor)", buckets=_DB_BUCKETS,
+)
+INBOUND_LAG = Histogram(
+    "ra_inbound_update_lag_seconds", "От записи лидером в inbound_updates до забора инстансом (cluster.py)",
+    buckets=_DB_BUCKETS,
+)
+
+DB_POOL_SIZE = Gauge("ra_db_pool_size", "Открытых соединений в пуле asyncpg")
+DB_POOL_IN_USE = Gauge("ra_db_pool_in_use", "Занятых соединений пула asyncpg")
+DB_POOL_MAX = Gauge("ra_db_pool_max", "Максимальный размер пула asyncpg")
+UPDATE_QUEUE = Gauge("ra_update_queue_size", "Апдейтов в очереди PTB Application.update_queue")
+DRAFTS = Gauge("ra_drafts", "Черновиков заявок в памяти (user_data)")
+CLUSTER_LEADER = Gauge("ra_cluster_leader", "1 — инстанс опрашивает getUpdates за весь кластер")
+CLUSTER_SHARDS = Gauge("ra_cluster_shards_owned", "Шардов пользователей за этим инстансом")
+DASHBOARD_CLIENTS = Gauge("ra_dashboard_clients", "Подключённых SSE-клиентов дашборда")
+
+# callback_data вида "<action>|..." — только известные действия, чтобы не плодить серии
+CALLBACK_ACTIONS = frozenset({"nav", "set", "summary", "edit", "act", "st", "close"})
+
+
+def callback_action(update: Any) -> str:
+    query = getattr(update, "callback_query", None)
+    data = (getattr(query, "data", None) or "") if query is not None else ""
+    action = data.split("|", 1)[0]
+    return action if action in CALLBACK_ACTIONS else "other"
+
+
+def timed_handler(name: str, action: Optional[Callable[[Any], str]] = None):
+    """Декоратор хэндлера PTB: гистограмма HANDLER_SECONDS{handler=name, action=action(update)}."""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(update, context, *args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await fn(update, context, *args, **kwargs)
+            finally:
+                HANDLER_SECONDS.labels(name, action(update) if action else "").observe(time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+def instrument_methods(cls: type, histogram: Histogram, names: Optional[Iterable[str]] = None) -> type:
+    """
+    Оборачивает корутин-методы класса замером в histogram{<имя>, outcome=ok|error}.
+    names=None — все публичные async-методы.
+    """
+    if names is None:
+        names = [n for n, f in vars(cls).items() if not n.startswith("_") and inspect.iscoroutinefunction(f)]
+    for name in names:
+        fn = getattr(cls, name)
+        if getattr(fn, "__instrumented__", False):
+            continue
+        setattr(cls, name, _timed_method(fn, histogram.labels(name, "ok"), histogram.labels(name, "error")))
+    return cls
+
+
+def _timed_method(fn, ok, err):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException:
+            err.observe(time.perf_counter() - t0)
+            raise
+        ok.observe(time.perf_counter() - t0)
+        return result
+    wrapper.__instrumented__ = True  # type: ignore[attr-defined]
+    return wrapper
+
+
+def observe_jira(op: str, status: str, seconds: float) -> None:
+    JIRA_SECONDS.labels(op, status).observe(seconds)
+
+
+def bind_state(*, pool: Callable[[], Any], application: Any) -> None:
+    """
+    Gauge'и читают состояние в момент скрейпа: pool() — текущий asyncpg.Pool (или None),
+    application — PTB Application.
+    """
+    def _pool_stat(fn: Callable[[Any], int]) -> Callable[[], float]:
+        def read() -> float:
+            p = pool()
+            return float(fn(p)) if p is not None else 0.0
+        return read
+
+    DB_POOL_SIZE.set_function(_pool_stat(lambda p: p.get_size()))
+    DB_POOL_IN_USE.set_function(_pool_stat(lambda p: p.get_size() - p.get_idle_size()))
+    DB_POOL_MAX.set_function(_pool_stat(lambda p: p.get_max_size()))
+    UPDATE_QUEUE.set_function(lambda: application.update_queue.qsize())
+    DRAFTS.set_function(
+        lambda: sum(1 for ud in list(application.user_data.values()) if "ticket" in ud.get("draft", {}))
+    )
+
+
+def render() -> tuple:
+    """(тело, content-type) для ответа /metrics."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,93 @@
+# pg_notify.py
+"""
+LISTEN/NOTIFY Postgres для фоновых служб бота.
+
+PgListener держит своё соединение (не из пула: LISTEN живёт, пока живо соединение),
+подписывается на каналы и вызывает обработчики прямо в event loop'е. При обрыве
+переподключается с паузой и вызывает on_reconnect-обработчики: уведомления за время
+обрыва потеряны, подписчики должны сами перечитать состояние.
+
+Обработчики синхронные и быстрые (поставить Event, положить в очередь); долгую работу
+подписчик делает в своей задаче.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str], None]
+
+
+class PgListener:
+    def __init__(self, dsn: str, *, reconnect_sec: float = 5.0, keepalive_sec: float = 30.0):
+        self._dsn = dsn
+        self._reconnect_sec = reconnect_sec
+        self._keepalive_sec = keepalive_sec
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._on_reconnect: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+
+    @property
+    def channels(self) -> List[str]:
+        return list(self._handlers)
+
+    def add(self, channel: str, handler: Handler) -> None:
+        """Подписка; регистрировать до start()."""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, handler: Callable[[], None]) -> None:
+        self._on_reconnect.append(handler)
+
+    def start(self) -> None:
+        if self._handlers and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="pg-listener")
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _dispatch(self, con, pid: int, channel: str, payload: str) -> None:
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception("PgListener: ошибка обработчика канала %s", channel)
+
+    async def _run(self) -> None:
+        first = True
+        while True:
+            con = None
+            try:
+                con = await asyncpg.connect(self._dsn)
+                lost = asyncio.Event()
+                con.add_termination_listener(lambda _con: lost.set())
+                for channel in self._handlers:
+                    await con.add_listener(channel, self._dispatch)
+                self.connected = True
+                if not first:
+                    logger.info("PgListener: переподключились к Postgres")
+                    for handler in self._on_reconnect:
+                        handler()
+                # keepalive: обрыв TCP без FIN иначе заметим только по таймауту ядра
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), self._keepalive_sec)
+                    except asyncio.TimeoutError:
+                        await asyncio.wait_for(con.execute("SELECT 1"), self._keepalive_sec)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("PgListener: соединение потеряно (%s), повтор через %g с", e, self._reconnect_sec)
+            finally:
+                self.connected = False
+                if con is not None and not con.is_closed():
+                    con.terminate()
+            first = False
+            await asyncio.sleep(self._reconnect_sec)
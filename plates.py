@@ -0,0 +1,114 @@
+# plates.py
+"""
+Нормализация госномеров (только порядок/кол-во символов) и их отображение.
+
+Компактная форма — без пробелов, кириллицей, в верхнем регистре: «А123ВС77», «АВ123477».
+Очистка ввода — один проход str.translate: верхний регистр, латиница → кириллица и
+выбрасывание всего, что не буква/цифра, делает одна таблица (_PlateChars).
+"""
+from __future__ import annotations
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ANY_LETTERS_CLASS = "A-ZА-ЯЁ"
+
+LAT_TO_CYR = str.maketrans({
+    "A": "А", "B": "В", "E": "Е", "K": "К", "M": "М",
+    "H": "Н", "O": "О", "P": "Р", "C": "С", "T": "Т",
+    "Y": "У", "X": "Х",
+})
+
+PLATE_RE_34 = re.compile(rf"^([{ANY_LETTERS_CLASS}])(\d{{3,4}})([{ANY_LETTERS_CLASS}]{{2}})(\d{{2,3}})$")
+PLATE_RE_3  = re.compile(rf"^([{ANY_LETTERS_CLASS}])(\d{{3}})([{ANY_LETTERS_CLASS}]{{2}})(\d{{2,3}})$")
+REF_COMPACT_RE = re.compile(rf"^([{ANY_LETTERS_CLASS}]{{2}})(\d{{4}})(\d{{2,3}})$")
+
+
+class _PlateChars(Dict[int, Optional[str]]):
+    """
+    Таблица для str.translate: символ → его верхний регистр, латиница заменена кириллицей,
+    не буквы/цифры → None (выбросить). Заполняется лениво: встреченный символ считается
+    один раз и дальше берётся из словаря.
+    """
+    def __missing__(self, code: int) -> Optional[str]:
+        out = "".join(c for c in chr(code).upper() if c.isalnum()).translate(LAT_TO_CYR) or None
+        self[code] = out
+        return out
+
+
+_PLATE_CHARS = _PlateChars()
+
+
+def clean_plate_text(text: str) -> str:
+    """Верхний регистр, латиница → кириллица, только буквы и цифры."""
+    return text.translate(_PLATE_CHARS)
+
+
+def _vats_from_clean(s: str, brand: Optional[str]) -> Optional[str]:
+    rx = PLATE_RE_3 if brand == "KIA_CEED" else PLATE_RE_34
+    # шаблон покрывает строку целиком, s уже в компактной форме
+    return s if rx.match(s) else None
+
+
+def _ref_from_clean(s: str) -> Optional[str]:
+    if REF_COMPACT_RE.match(s):
+        return s
+    # буквы и цифры вперемешку: берём первые 2 буквы, 4 цифры и регион
+    letters = "".join(ch for ch in s if ch.isalpha())
+    digits  = "".join(ch for ch in s if ch.isdigit())
+    if len(letters) < 2 or len(digits) < 6:
+        return None
+    s2 = f"{letters[:2]}{digits[:4]}{digits[4:7]}"
+    return s2 if REF_COMPACT_RE.match(s2) else None
+
+
+def normalize_vats_plate(text: str, *, brand: Optional[str]) -> Optional[str]:
+    if not text:
+        return None
+    return _vats_from_clean(text.translate(_PLATE_CHARS), brand)
+
+
+def normalize_ref_plate(text: str) -> Optional[str]:
+    if not text:
+        return None
+    return _ref_from_clean(text.translate(_PLATE_CHARS))
+
+
+def normalize_vats_plates(items: Iterable[Tuple[Optional[str], Optional[str]]]) -> List[Optional[str]]:
+    """Пачкой: [(текст, бренд), ...] → компактные номера (None — не распознан)."""
+    table = _PLATE_CHARS
+    out: List[Optional[str]] = []
+    append = out.append
+    m34, m3 = PLATE_RE_34.match, PLATE_RE_3.match
+    for text, brand in items:
+        if not text:
+            append(None)
+            continue
+        s = text.translate(table)
+        append(s if (m3 if brand == "KIA_CEED" else m34)(s) else None)
+    return out
+
+
+def normalize_ref_plates(texts: Iterable[Optional[str]]) -> List[Optional[str]]:
+    """Пачкой: тексты номеров рефа/пп → компактные номера (None — не распознан)."""
+    table = _PLATE_CHARS
+    return [_ref_from_clean(t.translate(table)) if t else None for t in texts]
+
+
+def format_vats_display(compact: Optional[str]) -> str:
+    if not compact:
+        return "—"
+    m = PLATE_RE_34.match(compact) or PLATE_RE_3.match(compact)
+    if not m:
+        return compact
+    l1, d, l2, reg = m.groups()
+    return f"{l1}{d}{l2} {reg}"
+
+
+def format_ref_display(compact: Optional[str]) -> str:
+    if not compact:
+        return "—"
+    m = REF_COMPACT_RE.match(compact)
+    if not m:
+        return compact
+    l2, d4, reg = m.groups()
+    return f"{l2}{d4} {reg}"
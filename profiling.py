@@ -0,0 +1,212 @@
+# profiling.py
+"""
+Профилирование в проде без перезапуска:
+
+- StackSampler — сэмплирующий профайлер: отдельный поток раз в interval снимает стек
+  потока event loop'а (sys._current_frames) и копит collapsed stacks —
+  "модуль:функция;модуль:функция N", формат flamegraph.pl / speedscope;
+- LoopMonitor — задержка event loop'а: задача-пульс тикает раз в interval, сторожевой
+  поток замечает, что пульса нет дольше threshold, и снимает стек потока loop'а в этот
+  момент. Так видно, какая задача и какой код заблокировали loop.
+
+Эндпоинты — в http_api.py (/admin/..., заголовок X-Admin-Token).
+"""
+from __future__ import annotations
+import asyncio
+import collections
+import sys
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _stack(frame, limit: int = 64) -> List[str]:
+    """Стек от корня к листу."""
+    out: List[str] = []
+    while frame is not None and len(out) < limit:
+        out.append(_frame_label(frame))
+        frame = frame.f_back
+    out.reverse()
+    return out
+
+
+class StackSampler:
+    """Один сеанс профилирования: start() → окно → stop() / сам по истечении max_seconds."""
+
+    def __init__(self, *, interval: float = 0.005):
+        self.interval = interval
+        self._counts: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, *, max_seconds: float, thread_id: Optional[int] = None) -> None:
+        """thread_id — чей стек снимать (по умолчанию вызывающий поток, т.е. поток loop'а)."""
+        if self.running:
+            raise RuntimeError("профайлер уже запущен")
+        self._counts = {}
+        self.samples = 0
+        self._target = thread_id or threading.get_ident()
+        self._stop.clear()
+        self.started_at, self.stopped_at = time.time(), None
+        deadline = time.monotonic() + max_seconds
+        self._thread = threading.Thread(target=self._run, args=(deadline,), name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, deadline: float) -> None:
+        counts = self._counts
+        while not self._stop.wait(self.interval):
+            if time.monotonic() >= deadline:
+                break
+            frame = sys._current_frames().get(self._target)  # type: ignore[arg-type]
+            if frame is None:
+                break
+            key = ";".join(_stack(frame))
+            counts[key] = counts.get(key, 0) + 1
+            self.samples += 1
+            del frame
+        self.stopped_at = time.time()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self._counts.items(), key=lambda x: -x[1]))
+
+
+class LoopMonitor:
+    """
+    interval — период пульса; threshold — с какой задержки считать loop заблокированным.
+    on_lag(seconds) вызывается на каждый тик (например, гистограмма Prometheus).
+    """
+
+    def __init__(
+        self,
+        *,
+        interval: float = 0.1,
+        threshold: float = 0.1,
+        keep: int = 50,
+        on_lag: Optional[Callable[[float], None]] = None,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self._on_lag = on_lag
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.max_lag = 0.0
+        self.ticks = 0
+        self.blocks: Deque[Dict[str, Any]] = collections.deque(maxlen=keep)
+        # по имени задачи: сколько раз и сколько всего блокировала loop
+        self.by_task: Dict[str, Dict[str, float]] = {}
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._pulse(), name="loop-monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def aclose(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _pulse(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.ticks += 1
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if self._on_lag is not None:
+                self._on_lag(lag)
+
+    def _watch(self) -> None:
+        # проверяем чаще порога, чтобы застать блокирующий код на месте
+        step = max(0.005, self.threshold / 4)
+        blocked_since: Optional[float] = None
+        event: Optional[Dict[str, Any]] = None
+        while not self._stop.wait(step):
+            stalled = time.monotonic() - self._beat - self.interval
+            if stalled < self.threshold:
+                if event is not None:
+                    self._finish(event, blocked_since)
+                blocked_since, event = None, None
+                continue
+            if event is None:
+                blocked_since = self._beat + self.interval
+                event = self._snapshot()
+
+    def _snapshot(self) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread)  # type: ignore[arg-type]
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        return {
+            "at": time.time(),
+            "task": task.get_name() if task is not None else None,
+            "coro": getattr(task.get_coro(), "__qualname__", None) if task is not None else None,
+            "stack": _stack(frame) if frame is not None else [],
+        }
+
+    def _finish(self, event: Dict[str, Any], since: Optional[float]) -> None:
+        blocked = time.monotonic() - (since or time.monotonic())
+        event["blocked_ms"] = round(blocked * 1000, 1)
+        self.blocks.append(event)
+        key = event["task"] or "<callback>"
+        agg = self.by_task.setdefault(key, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        agg["count"] += 1
+        agg["total_ms"] = round(agg["total_ms"] + event["blocked_ms"], 1)
+        agg["max_ms"] = max(agg["max_ms"], event["blocked_ms"])
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "ticks": self.ticks,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "slow_tasks": dict(sorted(self.by_task.items(), key=lambda x: -x[1]["total_ms"])),
+            "recent_blocks": list(self.blocks),
+        }
+
+
+def pending_tasks(limit: int = 200) -> List[Dict[str, Any]]:
+    """Живые задачи loop'а и где каждая сейчас ждёт."""
+    out = []
+    for task in list(asyncio.all_tasks())[:limit]:
+        frames = task.get_stack(limit=1)
+        where = None
+        if frames:
+            f = frames[-1]
+            where = f"{_frame_label(f)}:{f.f_lineno}"
+        out.append({"name": task.get_name(), "coro": getattr(task.get_coro(), "__qualname__", None), "waiting_at": where})
+    return out
@@ -2,109 +2,126 @@
 from __future__ import annotations
 
 import asyncio
-import os
-import re
 import json
 import logging
+import time
 from dataclasses import dataclass, field
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 import asyncpg
 import httpx
-from dotenv import load_dotenv
 from html import escape as _html_escape
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     Update,
 )
-from telegram.constants import ParseMode, ChatType
+from telegram.constants import ParseMode, ChatType, ChatMemberStatus
 from telegram.error import TelegramError, BadRequest
 from telegram.ext import (
     Application,
     ApplicationBuilder,
     CallbackQueryHandler,
+    ChatMemberHandler,
     CommandHandler,
     ContextTypes,
     Defaults,
     MessageHandler,
+    TypeHandler,
     filters,
 )
-from telegram.request import HTTPXRequest
+from telegram.request import BaseRequest
+
+import metrics
+import tracing
+from analytics import StageRollup
+from cluster import SCHEMA_LOCK, Cluster
+from config import load_settings
+from fleet_registry import FleetRegistry, FleetRow
+from jira_mapping import JiraMapping, JiraMappingReloader, from_settings as jira_mapping_from_settings
+from pg_notify import PgListener
+from update_recorder import UpdateRecorder
+from plates import (
+    format_ref_display,
+    format_vats_display,
+    normalize_ref_plate,
+    normalize_vats_plate,
+)
 
 # =========================
 # Конфиг / окружение
 # =========================
 
-load_dotenv()
+# Читается и проверяется один раз (config.py: окружение поверх .env); ниже — короткие имена для кода бота
+settings = load_settings()
 
-BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-DATABASE_URL = os.getenv("DATABASE_URL", "")
+BOT_TOKEN = settings.BOT_TOKEN
+DATABASE_URL = settings.DATABASE_URL
 
 # Чат для диспетчера (куда шлём при «Требуется эвакуатор»)
-DISPATCH_CHAT_ID = int(os.getenv("DISPATCH_CHAT_ID", "0"))
+DISPATCH_CHAT_ID = settings.DISPATCH_CHAT_ID
+
+# Региональные диспетчерские: JSON-список правил вида
+# [{"chat_id": -100..., "brand": "SITRAK", "incident_type": ["DTP"], "location": ["Тверь", "М-11"]}, ...]
+# Правило срабатывает, если совпали все указанные ключи (location — подстрока без учёта регистра).
+# Если ни одно правило не подошло — шлём в DISPATCH_CHAT_ID.
+DISPATCH_ROUTES = settings.DISPATCH_ROUTES
+
+# Реестр парка: CSV (plate,kind[,brand,active]) и/или таблица fleet_vehicles, период обновления
+FLEET_CSV_PATH    = settings.FLEET_CSV_PATH
+FLEET_FROM_DB     = settings.FLEET_FROM_DB
+FLEET_REFRESH_SEC = settings.FLEET_REFRESH_SEC
+
+# Апдейты дольше этого (мс) пишутся в лог ra.slow_update с разбором по участкам; 0 — выключено
+TRACE_SLOW_MS = settings.TRACE_SLOW_MS
+
+# Запись обезличенных апдейтов для scripts/replay_updates.py (gzip JSONL); пусто — не пишем
+UPDATE_CAPTURE_PATH = settings.UPDATE_CAPTURE_PATH
+UPDATE_CAPTURE_SALT = settings.UPDATE_CAPTURE_SALT
+
+# Группа инцидента: не создаём, если юзербот в FloodWait дольше этого (сек)
+INCIDENT_CHAT_MAX_WAIT_SEC = settings.INCIDENT_CHAT_MAX_WAIT_SEC
+
+# Пауза (сек) после последнего нажатия статуса, после которой перерисовываем клавиатуру
+STATUS_EDIT_DEBOUNCE_SEC = settings.STATUS_EDIT_DEBOUNCE_SEC
+
+# Инвайт-ссылки: срок жизни создаваемой ссылки и запас, за который до истечения её пересоздаём
+INVITE_LINK_TTL_SEC     = settings.INVITE_LINK_TTL_SEC
+INVITE_LINK_REFRESH_SEC = settings.INVITE_LINK_REFRESH_SEC
 
 # Jira базовые
-JIRA_BASE_URL    = os.getenv("JIRA_BASE_URL", "").rstrip("/")
-JIRA_EMAIL       = os.getenv("JIRA_EMAIL", "")
-JIRA_API_TOKEN   = os.getenv("JIRA_API_TOKEN", "")
-JIRA_PROJECT_KEY = os.getenv("JIRA_PROJECT_KEY", "")  # ключ проекта (например, RA)
+JIRA_BASE_URL    = settings.JIRA_BASE_URL
+JIRA_EMAIL       = settings.JIRA_EMAIL
+JIRA_API_TOKEN   = settings.JIRA_API_TOKEN
+JIRA_PROJECT_KEY = settings.JIRA_PROJECT_KEY  # ключ проекта (например, RA)
 
 # Тип верхнеуровневой задачи
-JIRA_ISSUE_TYPE_MAIN_ID = os.getenv("JIRA_ISSUE_TYPE_MAIN_ID", "")
-JIRA_ISSUE_TYPE_MAIN    = os.getenv("JIRA_ISSUE_TYPE_MAIN", "Task")
+JIRA_ISSUE_TYPE_MAIN_ID = settings.JIRA_ISSUE_TYPE_MAIN_ID
+JIRA_ISSUE_TYPE_MAIN    = settings.JIRA_ISSUE_TYPE_MAIN
 
 # Тип подзадачи (для RA и «Дежмеха»)
-JIRA_SUBTASK_TYPE_ID    = os.getenv("JIRA_SUBTASK_TYPE_ID", "")           # например "10000"
-JIRA_SUBTASK_TYPE       = os.getenv("JIRA_SUBTASK_TYPE", "Sub-task")      # или "Подзадача" в русской локали
+JIRA_SUBTASK_TYPE_ID    = settings.JIRA_SUBTASK_TYPE_ID           # например "10000"
+JIRA_SUBTASK_TYPE       = settings.JIRA_SUBTASK_TYPE      # или "Подзадача" в русской локали
 
 # Тип линка (если будем линковать верхнеуровневые задачи)
-JIRA_LINK_TYPE = os.getenv("JIRA_LINK_TYPE", "Relates")
-
-# Кастомные поля (ID вида customfield_XXXXX) + виды данных
-JIRA_CF_INCIDENT_TYPE       = os.getenv("JIRA_CF_INCIDENT_TYPE")
-JIRA_CF_INCIDENT_TYPE_KIND  = os.getenv("JIRA_CF_INCIDENT_TYPE_KIND", "select")
-JIRA_CF_BRAND               = os.getenv("JIRA_CF_BRAND")
-JIRA_CF_BRAND_KIND          = os.getenv("JIRA_CF_BRAND_KIND", "select")
-
-JIRA_CF_PLATE_VATS          = os.getenv("JIRA_CF_PLATE_VATS")
-JIRA_CF_PLATE_VATS_KIND     = os.getenv("JIRA_CF_PLATE_VATS_KIND", "text")
-JIRA_CF_PLATE_REF           = os.getenv("JIRA_CF_PLATE_REF")
-JIRA_CF_PLATE_REF_KIND      = os.getenv("JIRA_CF_PLATE_REF_KIND", "text")
-JIRA_CF_LOCATION            = os.getenv("JIRA_CF_LOCATION")
-JIRA_CF_LOCATION_KIND       = os.getenv("JIRA_CF_LOCATION_KIND", "text")
-JIRA_CF_PROBLEM_DESC        = os.getenv("JIRA_CF_PROBLEM_DESC")
-JIRA_CF_PROBLEM_DESC_KIND   = os.getenv("JIRA_CF_PROBLEM_DESC_KIND", "text")
-JIRA_CF_NOTES               = os.getenv("JIRA_CF_NOTES")
-JIRA_CF_NOTES_KIND          = os.getenv("JIRA_CF_NOTES_KIND", "text")
-
-JIRA_CF_INCIDENT_DATE       = os.getenv("JIRA_CF_INCIDENT_DATE")
-JIRA_CF_INCIDENT_DATE_KIND  = os.getenv("JIRA_CF_INCIDENT_DATE_KIND", "date")    # "date"|"text"
-JIRA_CF_INCIDENT_TIME       = os.getenv("JIRA_CF_INCIDENT_TIME")
-JIRA_CF_INCIDENT_TIME_KIND  = os.getenv("JIRA_CF_INCIDENT_TIME_KIND", "time")    # "time"|"datetime"|"text"
-
-# Флаги Да/Нет (select)
-JIRA_CF_FLAG_REQUIRE_MECH        = os.getenv("JIRA_CF_FLAG_REQUIRE_MECH")
-JIRA_CF_FLAG_REQUIRE_MECH_KIND   = os.getenv("JIRA_CF_FLAG_REQUIRE_MECH_KIND", "select")
-JIRA_CF_FLAG_PROBLEM_SOLVED      = os.getenv("JIRA_CF_FLAG_PROBLEM_SOLVED")
-JIRA_CF_FLAG_PROBLEM_SOLVED_KIND = os.getenv("JIRA_CF_FLAG_PROBLEM_SOLVED_KIND", "select")
-JIRA_CF_FLAG_REQUIRE_RA          = os.getenv("JIRA_CF_FLAG_REQUIRE_RA")
-JIRA_CF_FLAG_REQUIRE_RA_KIND     = os.getenv("JIRA_CF_FLAG_REQUIRE_RA_KIND", "select")
-
-# Значения опций для Да/Нет
-JIRA_OPT_YES = os.getenv("JIRA_OPT_YES", "Да")
-JIRA_OPT_NO  = os.getenv("JIRA_OPT_NO",  "Нет")
-
-# Маппинги подписей select для наших кодов
-INCIDENT_TYPE_OPTION_MAP = {
-    "DTP":   os.getenv("JIRA_OPT_INCIDENT_TYPE__DTP",   "ДТП"),
-    "BREAK": os.getenv("JIRA_OPT_INCIDENT_TYPE__BREAK", "Поломка"),
-}
-BRAND_OPTION_MAP = {
-    "KIA_CEED": os.getenv("JIRA_OPT_BRAND__KIA_CEED", "Kia Ceed"),
-    "SITRAK":   os.getenv("JIRA_OPT_BRAND__SITRAK",   "Sitrak"),
-}
+JIRA_LINK_TYPE = settings.JIRA_LINK_TYPE
+
+# Кастомные поля, подписи опций и варианты анкеты — снимок jira_mapping.current (см. jira_mapping.py):
+# JIRA_CF_* / JIRA_OPT_* из окружения, поверх них JIRA_MAPPING_PATH и таблица jira_mapping
+JIRA_MAPPING_PATH     = settings.JIRA_MAPPING_PATH
+JIRA_MAPPING_FROM_DB  = settings.JIRA_MAPPING_FROM_DB
+JIRA_MAPPING_POLL_SEC = settings.JIRA_MAPPING_POLL_SEC
+
+# Аналитика длительности этапов (см. analytics.py)
+ANALYTICS_INTERVAL_SEC = settings.ANALYTICS_INTERVAL_SEC
+ANALYTICS_SETTLE_SEC   = settings.ANALYTICS_SETTLE_SEC
+
+# Несколько инстансов на одной базе (см. cluster.py)
+CLUSTER_MODE          = settings.CLUSTER_MODE
+CLUSTER_INSTANCE_ID   = settings.CLUSTER_INSTANCE_ID
+CLUSTER_SHARDS        = settings.CLUSTER_SHARDS
+CLUSTER_HEARTBEAT_SEC = settings.CLUSTER_HEARTBEAT_SEC
 
 # =========================
 # Утилиты
@@ -140,6 +157,28 @@ async def safe_edit_reply_markup(query, *, reply_markup):
             return
         raise
 
+class EditDebouncer:
+    """
+    Откладывает правку сообщения до паузы в нажатиях: каждая новая правка того же
+    сообщения отменяет ещё не начатую предыдущую, так что рисуется только итоговое состояние.
+    """
+    def __init__(self, delay: float) -> None:
+        self._delay = delay
+        self._pending: Dict[Any, asyncio.Task] = {}
+
+    def schedule(self, app: Application, key: Any, render: Callable[[], Awaitable[None]], *, update: object = None) -> None:
+        prev = self._pending.pop(key, None)
+        if prev is not None:
+            prev.cancel()
+        self._pending[key] = app.create_task(self._run(key, render), update=update)
+
+    async def _run(self, key: Any, render: Callable[[], Awaitable[None]]) -> None:
+        await asyncio.sleep(self._delay)
+        # дальше не отменяемся: новое нажатие запланирует свою правку
+        if self._pending.get(key) is asyncio.current_task():
+            del self._pending[key]
+        await render()
+
 def format_jira_date(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d")
 
@@ -150,71 +189,14 @@ def format_jira_datetime(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%dT%H:%M:%S.000+0000")
 
 # =========================
-# Нормализация госномеров (только порядок/кол-во)
+# Нормализация госномеров (только порядок/кол-во) — см. plates.py
 # =========================
 
-ANY_LETTERS_CLASS = "A-ZА-ЯЁ"
-
-LAT_TO_CYR = str.maketrans({
-    "A": "А", "B": "В", "E": "Е", "K": "К", "M": "М",
-    "H": "Н", "O": "О", "P": "Р", "C": "С", "T": "Т",
-    "Y": "У", "X": "Х",
-})
-
-PLATE_RE_34 = re.compile(rf"^([{ANY_LETTERS_CLASS}])(\d{{3,4}})([{ANY_LETTERS_CLASS}]{{2}})(\d{{2,3}})$")
-PLATE_RE_3  = re.compile(rf"^([{ANY_LETTERS_CLASS}])(\d{{3}})([{ANY_LETTERS_CLASS}]{{2}})(\d{{2,3}})$")
-REF_COMPACT_RE = re.compile(rf"^([{ANY_LETTERS_CLASS}]{{2}})(\d{{4}})(\d{{2,3}})$")
-
-def normalize_vats_plate(text: str, *, brand: Optional[str]) -> Optional[str]:
-    if not text:
-        return None
-    s = "".join(ch for ch in (text or "").upper() if ch.isalnum()).translate(LAT_TO_CYR)
-    rx = PLATE_RE_3 if brand == "KIA_CEED" else PLATE_RE_34
-    m = rx.match(s)
-    if not m:
-        return None
-    l1, d, l2, reg = m.groups()
-    return f"{l1}{d}{l2}{reg}"
-
-def normalize_ref_plate(text: str) -> Optional[str]:
-    if not text:
-        return None
-    s = "".join(ch for ch in (text or "").upper() if ch.isalnum()).translate(LAT_TO_CYR)
-    m = REF_COMPACT_RE.match(s)
-    if not m:
-        letters = "".join(ch for ch in s if ch.isalpha())
-        digits  = "".join(ch for ch in s if ch.isdigit())
-        if len(letters) < 2 or len(digits) < 6:
-            return None
-        l2  = letters[:2]
-        d4  = digits[:4]
-        reg = digits[4:7]
-        if len(reg) < 2:
-            return None
-        s2 = f"{l2}{d4}{reg}"
-        m = REF_COMPACT_RE.match(s2)
-        if not m:
-            return None
-    l2, d4, reg = m.groups()
-    return f"{l2}{d4}{reg}"
-
-def format_vats_display(compact: Optional[str]) -> str:
-    if not compact:
-        return "—"
-    m = PLATE_RE_34.match(compact) or PLATE_RE_3.match(compact)
-    if not m:
-        return compact
-    l1, d, l2, reg = m.groups()
-    return f"{l1}{d}{l2} {reg}"
-
-def format_ref_display(compact: Optional[str]) -> str:
-    if not compact:
-        return "—"
-    m = REF_COMPACT_RE.match(compact)
-    if not m:
-        return compact
-    l2, d4, reg = m.groups()
-    return f"{l2}{d4} {reg}"
+def normalize_fleet_plate(text: str, kind: str, brand: Optional[str]) -> Optional[str]:
+    if kind == "ref":
+        return normalize_ref_plate(text)
+    # в реестре бренд может быть не указан — тогда принимаем обе длины
+    return normalize_vats_plate(text, brand=brand)
 
 # =========================
 # Анкета и статусы
@@ -250,16 +232,6 @@ STEP_INPUT_KIND = {
     "notes": "text",
 }
 
-CHOICE_OPTIONS = {
-    "incident_type": [("ДТП", "DTP"), ("Поломка", "BREAK")],
-    "brand": [("Kia Ceed", "KIA_CEED"), ("Sitrak", "SITRAK")],
-}
-
-HUMANIZE_VALUE = {
-    "incident_type": {"DTP": "ДТП", "BREAK": "Поломка"},
-    "brand": {"KIA_CEED": "Kia Ceed", "SITRAK": "Sitrak"},
-}
-
 STATUS_FLOW = [
     ("arrive",     "⬜️ RA прибыл на место",             "RA прибыл на место"),
     ("inspect",    "⬜️ RA провел осмотр ВАТС",           "RA провел осмотр ВАТС"),
@@ -287,6 +259,7 @@ class Ticket:
     jira_main: Optional[str] = None
     jira_mech: Optional[str] = None  # сабтаск
     jira_ra: Optional[str] = None    # сабтаск
+    incident_chat_id: Optional[int] = None  # группа инцидента (создаёт юзербот)
 
 # =========================
 # Хранилище (Postgres)
@@ -296,58 +269,157 @@ class Store:
     def __init__(self, dsn: str) -> None:
         self._dsn = dsn
         self.pool: Optional[asyncpg.Pool] = None
+        # вызываются с id заявки после каждой записи в tickets/status_* (инвалидация на других инстансах)
+        self.on_ticket_change: List[Callable[[str], None]] = []
+
+    def _changed(self, ticket_id: str) -> None:
+        for handler in self.on_ticket_change:
+            handler(ticket_id)
 
     async def init(self):
         if self.pool is None:
             self.pool = await asyncpg.create_pool(self._dsn, min_size=1, max_size=5)
             async with self.pool.acquire() as con:
-                await con.execute("""
-                CREATE TABLE IF NOT EXISTS tickets (
-                  id                TEXT PRIMARY KEY,
-                  user_id           BIGINT NOT NULL,
-                  username          TEXT,
-                  created_at        TIMESTAMPTZ NOT NULL,
-                  incident_type     TEXT,
-                  brand             TEXT,
-                  plate_vats        TEXT,
-                  plate_ref         TEXT,
-                  location          TEXT,
-                  problem_desc      TEXT,
-                  notes             TEXT,
-                  closed_at         TIMESTAMPTZ,
-                  jira_main         TEXT,
-                  jira_mech         TEXT,
-                  jira_ra           TEXT
-                );
-                """)
-                await con.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS jira_main TEXT;")
-                await con.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS jira_mech TEXT;")
-                await con.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS jira_ra TEXT;")
-                await con.execute("""
-                CREATE TABLE IF NOT EXISTS status_history (
-                  id         BIGSERIAL PRIMARY KEY,
-                  ticket_id  TEXT NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
-                  status_key TEXT NOT NULL,
-                  ts         TIMESTAMPTZ NOT NULL
-                );
-                """)
-                await con.execute("""
-                CREATE TABLE IF NOT EXISTS status_done (
-                  ticket_id  TEXT NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
-                  status_key TEXT NOT NULL,
-                  ts         TIMESTAMPTZ NOT NULL,
-                  PRIMARY KEY (ticket_id, status_key)
-                );
-                """)
-                await con.execute("""
-                CREATE TABLE IF NOT EXISTS input_history (
-                  id         BIGSERIAL PRIMARY KEY,
-                  ticket_id  TEXT NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
-                  field_key  TEXT NOT NULL,
-                  value_text TEXT,
-                  ts         TIMESTAMPTZ NOT NULL
-                );
-                """)
+                # DDL — одной транзакцией под advisory lock: инстансы стартуют одновременно,
+                # а параллельные CREATE FUNCTION/TRIGGER падают с "tuple concurrently updated"
+                async with con.transaction():
+                    await con.execute("SELECT pg_advisory_xact_lock($1, $2)", *SCHEMA_LOCK)
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS tickets (
+                      id                TEXT PRIMARY KEY,
+                      user_id           BIGINT NOT NULL,
+                      username          TEXT,
+                      created_at        TIMESTAMPTZ NOT NULL,
+                      incident_type     TEXT,
+                      brand             TEXT,
+                      plate_vats        TEXT,
+                      plate_ref         TEXT,
+                      location          TEXT,
+                      problem_desc      TEXT,
+                      notes             TEXT,
+                      closed_at         TIMESTAMPTZ,
+                      jira_main         TEXT,
+                      jira_mech         TEXT,
+                      jira_ra           TEXT
+                    );
+                    """)
+                    await con.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS jira_main TEXT;")
+                    await con.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS jira_mech TEXT;")
+                    await con.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS jira_ra TEXT;")
+                    await con.execute("ALTER TABLE tickets ADD COLUMN IF NOT EXISTS incident_chat_id BIGINT;")
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS status_history (
+                      id         BIGSERIAL PRIMARY KEY,
+                      ticket_id  TEXT NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
+                      status_key TEXT NOT NULL,
+                      ts         TIMESTAMPTZ NOT NULL
+                    );
+                    """)
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS status_done (
+                      ticket_id  TEXT NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
+                      status_key TEXT NOT NULL,
+                      ts         TIMESTAMPTZ NOT NULL,
+                      PRIMARY KEY (ticket_id, status_key)
+                    );
+                    """)
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS input_history (
+                      id         BIGSERIAL PRIMARY KEY,
+                      ticket_id  TEXT NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
+                      field_key  TEXT NOT NULL,
+                      value_text TEXT,
+                      ts         TIMESTAMPTZ NOT NULL
+                    );
+                    """)
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS dispatch_deliveries (
+                      id          BIGSERIAL PRIMARY KEY,
+                      ticket_id   TEXT NOT NULL REFERENCES tickets(id) ON DELETE CASCADE,
+                      chat_id     BIGINT NOT NULL,
+                      ok          BOOLEAN NOT NULL,
+                      message_id  BIGINT,
+                      error       TEXT,
+                      ts          TIMESTAMPTZ NOT NULL
+                    );
+                    """)
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS fleet_vehicles (
+                      kind        TEXT NOT NULL,
+                      plate       TEXT NOT NULL,
+                      brand       TEXT,
+                      active      BOOLEAN NOT NULL DEFAULT TRUE,
+                      updated_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+                      PRIMARY KEY (kind, plate)
+                    );
+                    """)
+                    await con.execute("CREATE INDEX IF NOT EXISTS fleet_vehicles_updated_at ON fleet_vehicles(updated_at);")
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS invite_links (
+                      chat_id     BIGINT PRIMARY KEY,
+                      invite_link TEXT NOT NULL,
+                      expire_at   TIMESTAMPTZ,
+                      created_at  TIMESTAMPTZ NOT NULL
+                    );
+                    """)
+                    # маппинг Jira: один документ (jira_mapping.py); триггер будит все инстансы через NOTIFY
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS jira_mapping (
+                      id          SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                      doc         JSONB NOT NULL,
+                      updated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+                    );
+                    """)
+                    await con.execute("""
+                    CREATE OR REPLACE FUNCTION jira_mapping_notify() RETURNS trigger AS $$
+                    BEGIN
+                      PERFORM pg_notify('jira_mapping', '');
+                      RETURN NULL;
+                    END $$ LANGUAGE plpgsql;
+                    """)
+                    await con.execute("""
+                    CREATE OR REPLACE TRIGGER jira_mapping_changed AFTER INSERT OR UPDATE OR DELETE ON jira_mapping
+                    FOR EACH STATEMENT EXECUTE FUNCTION jira_mapping_notify();
+                    """)
+                    # дашборд (dashboard.py): set_status_done, close_ticket и сохранение ключей Jira
+                    # шлют строку заявки в NOTIFY ticket_dashboard; та же функция отдаёт снимок
+                    await con.execute("CREATE INDEX IF NOT EXISTS tickets_open ON tickets(created_at) WHERE closed_at IS NULL;")
+                    await con.execute("""
+                    CREATE OR REPLACE FUNCTION ticket_dashboard_row(tid TEXT) RETURNS jsonb AS $$
+                      SELECT jsonb_build_object(
+                        'id', t.id, 'created_at', t.created_at, 'closed_at', t.closed_at,
+                        'incident_type', t.incident_type, 'brand', t.brand,
+                        'plate_vats', t.plate_vats, 'plate_ref', t.plate_ref,
+                        'location', left(t.location, 300),  -- NOTIFY ограничен 8000 байтами
+                        'jira_main', t.jira_main, 'jira_mech', t.jira_mech, 'jira_ra', t.jira_ra,
+                        'status', COALESCE(
+                          (SELECT jsonb_object_agg(d.status_key, d.ts) FROM status_done d WHERE d.ticket_id = t.id),
+                          '{}'::jsonb)
+                      ) FROM tickets t WHERE t.id = tid
+                    $$ LANGUAGE sql;
+                    """)
+                    await con.execute("""
+                    CREATE OR REPLACE FUNCTION ticket_dashboard_notify() RETURNS trigger AS $$
+                    BEGIN
+                      IF TG_TABLE_NAME = 'tickets' THEN
+                        PERFORM pg_notify('ticket_dashboard', ticket_dashboard_row(NEW.id)::text);
+                      ELSE
+                        PERFORM pg_notify('ticket_dashboard', ticket_dashboard_row(NEW.ticket_id)::text);
+                      END IF;
+                      RETURN NULL;
+                    END $$ LANGUAGE plpgsql;
+                    """)
+                    await con.execute("""
+                    CREATE OR REPLACE TRIGGER ticket_dashboard_changed AFTER UPDATE OF closed_at, jira_main, jira_mech, jira_ra ON tickets
+                    FOR EACH ROW WHEN (
+                      OLD.closed_at IS DISTINCT FROM NEW.closed_at OR OLD.jira_main IS DISTINCT FROM NEW.jira_main
+                      OR OLD.jira_mech IS DISTINCT FROM NEW.jira_mech OR OLD.jira_ra IS DISTINCT FROM NEW.jira_ra
+                    ) EXECUTE FUNCTION ticket_dashboard_notify();
+                    """)
+                    await con.execute("""
+                    CREATE OR REPLACE TRIGGER ticket_dashboard_status AFTER INSERT ON status_done
+                    FOR EACH ROW EXECUTE FUNCTION ticket_dashboard_notify();
+                    """)
 
     async def _ensure_pool(self):
         if self.pool is None:
@@ -383,22 +455,35 @@ class Store:
         await self._ensure_pool()
         async with self.pool.acquire() as con:  # type: ignore
             await con.execute(f"UPDATE tickets SET {field}=$1 WHERE id=$2", value, ticket_id)
+        self._changed(ticket_id)
 
     async def set_status_done(self, ticket_id: str, key: str, ts: datetime) -> None:
+        # один стейтмент = одна транзакция и один round-trip
         await self._ensure_pool()
         async with self.pool.acquire() as con:  # type: ignore
             await con.execute("""
-                INSERT INTO status_done(ticket_id, status_key, ts)
-                VALUES ($1,$2,$3) ON CONFLICT DO NOTHING
-            """, ticket_id, key, ts)
-            await con.execute("""
+                WITH done AS (
+                    INSERT INTO status_done(ticket_id, status_key, ts)
+                    VALUES ($1,$2,$3) ON CONFLICT DO NOTHING
+                )
                 INSERT INTO status_history(ticket_id, status_key, ts)
                 VALUES ($1,$2,$3)
             """, ticket_id, key, ts)
+        self._changed(ticket_id)
 
     async def close_ticket(self, ticket_id: str, closed_ts: datetime) -> None:
         await self.save_field(ticket_id, "closed_at", closed_ts)
 
+    async def fetch_ticket(self, ticket_id: str) -> Optional[Tuple[Dict[str, Any], Dict[str, datetime]]]:
+        """Строка tickets и отметки status_done (ключ → время) — для restore_draft."""
+        await self._ensure_pool()
+        async with self.pool.acquire() as con:  # type: ignore
+            row = await con.fetchrow("SELECT * FROM tickets WHERE id=$1", ticket_id)
+            if row is None:
+                return None
+            done = await con.fetch("SELECT status_key, ts FROM status_done WHERE ticket_id=$1", ticket_id)
+        return dict(row), {r["status_key"]: r["ts"] for r in done}
+
     async def log_input(self, ticket_id: str, field_key: str, value_text: Optional[str], ts: datetime) -> None:
         await self._ensure_pool()
         async with self.pool.acquire() as con:  # type: ignore
@@ -407,8 +492,276 @@ class Store:
                 ticket_id, field_key, value_text, ts
             )
 
+    async def log_dispatch_deliveries(
+        self, rows: List[Tuple[str, int, bool, Optional[int], Optional[str], datetime]]
+    ) -> None:
+        if not rows:
+            return
+        await self._ensure_pool()
+        async with self.pool.acquire() as con:  # type: ignore
+            await con.executemany(
+                "INSERT INTO dispatch_deliveries(ticket_id, chat_id, ok, message_id, error, ts) VALUES ($1,$2,$3,$4,$5,$6)",
+                rows,
+            )
+
+    async def fetch_fleet_changes(self, since: Optional[datetime]) -> List[FleetRow]:
+        await self._ensure_pool()
+        async with self.pool.acquire() as con:  # type: ignore
+            if since is None:
+                rows = await con.fetch("SELECT plate, kind, brand, active, updated_at FROM fleet_vehicles WHERE active")
+            else:
+                # >= : строки с той же меткой, закоммиченные позже, не теряем (повторное применение безвредно)
+                rows = await con.fetch(
+                    "SELECT plate, kind, brand, active, updated_at FROM fleet_vehicles WHERE updated_at >= $1 ORDER BY updated_at",
+                    since,
+                )
+        return [(r["plate"], r["kind"], r["brand"], r["active"], r["updated_at"]) for r in rows]
+
+    async def fetch_dashboard(self, since: datetime) -> List[Dict[str, Any]]:
+        """Снимок для дашборда: открытые отправленные заявки, созданные не раньше since."""
+        await self._ensure_pool()
+        async with self.pool.acquire() as con:  # type: ignore
+            rows = await con.fetch("""
+                SELECT ticket_dashboard_row(t.id)::text AS row FROM tickets t
+                 WHERE t.closed_at IS NULL AND t.created_at >= $1
+                   AND (t.jira_main IS NOT NULL OR EXISTS (SELECT 1 FROM status_done d WHERE d.ticket_id = t.id))
+                 ORDER BY t.created_at
+            """, since)
+        return [json.loads(r["row"]) for r in rows]
+
+    async def fetch_jira_mapping(self) -> Optional[Tuple[Dict[str, Any], datetime]]:
+        await self._ensure_pool()
+        async with self.pool.acquire() as con:  # type: ignore
+            row = await con.fetchrow("SELECT doc::text AS doc, updated_at FROM jira_mapping WHERE id = 1")
+        return (json.loads(row["doc"]), row["updated_at"]) if row else None
+
+    async def get_invite_link(self, chat_id: int) -> Optional[Tuple[str, Optional[datetime]]]:
+        await self._ensure_pool()
+        async with self.pool.acquire() as con:  # type: ignore
+            row = await con.fetchrow("SELECT invite_link, expire_at FROM invite_links WHERE chat_id=$1", chat_id)
+        return (row["invite_link"], row["expire_at"]) if row else None
+
+    async def save_invite_link(
+        self, chat_id: int, link: str, expire_at: Optional[datetime], ts: datetime, *, stale_before: datetime
+    ) -> Tuple[str, Optional[datetime]]:
+        """
+        Сохраняет ссылку, только если в базе нет другой живой (expire_at позже stale_before).
+        Возвращает ссылку, которая в итоге лежит в базе — свою или созданную другим инстансом.
+        """
+        await self._ensure_pool()
+        async with self.pool.acquire() as con:  # type: ignore
+            row = await con.fetchrow("""
+                INSERT INTO invite_links(chat_id, invite_link, expire_at, created_at)
+                VALUES ($1,$2,$3,$4)
+                ON CONFLICT (chat_id) DO UPDATE
+                  SET invite_link=EXCLUDED.invite_link, expire_at=EXCLUDED.expire_at, created_at=EXCLUDED.created_at
+                  WHERE invite_links.expire_at IS NOT NULL AND invite_links.expire_at <= $5
+                RETURNING invite_link, expire_at
+            """, chat_id, link, expire_at, ts, stale_before)
+            if row is None:
+                row = await con.fetchrow("SELECT invite_link, expire_at FROM invite_links WHERE chat_id=$1", chat_id)
+        return row["invite_link"], row["expire_at"]
+
+    async def delete_invite_link(self, chat_id: int, link: Optional[str] = None) -> None:
+        await self._ensure_pool()
+        async with self.pool.acquire() as con:  # type: ignore
+            if link is None:
+                await con.execute("DELETE FROM invite_links WHERE chat_id=$1", chat_id)
+            else:
+                await con.execute("DELETE FROM invite_links WHERE chat_id=$1 AND invite_link=$2", chat_id, link)
+
+metrics.instrument_methods(Store, metrics.STORE_SECONDS)
+tracing.trace_methods(Store, "db")
 store = Store(DATABASE_URL)
 
+# =========================
+# Кэш инвайт-ссылок
+# =========================
+
+class InviteLinkCache:
+    """
+    Инвайт-ссылки по чатам: память -> Postgres -> create_chat_invite_link.
+    Ссылка переиспользуется, пока не истекла (с запасом refresh_sec) или не отозвана;
+    через Postgres её видят все инстансы бота.
+    """
+    def __init__(self, store: Store, *, ttl_sec: int, refresh_sec: int) -> None:
+        self._store = store
+        self._ttl = timedelta(seconds=ttl_sec)
+        self._refresh = timedelta(seconds=refresh_sec)
+        self._links: Dict[int, Tuple[str, Optional[datetime]]] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _is_fresh(self, expire_at: Optional[datetime]) -> bool:
+        return expire_at is None or expire_at - self._refresh > utc_now()
+
+    async def get(self, bot, chat_id: int) -> Optional[str]:
+        cached = self._links.get(chat_id)
+        if cached and self._is_fresh(cached[1]):
+            return cached[0]
+        async with self._locks.setdefault(chat_id, asyncio.Lock()):
+            cached = self._links.get(chat_id)
+            if cached and self._is_fresh(cached[1]):
+                return cached[0]
+            stored = await self._store.get_invite_link(chat_id)
+            if stored and self._is_fresh(stored[1]):
+                self._links[chat_id] = stored
+                return stored[0]
+            now = utc_now()
+            try:
+                link = await bot.create_chat_invite_link(
+                    chat_id=chat_id, expire_date=now + self._ttl, creates_join_request=False
+                )
+            except TelegramError as e:
+                logging.warning("⚠️ Не удалось создать инвайт-ссылку для чата %s: %s", chat_id, e)
+                return None
+            saved = await self._store.save_invite_link(
+                chat_id, link.invite_link, link.expire_date, now, stale_before=now + self._refresh
+            )
+            if saved[0] != link.invite_link:
+                # другой инстанс успел раньше — нашу ссылку не плодим
+                await self._revoke_quietly(bot, chat_id, link.invite_link)
+            self._links[chat_id] = saved
+            return saved[0]
+
+    async def warm(self, bot, chat_ids: List[int]) -> None:
+        await asyncio.gather(*(self.get(bot, cid) for cid in chat_ids if cid), return_exceptions=True)
+
+    def invalidate(self, chat_id: int) -> None:
+        self._links.pop(chat_id, None)
+
+    @staticmethod
+    async def _revoke_quietly(bot, chat_id: int, link: str) -> None:
+        try:
+            await bot.revoke_chat_invite_link(chat_id=chat_id, invite_link=link)
+        except TelegramError:
+            pass
+
+invite_links = InviteLinkCache(store, ttl_sec=INVITE_LINK_TTL_SEC, refresh_sec=INVITE_LINK_REFRESH_SEC)
+status_edits = EditDebouncer(STATUS_EDIT_DEBOUNCE_SEC)
+update_recorder = UpdateRecorder(UPDATE_CAPTURE_PATH, salt=UPDATE_CAPTURE_SALT or BOT_TOKEN)
+# LISTEN/NOTIFY: своё соединение, подписки регистрируются здесь, запуск в on_startup
+pg_listener = PgListener(DATABASE_URL)
+
+jira_mapping = JiraMappingReloader(
+    jira_mapping_from_settings(settings),
+    path=JIRA_MAPPING_PATH,
+    fetch_doc=store.fetch_jira_mapping if JIRA_MAPPING_FROM_DB else None,
+    poll_sec=JIRA_MAPPING_POLL_SEC,
+)
+if JIRA_MAPPING_FROM_DB:
+    pg_listener.add("jira_mapping", jira_mapping.wake)
+    pg_listener.on_reconnect(jira_mapping.wake)
+fleet = FleetRegistry(
+    csv_path=FLEET_CSV_PATH,
+    fetch_changes=store.fetch_fleet_changes if FLEET_FROM_DB else None,
+    normalize=normalize_fleet_plate,
+    refresh_sec=FLEET_REFRESH_SEC,
+)
+stage_rollup = StageRollup(
+    lambda: store.pool, interval_sec=ANALYTICS_INTERVAL_SEC, settle_sec=ANALYTICS_SETTLE_SEC,
+)
+# CLUSTER_MODE: апдейты принимает лидер, обрабатывает владелец шарда пользователя
+cluster: Optional[Cluster] = (
+    Cluster(
+        DATABASE_URL,
+        listener=pg_listener,
+        instance_id=CLUSTER_INSTANCE_ID,
+        shards=CLUSTER_SHARDS,
+        heartbeat_sec=CLUSTER_HEARTBEAT_SEC,
+    )
+    if CLUSTER_MODE else None
+)
+if cluster is not None:
+    store.on_ticket_change.append(lambda ticket_id: cluster.publish("ticket", ticket_id))
+
+# =========================
+# Маршрутизация запросов диспетчерам
+# =========================
+
+def _as_tuple(v: Any) -> Tuple[str, ...]:
+    if v is None:
+        return ()
+    if isinstance(v, (list, tuple)):
+        return tuple(str(x) for x in v)
+    return (str(v),)
+
+@dataclass(frozen=True)
+class DispatchRoute:
+    chat_id: int
+    brands: Tuple[str, ...] = ()
+    incident_types: Tuple[str, ...] = ()
+    locations: Tuple[str, ...] = ()
+
+    def matches(self, ticket: Ticket) -> bool:
+        if self.brands and ticket.brand not in self.brands:
+            return False
+        if self.incident_types and ticket.incident_type not in self.incident_types:
+            return False
+        if self.locations:
+            loc = (ticket.location or "").casefold()
+            if not any(word.casefold() in loc for word in self.locations):
+                return False
+        return True
+
+def parse_dispatch_routes(raw: str) -> List[DispatchRoute]:
+    if not raw.strip():
+        return []
+    try:
+        items = json.loads(raw)
+        return [
+            DispatchRoute(
+                chat_id=int(it["chat_id"]),
+                brands=_as_tuple(it.get("brand")),
+                incident_types=_as_tuple(it.get("incident_type")),
+                locations=_as_tuple(it.get("location")),
+            )
+            for it in items
+        ]
+    except (ValueError, TypeError, KeyError) as e:
+        logging.error("❌ DISPATCH_ROUTES не разобран (%s) — используем только DISPATCH_CHAT_ID", e)
+        return []
+
+dispatch_routes = parse_dispatch_routes(DISPATCH_ROUTES)
+
+def dispatch_targets(ticket: Ticket) -> List[int]:
+    targets: List[int] = []
+    for route in dispatch_routes:
+        if route.matches(ticket) and route.chat_id not in targets:
+            targets.append(route.chat_id)
+    if not targets and DISPATCH_CHAT_ID:
+        targets.append(DISPATCH_CHAT_ID)
+    return targets
+
+def all_dispatch_chat_ids() -> List[int]:
+    ids = {r.chat_id for r in dispatch_routes}
+    if DISPATCH_CHAT_ID:
+        ids.add(DISPATCH_CHAT_ID)
+    return sorted(ids)
+
+async def dispatch_evacuation(bot, ticket: Ticket, targets: List[int]) -> None:
+    """
+    Рассылает запрос эвакуатора во все целевые чаты параллельно.
+    Ошибка одного чата не мешает остальным; результаты пишем в dispatch_deliveries.
+    """
+    text_msg = f"🚨 Требуется диспетчер по заявке #{ticket.id}. Jira: {ticket.jira_main or '—'}"
+
+    async def send_one(chat_id: int) -> int:
+        invite_link = await invite_links.get(bot, chat_id)
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("Открыть беседу", url=invite_link)]]) if invite_link else None
+        msg = await bot.send_message(chat_id=chat_id, text=text_msg, reply_markup=markup)
+        return msg.message_id
+
+    results = await asyncio.gather(*(send_one(cid) for cid in targets), return_exceptions=True)
+    now = utc_now()
+    rows: List[Tuple[str, int, bool, Optional[int], Optional[str], datetime]] = []
+    for chat_id, res in zip(targets, results):
+        if isinstance(res, BaseException):
+            logging.warning("⚠️ Заявка #%s: не доставлено в чат %s: %s", ticket.id, chat_id, res)
+            rows.append((ticket.id, chat_id, False, None, str(res)[:500], now))
+        else:
+            rows.append((ticket.id, chat_id, True, res, None, now))
+    await store.log_dispatch_deliveries(rows)
+
 # =========================
 # Клавиатуры / рендеры
 # =========================
@@ -456,8 +809,8 @@ def set_field_local(ticket: Ticket, key: str, val: Optional[str]) -> None:
 
 def kb_choice(step_key: str) -> InlineKeyboardMarkup:
     rows: List[List[InlineKeyboardButton]] = []
-    for text, val in CHOICE_OPTIONS.get(step_key, []):
-        rows.append([InlineKeyboardButton(text, callback_data=f"set|{step_key}|{val}")])
+    for choice in jira_mapping.current.choices.get(step_key, ()):
+        rows.append([InlineKeyboardButton(choice.label, callback_data=f"set|{step_key}|{choice.code}")])
     if step_key != "incident_type":
         rows.append([InlineKeyboardButton("🚫 Не указывать", callback_data=f"nav|skip|{step_key}")])
         rows.append([InlineKeyboardButton("⬅ Назад", callback_data=f"nav|back|{step_key}")])
@@ -471,6 +824,28 @@ def kb_nav(cur_key: str, back: bool = True, skip: bool = True) -> InlineKeyboard
         rows.append([InlineKeyboardButton("⬅ Назад", callback_data=f"nav|back|{cur_key}")])
     return InlineKeyboardMarkup(rows or [])
 
+def render_plate_error(kind: str, brand: Optional[str]) -> str:
+    if kind == "plate_ref":
+        return ("❌ <b>Неверный формат</b> ❌\nОжидается: 2 буквы + 4 цифры + 2–3 цифры (регион)\n"
+                "Пример: AB1234 77\nМожно использовать латиницу или кириллицу.")
+    if brand == "KIA_CEED":
+        pattern = "Буква + 3 цифры + 2 буквы + 2–3 цифры"
+        example = "A123BC 77"
+    else:
+        pattern = "Буква + 3–4 цифры + 2 буквы + 2–3 цифры"
+        example = "A1234BC 77"
+    return (f"❌ <b>Ошибка в госномере</b> ❌\nОжидается: {pattern}\nПример: {example}\n"
+            f"Можно использовать латиницу или кириллицу — важны только количество и порядок.")
+
+def kb_plate_suggestions(step_key: str, entered: str, suggestions: List[str]) -> InlineKeyboardMarkup:
+    fmt = format_ref_display if step_key == "plate_ref" else format_vats_display
+    rows: List[List[InlineKeyboardButton]] = [
+        [InlineKeyboardButton(f"✅ {fmt(s)}", callback_data=f"set|{step_key}|{s}")] for s in suggestions
+    ]
+    rows.append([InlineKeyboardButton(f"Оставить {fmt(entered)}", callback_data=f"set|{step_key}|{entered}")])
+    rows.append([InlineKeyboardButton("⬅ Назад", callback_data=f"nav|back|{step_key}")])
+    return InlineKeyboardMarkup(rows)
+
 def kb_summary(ticket_id: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton(" ✍️ Внести изменения", callback_data="summary|edit")],
@@ -501,7 +876,7 @@ def kb_status_with_evac(ticket: Ticket) -> InlineKeyboardMarkup:
 def human(val: Optional[str], key: str) -> str:
     if val is None or val == "":
         return "—"
-    return HUMANIZE_VALUE.get(key, {}).get(val, val)
+    return jira_mapping.current.label(key, val)
 
 def render_preview(ticket: Ticket) -> str:
     def esc(s: Optional[str]) -> str:
@@ -572,14 +947,15 @@ def _select_value_or_text_or_adf(kind: str, raw_value: Optional[str], display_va
         return format_jira_datetime(utc_now())
     return display_value or raw_value
 
-def _option_from_code(code: Optional[str], mapping: Dict[str, str]) -> Optional[str]:
+def _option_from_code(mapping: JiraMapping, step: str, code: Optional[str]) -> Optional[str]:
     if not code:
         return None
-    return mapping.get(code, code)
+    return mapping.option(step, code)
 
 def render_jira_summary(ticket: Ticket) -> str:
-    itype = HUMANIZE_VALUE.get("incident_type", {}).get(ticket.incident_type or "", ticket.incident_type or "")
-    brand = HUMANIZE_VALUE.get("brand", {}).get(ticket.brand or "", ticket.brand or "")
+    mapping = jira_mapping.current
+    itype = mapping.label("incident_type", ticket.incident_type or "")
+    brand = mapping.label("brand", ticket.brand or "")
     plate = format_vats_display(ticket.plate_vats)
     base = f"[{itype or '-'}] {brand or '-'}"
     if plate and plate != "—":
@@ -587,6 +963,8 @@ def render_jira_summary(ticket: Ticket) -> str:
     return base
 
 def build_fields_main(ticket: Ticket) -> Dict[str, Any]:
+    # один снимок на всю сборку: подмена маппинга посреди не смешает старые и новые поля
+    mapping = jira_mapping.current
     fields: Dict[str, Any] = {
         "project": {"key": JIRA_PROJECT_KEY},
         "summary": render_jira_summary(ticket),
@@ -597,58 +975,66 @@ def build_fields_main(ticket: Ticket) -> Dict[str, Any]:
     else:
         fields["issuetype"] = {"name": JIRA_ISSUE_TYPE_MAIN}
 
-    if JIRA_CF_INCIDENT_TYPE:
-        display = _option_from_code(ticket.incident_type, INCIDENT_TYPE_OPTION_MAP)
-        fields[JIRA_CF_INCIDENT_TYPE] = _select_value_or_text_or_adf(JIRA_CF_INCIDENT_TYPE_KIND, ticket.incident_type, display)
-    if JIRA_CF_BRAND:
-        display = _option_from_code(ticket.brand, BRAND_OPTION_MAP)
-        fields[JIRA_CF_BRAND] = _select_value_or_text_or_adf(JIRA_CF_BRAND_KIND, ticket.brand, display)
-
-    if JIRA_CF_PLATE_VATS:
-        fields[JIRA_CF_PLATE_VATS] = _select_value_or_text_or_adf(
-            JIRA_CF_PLATE_VATS_KIND, ticket.plate_vats, format_vats_display(ticket.plate_vats) if ticket.plate_vats else None
+    cf = mapping.spec("incident_type")
+    if cf.id:
+        display = _option_from_code(mapping, "incident_type", ticket.incident_type)
+        fields[cf.id] = _select_value_or_text_or_adf(cf.kind, ticket.incident_type, display)
+    cf = mapping.spec("brand")
+    if cf.id:
+        display = _option_from_code(mapping, "brand", ticket.brand)
+        fields[cf.id] = _select_value_or_text_or_adf(cf.kind, ticket.brand, display)
+
+    cf = mapping.spec("plate_vats")
+    if cf.id:
+        fields[cf.id] = _select_value_or_text_or_adf(
+            cf.kind, ticket.plate_vats, format_vats_display(ticket.plate_vats) if ticket.plate_vats else None
         )
-    if JIRA_CF_PLATE_REF and ticket.brand != "KIA_CEED":
-        fields[JIRA_CF_PLATE_REF] = _select_value_or_text_or_adf(
-            JIRA_CF_PLATE_REF_KIND, ticket.plate_ref, format_ref_display(ticket.plate_ref) if ticket.plate_ref else None
+    cf = mapping.spec("plate_ref")
+    if cf.id and ticket.brand != "KIA_CEED":
+        fields[cf.id] = _select_value_or_text_or_adf(
+            cf.kind, ticket.plate_ref, format_ref_display(ticket.plate_ref) if ticket.plate_ref else None
         )
-    if JIRA_CF_LOCATION:
-        fields[JIRA_CF_LOCATION] = _select_value_or_text_or_adf(JIRA_CF_LOCATION_KIND, ticket.location)
-    if JIRA_CF_PROBLEM_DESC:
-        fields[JIRA_CF_PROBLEM_DESC] = _select_value_or_text_or_adf(JIRA_CF_PROBLEM_DESC_KIND, ticket.problem_desc)
-    if JIRA_CF_NOTES:
-        fields[JIRA_CF_NOTES] = _select_value_or_text_or_adf(JIRA_CF_NOTES_KIND, ticket.notes)
+    for name in ("location", "problem_desc", "notes"):
+        cf = mapping.spec(name)
+        if cf.id:
+            fields[cf.id] = _select_value_or_text_or_adf(cf.kind, getattr(ticket, name))
 
     try:
         created_dt = from_iso(ticket.created_at)
     except Exception:
         created_dt = utc_now()
 
-    if JIRA_CF_INCIDENT_DATE:
-        if JIRA_CF_INCIDENT_DATE_KIND == "date":
-            fields[JIRA_CF_INCIDENT_DATE] = format_jira_date(created_dt)
+    cf = mapping.spec("incident_date")
+    if cf.id:
+        if cf.kind == "date":
+            fields[cf.id] = format_jira_date(created_dt)
         else:
-            fields[JIRA_CF_INCIDENT_DATE] = _select_value_or_text_or_adf(JIRA_CF_INCIDENT_DATE_KIND, None)
-    if JIRA_CF_INCIDENT_TIME:
-        kind = (JIRA_CF_INCIDENT_TIME_KIND or "").lower()
+            fields[cf.id] = _select_value_or_text_or_adf(cf.kind, None)
+    cf = mapping.spec("incident_time")
+    if cf.id:
+        kind = (cf.kind or "").lower()
         if kind == "time":
-            fields[JIRA_CF_INCIDENT_TIME] = format_jira_time(created_dt)
+            fields[cf.id] = format_jira_time(created_dt)
         elif kind == "datetime":
-            fields[JIRA_CF_INCIDENT_TIME] = format_jira_datetime(created_dt)
+            fields[cf.id] = format_jira_datetime(created_dt)
         else:
-            fields[JIRA_CF_INCIDENT_TIME] = format_jira_time(created_dt)
+            fields[cf.id] = format_jira_time(created_dt)
 
-    def yesno(v: bool) -> Dict[str, str]:
-        return {"value": JIRA_OPT_YES if v else JIRA_OPT_NO}
-    if JIRA_CF_FLAG_REQUIRE_MECH and JIRA_CF_FLAG_REQUIRE_MECH_KIND == "select":
-        fields[JIRA_CF_FLAG_REQUIRE_MECH] = yesno(False)
-    if JIRA_CF_FLAG_PROBLEM_SOLVED and JIRA_CF_FLAG_PROBLEM_SOLVED_KIND == "select":
-        fields[JIRA_CF_FLAG_PROBLEM_SOLVED] = yesno(False)
-    if JIRA_CF_FLAG_REQUIRE_RA and JIRA_CF_FLAG_REQUIRE_RA_KIND == "select":
-        fields[JIRA_CF_FLAG_REQUIRE_RA] = yesno(False)
+    for name in ("flag_require_mech", "flag_problem_solved", "flag_require_ra"):
+        cf = mapping.spec(name)
+        if cf.id and cf.kind == "select":
+            fields[cf.id] = {"value": mapping.opt_no}
 
     return fields
 
+def select_flag_yes(name: str) -> Optional[Dict[str, Any]]:
+    """Поля для jira_update_fields, выставляющие флаг-select в «Да»; None — флаг не настроен."""
+    mapping = jira_mapping.current
+    cf = mapping.spec(name)
+    if cf.id and cf.kind == "select":
+        return {cf.id: {"value": mapping.opt_yes}}
+    return None
+
 # --- Сабтаски (универсальный билдер) ---
 
 def _issuetype_payload_from(id_value: Optional[str], name_value: Optional[str], prefer_id: bool) -> Dict[str, str]:
@@ -683,6 +1069,36 @@ def build_fields_subtask_try(
         "labels": labels or [],
     }
 
+_jira_client: Optional[httpx.AsyncClient] = None
+
+def jira_http() -> httpx.AsyncClient:
+    """Общий HTTP-клиент Jira: один пул соединений на процесс вместо клиента на каждый запрос."""
+    global _jira_client
+    if _jira_client is None or _jira_client.is_closed:
+        _jira_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=15.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _jira_client
+
+async def _jira_send(op: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+    """Запрос к Jira через общий клиент + метрика ra_jira_request_seconds{op, status}."""
+    t0 = time.perf_counter()
+    try:
+        with tracing.span("jira", op):
+            r = await jira_http().request(method, url, auth=(JIRA_EMAIL, JIRA_API_TOKEN), **kwargs)
+    except httpx.RequestError:
+        metrics.observe_jira(op, "network_error", time.perf_counter() - t0)
+        raise
+    metrics.observe_jira(op, str(r.status_code), time.perf_counter() - t0)
+    return r
+
+async def close_jira_http() -> None:
+    global _jira_client
+    if _jira_client is not None:
+        await _jira_client.aclose()
+        _jira_client = None
+
 def format_jira_error(status: int, body_text: str) -> str:
     lines = [f"HTTP {status}"]
     t = (body_text or "").strip()
@@ -710,13 +1126,11 @@ async def jira_create(fields: Dict[str, Any]) -> Tuple[Optional[str], Optional[s
     if not (JIRA_BASE_URL and JIRA_EMAIL and JIRA_API_TOKEN):
         return None, "Не задана конфигурация Jira (JIRA_BASE_URL, JIRA_EMAIL, JIRA_API_TOKEN)."
     url = f"{JIRA_BASE_URL}/rest/api/3/issue"
-    timeout = httpx.Timeout(30.0, connect=15.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            logging.info("→ JIRA POST %s fields=%s", url, json.dumps(fields, ensure_ascii=False)[:2000])
-            r = await client.post(url, json={"fields": fields}, auth=(JIRA_EMAIL, JIRA_API_TOKEN))
-        except httpx.RequestError as e:
-            return None, f"Сеть/подключение: {e!s}"
+    try:
+        logging.info("→ JIRA POST %s fields=%s", url, json.dumps(fields, ensure_ascii=False)[:2000])
+        r = await _jira_send("create", "POST", url, json={"fields": fields})
+    except httpx.RequestError as e:
+        return None, f"Сеть/подключение: {e!s}"
     if r.status_code == 201:
         try:
             data = r.json()
@@ -727,12 +1141,10 @@ async def jira_create(fields: Dict[str, Any]) -> Tuple[Optional[str], Optional[s
 
 async def jira_update_fields(issue_key: str, patch_fields: Dict[str, Any]) -> Optional[str]:
     url = f"{JIRA_BASE_URL}/rest/api/3/issue/{issue_key}"
-    timeout = httpx.Timeout(30.0, connect=15.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.put(url, json={"fields": patch_fields}, auth=(JIRA_EMAIL, JIRA_API_TOKEN))
-        except httpx.RequestError as e:
-            return f"Сеть/подключение: {e!s}"
+    try:
+        r = await _jira_send("update_fields", "PUT", url, json={"fields": patch_fields})
+    except httpx.RequestError as e:
+        return f"Сеть/подключение: {e!s}"
     if r.status_code in (204, 200):
         return None
     return format_jira_error(r.status_code, r.text)
@@ -742,24 +1154,31 @@ async def jira_link_issues(outward_key: str, inward_key: str, link_type: str = J
     payload = {"type": {"name": link_type},
                "outwardIssue": {"key": outward_key},
                "inwardIssue": {"key": inward_key}}
-    timeout = httpx.Timeout(30.0, connect=15.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.post(url, json=payload, auth=(JIRA_EMAIL, JIRA_API_TOKEN))
-        except httpx.RequestError as e:
-            return f"Сеть/подключение: {e!s}"
+    try:
+        r = await _jira_send("link_issues", "POST", url, json=payload)
+    except httpx.RequestError as e:
+        return f"Сеть/подключение: {e!s}"
+    if r.status_code in (201, 200):
+        return None
+    return format_jira_error(r.status_code, r.text)
+
+async def jira_add_remote_link(issue_key: str, link_url: str, title: str) -> Optional[str]:
+    url = f"{JIRA_BASE_URL}/rest/api/3/issue/{issue_key}/remotelink"
+    payload = {"object": {"url": link_url, "title": title}}
+    try:
+        r = await _jira_send("add_remote_link", "POST", url, json=payload)
+    except httpx.RequestError as e:
+        return f"Сеть/подключение: {e!s}"
     if r.status_code in (201, 200):
         return None
     return format_jira_error(r.status_code, r.text)
 
 async def jira_get_issue_basic(issue_key: str) -> Tuple[Optional[dict], Optional[str]]:
     url = f"{JIRA_BASE_URL}/rest/api/3/issue/{issue_key}"
-    timeout = httpx.Timeout(30.0, connect=15.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.get(url, params={"fields": "project"}, auth=(JIRA_EMAIL, JIRA_API_TOKEN))
-        except httpx.RequestError as e:
-            return None, f"Сеть/подключение: {e!s}"
+    try:
+        r = await _jira_send("get_issue_basic", "GET", url, params={"fields": "project"})
+    except httpx.RequestError as e:
+        return None, f"Сеть/подключение: {e!s}"
     if r.status_code == 200:
         try:
             return r.json(), None
@@ -769,12 +1188,10 @@ async def jira_get_issue_basic(issue_key: str) -> Tuple[Optional[dict], Optional
 
 async def jira_get_issuetypes() -> Tuple[Optional[List[dict]], Optional[str]]:
     url = f"{JIRA_BASE_URL}/rest/api/3/issuetype"
-    timeout = httpx.Timeout(30.0, connect=15.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.get(url, auth=(JIRA_EMAIL, JIRA_API_TOKEN))
-        except httpx.RequestError as e:
-            return None, f"Сеть/подключение: {e!s}"
+    try:
+        r = await _jira_send("get_issuetypes", "GET", url)
+    except httpx.RequestError as e:
+        return None, f"Сеть/подключение: {e!s}"
     if r.status_code == 200:
         try:
             return r.json(), None
@@ -799,12 +1216,10 @@ async def jira_get_project_createmeta_for_subtask(project_key: str, subtask_type
         "issuetypeIds": subtask_type_id,
         "expand": "projects.issuetypes.fields",
     }
-    timeout = httpx.Timeout(30.0, connect=15.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.get(url, params=params, auth=(JIRA_EMAIL, JIRA_API_TOKEN))
-        except httpx.RequestError as e:
-            return None, f"Сеть/подключение: {e!s}"
+    try:
+        r = await _jira_send("createmeta", "GET", url, params=params)
+    except httpx.RequestError as e:
+        return None, f"Сеть/подключение: {e!s}"
     if r.status_code == 200:
         try:
             return r.json(), None
@@ -823,6 +1238,71 @@ def _extract_required_fields_from_createmeta(createmeta: dict) -> List[Tuple[str
                     req.append((fid, fdef))
     return req
 
+# =========================
+# Группа инцидента
+# =========================
+
+def render_incident_chat_title(ticket: Ticket) -> str:
+    return f"#{ticket.id} {render_jira_summary(ticket)}"[:128]
+
+async def create_incident_chat(chat_factory, ticket: Ticket) -> Optional[int]:
+    """Создаёт группу инцидента через юзербота; ошибки не мешают созданию заявки в Jira."""
+    if chat_factory is None or ticket.incident_chat_id:
+        return ticket.incident_chat_id
+    backoff = chat_factory.backoff_seconds() if hasattr(chat_factory, "backoff_seconds") else 0.0
+    if backoff > INCIDENT_CHAT_MAX_WAIT_SEC:
+        logging.warning("⚠️ Заявка #%s: юзербот во FloodWait ещё %.0f с — группу не создаём", ticket.id, backoff)
+        return None
+    try:
+        # FloodWait, начавшийся уже во время создания, ждём не дольше того же порога
+        chat_id = await chat_factory.create_group_with_bot(
+            render_incident_chat_title(ticket), timeout=INCIDENT_CHAT_MAX_WAIT_SEC,
+        )
+    except Exception as e:
+        logging.warning("⚠️ Заявка #%s: не удалось создать группу инцидента: %s", ticket.id, e)
+        return None
+    ticket.incident_chat_id = chat_id
+    await store.save_field(ticket.id, "incident_chat_id", chat_id)
+    return chat_id
+
+async def create_incident_invite_link(bot, ticket: Ticket) -> Optional[str]:
+    """
+    Бессрочная ссылка в группу инцидента: она уходит в Jira и водителю навсегда,
+    поэтому не через InviteLinkCache (там ссылки диспетчерских чатов с INVITE_LINK_TTL_SEC).
+    """
+    try:
+        link = await bot.create_chat_invite_link(
+            chat_id=ticket.incident_chat_id, name=f"#{ticket.id}", creates_join_request=False
+        )
+    except TelegramError as e:
+        logging.warning("⚠️ Заявка #%s: не удалось создать инвайт-ссылку группы: %s", ticket.id, e)
+        return None
+    return link.invite_link
+
+async def finalize_incident_chat(bot, ticket: Ticket, user_chat_id: int) -> None:
+    """
+    Когда есть и группа, и задача: постим в группу ключ Jira и инвайт,
+    вешаем ссылку на группу в задачу и отдаём её водителю.
+    """
+    chat_id = ticket.incident_chat_id
+    if not chat_id:
+        return
+    invite_link = await create_incident_invite_link(bot, ticket)
+    lines = [f"🚨 Заявка #{ticket.id}: {_html_escape(render_jira_summary(ticket))}"]
+    if ticket.jira_main:
+        lines.append(f"Jira: <a href=\"{JIRA_BASE_URL}/browse/{ticket.jira_main}\">{ticket.jira_main}</a>")
+    if invite_link:
+        lines.append(f"Приглашение в группу: {invite_link}")
+    await bot.send_message(chat_id=chat_id, text="\n".join(lines))
+
+    if invite_link and ticket.jira_main:
+        err = await jira_add_remote_link(ticket.jira_main, invite_link, f"Telegram: {render_incident_chat_title(ticket)}")
+        if err:
+            logging.warning("⚠️ Не удалось добавить ссылку на группу в %s: %s", ticket.jira_main, err)
+    if invite_link:
+        markup = InlineKeyboardMarkup([[InlineKeyboardButton("Открыть группу инцидента", url=invite_link)]])
+        await bot.send_message(chat_id=user_chat_id, text=f"💬 Группа по заявке #{ticket.id} создана.", reply_markup=markup)
+
 # =========================
 # Черновик и шаги
 # =========================
@@ -841,6 +1321,53 @@ async def start_new_draft(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await store.create_ticket(ticket)
     return ticket
 
+def callback_ticket_id(data: str) -> Optional[str]:
+    """id заявки из кнопок act|<действие>|<id>, st|<id>|<статус>, close|<id>."""
+    parts = data.split("|")
+    if parts[0] == "act" and len(parts) == 3:
+        return parts[2]
+    if parts[0] in ("st", "close") and len(parts) >= 2:
+        return parts[1]
+    return None
+
+async def restore_draft(context: ContextTypes.DEFAULT_TYPE, ticket_id: str, user_id: int) -> Optional[Ticket]:
+    """
+    Черновика в памяти нет: шард пользователя переехал на этот инстанс (cluster.py), бот
+    перезапустился или _drop_stale_drafts сбросил устаревшую копию. Кнопки отправленной
+    заявки несут её id — собираем Ticket из tickets/status_done. Незаконченную анкету так
+    не восстановить: её кнопки без id, водитель начнёт заново.
+    """
+    found = await store.fetch_ticket(ticket_id)
+    if found is None:
+        return None
+    row, done = found
+    if row["user_id"] != user_id:
+        return None
+    ticket = Ticket(
+        id=row["id"],
+        user_id=row["user_id"],
+        username=row["username"],
+        created_at=iso(row["created_at"]),
+        incident_type=row["incident_type"],
+        brand=row["brand"],
+        plate_vats=row["plate_vats"],
+        plate_ref=row["plate_ref"],
+        location=row["location"],
+        problem_desc=row["problem_desc"],
+        notes=row["notes"],
+        status_done_at={k: iso(ts) for k, ts in done.items()},
+        closed_at=iso(row["closed_at"]) if row["closed_at"] else None,
+        jira_main=row["jira_main"],
+        jira_mech=row["jira_mech"],
+        jira_ra=row["jira_ra"],
+        incident_chat_id=row["incident_chat_id"],
+    )
+    draft = get_draft(context)
+    draft["ticket"] = ticket
+    draft["step_idx"] = 0
+    draft["editing"] = False
+    return ticket
+
 async def ask_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     key = current_step_key(context)
     prompt = QUESTION_LABELS[key]
@@ -850,16 +1377,39 @@ async def ask_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     else:
         await context.bot.send_message(update.effective_chat.id, prompt, reply_markup=kb_nav(cur_key=key, back=True, skip=True))
 
+async def ask_plate_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE, key: str, kind: str, norm: str) -> bool:
+    """
+    Номера нет в реестре парка — предлагаем похожие (расстояние 1–2) или оставить как есть.
+    True — вопрос задан, ответ придёт callback'ом set|...
+    """
+    if not fleet.enabled or fleet.contains(kind, norm):
+        return False
+    fmt = format_ref_display if kind == "ref" else format_vats_display
+    if kind == "ref":
+        suggestions = fleet.suggest(kind, norm)
+    else:
+        # номер другой марки не пройдёт проверку в set| — такие не предлагаем
+        brand = get_draft(context)["ticket"].brand
+        suggestions = [p for p in fleet.suggest(kind, norm, brand=brand) if normalize_vats_plate(p, brand=brand)]
+    text = f"⚠️ Номер <b>{fmt(norm)}</b> не найден в парке."
+    text += "\nВозможно, вы имели в виду:" if suggestions else "\nПроверьте номер или оставьте как есть."
+    await context.bot.send_message(update.effective_chat.id, text, reply_markup=kb_plate_suggestions(key, norm, suggestions))
+    return True
+
 # =========================
 # Хэндлеры
 # =========================
 
+@metrics.timed_handler("cmd_start")
+@tracing.traced_update("cmd_start")
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_chat.type != ChatType.PRIVATE:
         return
     await start_new_draft(update, context)
     await context.bot.send_message(update.effective_chat.id, "Пожалуйста, выбери тип происшествия:", reply_markup=kb_choice("incident_type"))
 
+@metrics.timed_handler("on_text")
+@tracing.traced_update("on_text")
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_chat.type != ChatType.PRIVATE:
         return
@@ -876,19 +1426,13 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if kind == "plate":
         norm = normalize_vats_plate(text, brand=ticket.brand)
         if not norm:
-            if ticket.brand == "KIA_CEED":
-                pattern = "Буква + 3 цифры + 2 буквы + 2–3 цифры"
-                example = "A123BC 77"
-            else:
-                pattern = "Буква + 3–4 цифры + 2 буквы + 2–3 цифры"
-                example = "A1234BC 77"
             await context.bot.send_message(
-                update.effective_chat.id,
-                f"❌ <b>Ошибка в госномере</b> ❌\nОжидается: {pattern}\nПример: {example}\n"
-                f"Можно использовать латиницу или кириллицу — важны только количество и порядок.",
+                update.effective_chat.id, render_plate_error(kind, ticket.brand),
                 reply_markup=kb_nav(cur_key=key, back=True, skip=True),
             )
             return
+        if await ask_plate_confirmation(update, context, key, "vats", norm):
+            return
         set_field_local(ticket, key, norm)
         await store.save_field(ticket.id, key, norm)
         await store.log_input(ticket.id, key, norm, utc_now())
@@ -897,12 +1441,12 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         norm = normalize_ref_plate(text)
         if not norm:
             await context.bot.send_message(
-                update.effective_chat.id,
-                "❌ <b>Неверный формат</b> ❌\nОжидается: 2 буквы + 4 цифры + 2–3 цифры (регион)\n"
-                "Пример: AB1234 77\nМожно использовать латиницу или кириллицу.",
+                update.effective_chat.id, render_plate_error(kind, ticket.brand),
                 reply_markup=kb_nav(cur_key=key, back=True, skip=True),
             )
             return
+        if await ask_plate_confirmation(update, context, key, "ref", norm):
+            return
         set_field_local(ticket, key, norm)
         await store.save_field(ticket.id, key, norm)
         await store.log_input(ticket.id, key, norm, utc_now())
@@ -930,6 +1474,8 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     goto_next_step(context)
     await ask_step(update, context)
 
+@metrics.timed_handler("on_callback", action=metrics.callback_action)
+@tracing.traced_update("on_callback", action=metrics.callback_action)
 async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_chat.type != ChatType.PRIVATE:
         return
@@ -938,8 +1484,10 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     data = query.data or ""
     draft = get_draft(context)
     if "ticket" not in draft:
-        await cmd_start(update, context)
-        return
+        ticket_id = callback_ticket_id(data)
+        if not ticket_id or await restore_draft(context, ticket_id, update.effective_user.id) is None:
+            await cmd_start(update, context)
+            return
     ticket: Ticket = draft["ticket"]
 
     # Навигация по анкете
@@ -985,6 +1533,23 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         _, field_key, value = data.split("|", 2)
         if field_key not in ALL_STEP_KEYS:
             return
+        # кнопка из клавиатуры до смены маппинга: такого варианта уже нет
+        if STEP_INPUT_KIND[field_key] == "choice" and not jira_mapping.current.has_choice(field_key, value):
+            await safe_edit_message_text(query, text=QUESTION_LABELS[field_key], reply_markup=kb_choice(field_key))
+            return
+        # номер из подсказки реестра: нормализуем заново, callback_data приходит от клиента
+        if STEP_INPUT_KIND[field_key] == "plate":
+            value = normalize_vats_plate(value, brand=ticket.brand)
+        elif STEP_INPUT_KIND[field_key] == "plate_ref":
+            value = normalize_ref_plate(value)
+        if not value:
+            if STEP_INPUT_KIND[field_key] in ("plate", "plate_ref"):
+                # например, марку сменили после подсказки — просим ввести номер заново
+                await safe_edit_message_text(
+                    query, text=render_plate_error(STEP_INPUT_KIND[field_key], ticket.brand),
+                    reply_markup=kb_nav(cur_key=field_key, back=True, skip=True),
+                )
+            return
         set_field_local(ticket, field_key, value)
         await store.save_field(ticket.id, field_key, value)
         await store.log_input(ticket.id, field_key, value, utc_now())
@@ -1032,7 +1597,12 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     if data == "summary|create":
         fields_main = build_fields_main(ticket)
-        jira_key, jira_err = await jira_create(fields_main)
+        had_chat = ticket.incident_chat_id
+        # Jira и группа инцидента создаются параллельно: ждём только более медленную из операций
+        (jira_key, jira_err), _ = await asyncio.gather(
+            jira_create(fields_main),
+            create_incident_chat(context.application.bot_data.get("chat_factory"), ticket),
+        )
         if jira_key:
             ticket.jira_main = jira_key
             await store.save_field(ticket.id, "jira_main", jira_key)
@@ -1044,6 +1614,10 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         else:
             safe_err = jira_err or "Неизвестная ошибка"
             await safe_edit_message_text(query, text=f"⚠️ Не удалось создать задачу в Jira.\n<pre>{_html_escape(safe_err)}</pre>", parse_mode=ParseMode.HTML)
+        if ticket.incident_chat_id and (jira_key or not had_chat):
+            context.application.create_task(
+                finalize_incident_chat(context.bot, ticket, update.effective_chat.id), update=update
+            )
         return
 
     # Дальнейшие действия после создания основной
@@ -1134,8 +1708,9 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                 ticket.jira_mech = created_key
                 await store.save_field(ticket.id, "jira_mech", created_key)
 
-                if JIRA_CF_FLAG_REQUIRE_MECH and JIRA_CF_FLAG_REQUIRE_MECH_KIND == "select":
-                    err2 = await jira_update_fields(ticket.jira_main, {JIRA_CF_FLAG_REQUIRE_MECH: {"value": JIRA_OPT_YES}})
+                flag = select_flag_yes("flag_require_mech")
+                if flag:
+                    err2 = await jira_update_fields(ticket.jira_main, flag)
                     if err2:
                         await context.bot.send_message(update.effective_chat.id, f"⚠️ Не удалось обновить флаг «Требуется дежмех»: {err2}")
 
@@ -1146,8 +1721,9 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             if not ticket.jira_main:
                 await safe_edit_message_text(query, text="Сначала создайте основную задачу.")
                 return
-            if JIRA_CF_FLAG_PROBLEM_SOLVED and JIRA_CF_FLAG_PROBLEM_SOLVED_KIND == "select":
-                err = await jira_update_fields(ticket.jira_main, {JIRA_CF_FLAG_PROBLEM_SOLVED: {"value": JIRA_OPT_YES}})
+            flag = select_flag_yes("flag_problem_solved")
+            if flag:
+                err = await jira_update_fields(ticket.jira_main, flag)
                 if err:
                     await safe_edit_message_text(query, text=f"⚠️ Не удалось выставить «Проблема решена»: {err}")
                     return
@@ -1232,8 +1808,9 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                 ticket.jira_ra = created_key
                 await store.save_field(ticket.id, "jira_ra", created_key)
 
-                if JIRA_CF_FLAG_REQUIRE_RA and JIRA_CF_FLAG_REQUIRE_RA_KIND == "select":
-                    err2 = await jira_update_fields(ticket.jira_main, {JIRA_CF_FLAG_REQUIRE_RA: {"value": JIRA_OPT_YES}})
+                flag = select_flag_yes("flag_require_ra")
+                if flag:
+                    err2 = await jira_update_fields(ticket.jira_main, flag)
                     if err2:
                         await context.bot.send_message(update.effective_chat.id, f"⚠️ Не удалось обновить флаг «Требуется RA»: {err2}")
 
@@ -1241,23 +1818,12 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             return
 
         if action == "evac":
-            if not DISPATCH_CHAT_ID:
-                await safe_edit_message_text(query, text="Не задан DISPATCH_CHAT_ID в .env — некуда отправлять сообщение для диспетчера.")
+            targets = dispatch_targets(ticket)
+            if not targets:
+                await safe_edit_message_text(query, text="Не задан DISPATCH_CHAT_ID / DISPATCH_ROUTES в .env — некуда отправлять сообщение для диспетчера.")
                 return
-            invite_link = None
-            try:
-                link = await context.bot.create_chat_invite_link(chat_id=DISPATCH_CHAT_ID, creates_join_request=False)
-                invite_link = link.invite_link
-            except TelegramError:
-                invite_link = None
-
-            text_msg = f"🚨 Требуется диспетчер по заявке #{ticket.id}. Jira: {ticket.jira_main or '—'}"
-            if invite_link:
-                markup = InlineKeyboardMarkup([[InlineKeyboardButton("Открыть беседу", url=invite_link)]])
-                await context.bot.send_message(chat_id=DISPATCH_CHAT_ID, text=text_msg, reply_markup=markup)
-            else:
-                await context.bot.send_message(chat_id=DISPATCH_CHAT_ID, text=text_msg)
-
+            # рассылка идёт в фоне: подтверждение пользователю не ждёт самый медленный чат
+            context.application.create_task(dispatch_evacuation(context.bot, ticket, targets), update=update)
             await safe_edit_message_text(query, text="🧷 Запрос диспетчеру отправлен.", reply_markup=kb_status_with_evac(ticket))
             return
 
@@ -1270,12 +1836,16 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         if st_key not in valid:
             return
         now = utc_now()
-        if st_key not in ticket.status_done_at:
-            ticket.status_done_at[st_key] = iso(now)
-            await store.set_status_done(ticket.id, st_key, now)
-        else:
-            await store.set_status_done(ticket.id, st_key, now)
-        await safe_edit_reply_markup(query, reply_markup=kb_status_with_evac(ticket))
+        ticket.status_done_at.setdefault(st_key, iso(now))
+        # клавиатуру рисуем по состоянию тикета на момент правки, а не нажатия
+        msg_key = (query.message.chat_id, query.message.message_id) if query.message else query.inline_message_id
+        status_edits.schedule(
+            context.application,
+            msg_key,
+            lambda: safe_edit_reply_markup(query, reply_markup=kb_status_with_evac(ticket)),
+            update=update,
+        )
+        await store.set_status_done(ticket.id, st_key, now)
         return
 
     # Закрыть заявку (локально)
@@ -1293,12 +1863,21 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 # Error handler и запуск
 # =========================
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.exception("Unhandled exception while processing update: %s", update)
 
+async def on_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # бота лишили админки или убрали из чата — его инвайт-ссылки Telegram уже отозвал
+    member = update.my_chat_member
+    if member and member.new_chat_member.status not in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER):
+        chat_id = member.chat.id
+        invite_links.invalidate(chat_id)
+        await store.delete_invite_link(chat_id)
+        if cluster is not None:
+            cluster.publish("invite_link", chat_id)
+
 def kb_edit_field_list(context: ContextTypes.DEFAULT_TYPE) -> InlineKeyboardMarkup:
     rows = []
     for key in active_steps(context):
@@ -1306,13 +1885,20 @@ def kb_edit_field_list(context: ContextTypes.DEFAULT_TYPE) -> InlineKeyboardMark
     rows.append([InlineKeyboardButton("⬅ Назад к итогу", callback_data="edit|cancel")])
     return InlineKeyboardMarkup(rows)
 
-def build_app() -> Application:
-    request = HTTPXRequest(
-        connect_timeout=30.0,
-        read_timeout=70.0,
-        write_timeout=30.0,
-        pool_timeout=70.0,
-    )
+def build_application(chat_factory=None, *, request: Optional[BaseRequest] = None) -> Application:
+    """
+    Собирает PTB-приложение. chat_factory — объект с create_group_with_bot(title, *, timeout) -> chat_id
+    (см. chat_factory_adapter.py), доступен хэндлерам как bot_data["chat_factory"].
+    request — свой транспорт Bot API (например, fake_services.FakeBotRequest для бенчмарков).
+    """
+    tracing.configure(TRACE_SLOW_MS)
+    if request is None:
+        request = tracing.TracedHTTPXRequest(
+            connect_timeout=30.0,
+            read_timeout=70.0,
+            write_timeout=30.0,
+            pool_timeout=70.0,
+        )
     defaults = Defaults(parse_mode=ParseMode.HTML)
 
     async def _post_init(app: Application) -> None:
@@ -1329,57 +1915,83 @@ def build_app() -> Application:
         .build()
     )
 
+    if update_recorder.enabled:
+        # группа -1 — до основных хэндлеров, пока в черновике ещё прежний id заявки
+        app.add_handler(TypeHandler(Update, update_recorder.on_update), group=-1)
     app.add_handler(CommandHandler("start", cmd_start, filters.ChatType.PRIVATE))
     app.add_handler(CallbackQueryHandler(on_callback))
     app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND, on_text))
+    app.add_handler(ChatMemberHandler(on_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
     app.add_error_handler(on_error)
+    app.bot_data["chat_factory"] = chat_factory
     return app
 
+def _drop_stale_drafts(app: Application, ticket_id: str) -> None:
+    # заявку поменял другой инстанс (шард пользователя переехал) — наша копия в памяти устарела;
+    # кнопки отправленной заявки соберут её заново из базы (restore_draft), а не допишут поверх
+    # чужих изменений
+    for user_data in app.user_data.values():
+        ticket = user_data.get("draft", {}).get("ticket")
+        if ticket is not None and ticket.id == ticket_id:
+            user_data.pop("draft", None)
+
+async def on_startup(app: Application) -> None:
+    """Фоновые службы бота; вызывается после app.start()."""
+    if cluster is not None:
+        cluster.on_invalidate("ticket", lambda key: _drop_stale_drafts(app, key))
+        cluster.on_invalidate("invite_link", lambda key: invite_links.invalidate(int(key)))
+    jira_mapping.start()
+    pg_listener.start()
+    fleet.start()
+    stage_rollup.start()
+    update_recorder.start()
+    metrics.bind_state(pool=lambda: store.pool, application=app)
+    # ссылки создаём в фоне, чтобы первое «Требуется эвакуатор» не ждало Bot API
+    chat_ids = all_dispatch_chat_ids()
+    if chat_ids:
+        app.create_task(invite_links.warm(app.bot, chat_ids), name="invite-links-warm")
+
+async def on_shutdown(app: Application) -> None:
+    """Досылает накопленное фоновыми службами; вызывается до app.stop()."""
+    await fleet.aclose()
+    await stage_rollup.aclose()
+    await update_recorder.stop()
+    await pg_listener.aclose()
+    await jira_mapping.aclose()
+
 # ---- запуск
+async def start_receiving(app: Application) -> None:
+    """Начать приём апдейтов: свой long polling или, в CLUSTER_MODE, очередь кластера."""
+    if cluster is not None:
+        cluster.start(app)
+    else:
+        await app.updater.start_polling()
+
+async def stop_receiving(app: Application) -> None:
+    """Перестать принимать апдейты и доработать принятые; вызывается до on_shutdown()."""
+    if cluster is not None:
+        await cluster.aclose()
+    elif app.updater and app.updater.running:
+        await app.updater.stop()
+
 async def _run_with_updater(app: Application) -> None:
     await app.initialize()
     await app.start()
-    await app.updater.start_polling()
+    await on_startup(app)
+    await start_receiving(app)
     try:
         await asyncio.Event().wait()
     finally:
-        await app.updater.stop()
+        await stop_receiving(app)
+        await on_shutdown(app)
         await app.stop()
+        await app.shutdown()
+        await close_jira_http()
         await store.close()
-# =========================
-# API для Telegram WebApp
-# =========================
-
-from fastapi import FastAPI, Request
-from telegram import Bot
-
-# создаём API и бота
-api = FastAPI()
-bot_api = Bot(token=BOT_TOKEN)
-
-@api.post("/api/from_webapp")
-async def from_webapp(req: Request):
-    """
-    Этот маршрут принимает данные из твоего React-приложения (WebApp)
-    и отправляет уведомление пользователю в Telegram.
-    """
-    data = await req.json()
-    user_id = data.get("user_id")
-    action = data.get("action")
-
-    if user_id:
-        msg = f"📩 Пользователь нажал кнопку в WebApp! (действие: {action})"
-        try:
-            await bot_api.send_message(chat_id=user_id, text=msg)
-        except Exception as e:
-            return {"status": "error", "details": str(e)}
-
-    return {"status": "ok"}
 
 if __name__ == "__main__":
-    if not BOT_TOKEN or not DATABASE_URL:
-        raise SystemExit("Заполните .env: BOT_TOKEN, DATABASE_URL")
-    application = build_app()
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    application = build_application()
     if getattr(application, "updater", None) is not None:
         asyncio.run(_run_with_updater(application))
     else:
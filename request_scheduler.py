@@ -0,0 +1,215 @@
+# request_scheduler.py
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telethon import TelegramClient, errors
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0     # пользователь ждёт прямо сейчас
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20     # фоновые задачи (пополнение пула и т.п.)
+
+
+class SchedulerBackoff(Exception):
+    """Семейство запросов в FloodWait дольше, чем позволяет дедлайн вызова."""
+    def __init__(self, family: str, wait: float):
+        super().__init__(f"{family}: FloodWait ещё {wait:.0f} с")
+        self.family = family
+        self.wait = wait
+
+
+@dataclass(order=True)
+class _Item:
+    priority: int
+    seq: int
+    fn: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    deadline: Optional[float] = field(compare=False, default=None)
+    attempts: int = field(compare=False, default=0)
+
+
+class _Lane:
+    """Очередь одного семейства методов: свой темп и своё состояние FloodWait."""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.heap: List[_Item] = []
+        self.wakeup = asyncio.Event()
+        self.next_at = 0.0        # раньше этого момента следующий запрос не шлём (темп)
+        self.blocked_until = 0.0  # FloodWait от Telegram
+        self.task: Optional[asyncio.Task] = None
+
+
+class RequestScheduler:
+    """
+    Планировщик MTProto-запросов поверх TelegramClient:
+    - темп по семействам методов ("channels.CreateChannel", ...), запросы одного семейства идут по одному;
+    - FloodWait не пробрасывается сразу: семейство засыпает на указанное время (+джиттер), запрос повторяется;
+    - очередь с приоритетами и дедлайнами: если ждать дольше дедлайна — SchedulerBackoff сразу;
+    - backoff()/state() показывают текущее состояние, чтобы вызывающий мог деградировать, а не висеть.
+    Настройки клиента не трогает: автосон Telethon на FloodWait выключается только для
+    запросов, идущих через планировщик (flood_sleep_threshold=0 в вызове).
+    """
+    DEFAULT_INTERVALS: Dict[str, float] = {
+        "channels.CreateChannel": 3.0,
+        "channels.InviteToChannel": 1.0,
+        "channels.EditAdmin": 1.0,
+        "channels.EditTitle": 1.0,
+        "contacts.ResolveUsername": 1.0,
+    }
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        *,
+        intervals: Optional[Dict[str, float]] = None,
+        default_interval: float = 0.1,
+        max_retries: int = 3,
+        max_flood_wait: float = 900.0,
+        jitter: float = 0.1,
+    ):
+        self._client = client
+        self._intervals = {**self.DEFAULT_INTERVALS, **(intervals or {})}
+        self._default_interval = default_interval
+        self._max_retries = max_retries
+        self._max_flood_wait = max_flood_wait
+        self._jitter = jitter
+        self._lanes: Dict[str, _Lane] = {}
+        self._seq = itertools.count()
+
+    @staticmethod
+    def family_of(request: Any) -> str:
+        module = type(request).__module__.rsplit(".", 1)[-1]
+        name = type(request).__name__
+        if name.endswith("Request"):
+            name = name[: -len("Request")]
+        return f"{module}.{name}"
+
+    async def call(
+        self,
+        request: Any,
+        *,
+        priority: int = PRIORITY_NORMAL,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        return await self.run(
+            self.family_of(request),
+            lambda: self._client(request, flood_sleep_threshold=0),
+            priority=priority,
+            timeout=timeout,
+        )
+
+    async def run(
+        self,
+        family: str,
+        fn: Callable[[], Awaitable[Any]],
+        *,
+        priority: int = PRIORITY_NORMAL,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Выполняет fn() в очереди семейства family. fn должна быть повторяемой (для ретраев) и
+        пробрасывать FloodWaitError (client(request, flood_sleep_threshold=0)), иначе Telethon
+        проспит его сам, мимо очереди. timeout — сколько вызывающий готов ждать FloodWait.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        lane = self._lane(family)
+        wait = lane.blocked_until - loop.time()
+        if deadline is not None and wait > 0 and loop.time() + wait > deadline:
+            raise SchedulerBackoff(family, wait)
+        item = _Item(priority, next(self._seq), fn, loop.create_future(), deadline)
+        heapq.heappush(lane.heap, item)
+        lane.wakeup.set()
+        return await item.future
+
+    def backoff(self, family: str) -> float:
+        """Сколько секунд семейство ещё в FloodWait (0 — можно слать)."""
+        lane = self._lanes.get(family)
+        if lane is None:
+            return 0.0
+        return max(0.0, lane.blocked_until - asyncio.get_running_loop().time())
+
+    def state(self) -> Dict[str, Dict[str, float]]:
+        return {
+            family: {"backoff": self.backoff(family), "queued": len(lane.heap)}
+            for family, lane in self._lanes.items()
+        }
+
+    async def aclose(self) -> None:
+        tasks = [lane.task for lane in self._lanes.values() if lane.task]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for lane in self._lanes.values():
+            for item in lane.heap:
+                if not item.future.done():
+                    item.future.cancel()
+        self._lanes.clear()
+
+    def _lane(self, family: str) -> _Lane:
+        lane = self._lanes.get(family)
+        if lane is None:
+            lane = _Lane(self._intervals.get(family, self._default_interval))
+            lane.task = asyncio.create_task(self._worker(family, lane), name=f"tg-lane-{family}")
+            self._lanes[family] = lane
+        return lane
+
+    def _expire(self, family: str, lane: _Lane, ready_at: float) -> None:
+        # тем, кто не дождётся окна до своего дедлайна, сразу отвечаем SchedulerBackoff
+        keep: List[_Item] = []
+        now = asyncio.get_running_loop().time()
+        for item in lane.heap:
+            if item.future.done():
+                continue
+            if item.deadline is not None and item.deadline < ready_at:
+                item.future.set_exception(SchedulerBackoff(family, ready_at - now))
+            else:
+                keep.append(item)
+        heapq.heapify(keep)
+        lane.heap = keep
+
+    async def _worker(self, family: str, lane: _Lane) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not lane.heap:
+                lane.wakeup.clear()
+                await lane.wakeup.wait()
+                continue
+            ready_at = max(lane.next_at, lane.blocked_until)
+            if ready_at > loop.time():
+                self._expire(family, lane, ready_at)
+                await asyncio.sleep(ready_at - loop.time())
+                continue
+            item = heapq.heappop(lane.heap)
+            if item.future.done():  # вызывающий отменил ожидание
+                continue
+            lane.next_at = loop.time() + lane.interval
+            try:
+                result = await item.fn()
+            except errors.FloodWaitError as e:
+                item.attempts += 1
+                lane.blocked_until = loop.time() + e.seconds * (1 + random.uniform(0, self._jitter)) + 1
+                logger.warning("FloodWait %s с на %s (попытка %s)", e.seconds, family, item.attempts)
+                if item.attempts > self._max_retries or e.seconds > self._max_flood_wait:
+                    item.future.set_exception(e)
+                elif item.deadline is not None and lane.blocked_until > item.deadline:
+                    item.future.set_exception(SchedulerBackoff(family, lane.blocked_until - loop.time()))
+                else:
+                    heapq.heappush(lane.heap, item)
+            except asyncio.CancelledError:
+                if not item.future.done():
+                    item.future.cancel()
+                raise
+            except Exception as e:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            else:
+                if not item.future.done():
+                    item.future.set_result(result)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plates import normalize_ref_plates, normalize_vats_plates  # noqa: E402
+
+# Перенормализация госномеров в старых заявках после смены правил (plates.py).
+# Заявки читаются серверным курсором по возрастанию id, изменившиеся plate_vats/plate_ref
+# обновляются одним UPDATE ... FROM unnest(...) на пачку; в той же транзакции сохраняется
+# контрольная точка (последний обработанный id), так что прерванный прогон продолжается с неё.
+#   python scripts/backfill_plates.py --chunk 2000 --dry-run
+#   python scripts/backfill_plates.py --name rules-2024-06
+#
+# Нераспознанный номер не затираем: если новая нормализация вернула None, значение остаётся как есть.
+
+logger = logging.getLogger("backfill_plates")
+
+Row = Tuple[str, Optional[str], Optional[str]]  # (id, plate_vats, plate_ref)
+
+
+async def ensure_checkpoint_table(con: asyncpg.Connection) -> None:
+    await con.execute("""
+    CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+      name        TEXT PRIMARY KEY,
+      last_id     TEXT NOT NULL,
+      processed   BIGINT NOT NULL DEFAULT 0,
+      updated     BIGINT NOT NULL DEFAULT 0,
+      updated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+
+
+async def load_checkpoint(con: asyncpg.Connection, name: str) -> Tuple[str, int, int]:
+    row = await con.fetchrow("SELECT last_id, processed, updated FROM backfill_checkpoints WHERE name=$1", name)
+    if row is None:
+        return "", 0, 0
+    return row["last_id"], row["processed"], row["updated"]
+
+
+def renormalize(records: List[asyncpg.Record]) -> List[Row]:
+    """Изменившиеся строки пачки: (id, новый plate_vats, новый plate_ref)."""
+    vats = normalize_vats_plates((r["plate_vats"], r["brand"]) for r in records)
+    refs = normalize_ref_plates(r["plate_ref"] for r in records)
+    changed: List[Row] = []
+    for r, v, p in zip(records, vats, refs):
+        new_v = v or r["plate_vats"]
+        new_p = p or r["plate_ref"]
+        if new_v != r["plate_vats"] or new_p != r["plate_ref"]:
+            changed.append((r["id"], new_v, new_p))
+    return changed
+
+
+async def apply_chunk(
+    con: asyncpg.Connection, name: str, changed: List[Row], last_id: str, processed: int, updated: int, dry_run: bool
+) -> None:
+    async with con.transaction():
+        if changed and not dry_run:
+            ids, vats, refs = zip(*changed)
+            await con.execute(
+                """
+                UPDATE tickets t
+                SET plate_vats = u.plate_vats, plate_ref = u.plate_ref
+                FROM unnest($1::text[], $2::text[], $3::text[]) AS u(id, plate_vats, plate_ref)
+                WHERE t.id = u.id
+                """,
+                list(ids), list(vats), list(refs),
+            )
+        if not dry_run:
+            await con.execute(
+                """
+                INSERT INTO backfill_checkpoints(name, last_id, processed, updated, updated_at)
+                VALUES ($1, $2, $3, $4, now())
+                ON CONFLICT (name) DO UPDATE
+                SET last_id = EXCLUDED.last_id, processed = EXCLUDED.processed,
+                    updated = EXCLUDED.updated, updated_at = now()
+                """,
+                name, last_id, processed, updated,
+            )
+
+
+async def run(args) -> None:
+    dsn = args.dsn or os.getenv("DATABASE_URL", "")
+    if not dsn:
+        raise SystemExit("Укажите --dsn или DATABASE_URL")
+    # чтение и запись — на разных соединениях: курсор живёт в своей транзакции,
+    # а пачки с контрольной точкой коммитятся сразу
+    reader = await asyncpg.connect(dsn)
+    writer = await asyncpg.connect(dsn)
+    try:
+        await ensure_checkpoint_table(writer)
+        if args.reset:
+            await writer.execute("DELETE FROM backfill_checkpoints WHERE name=$1", args.name)
+        last_id, processed, updated = await load_checkpoint(writer, args.name)
+        if last_id:
+            logger.info("Продолжаем с id > %s (уже обработано %s, обновлено %s)", last_id, processed, updated)
+        t0 = time.perf_counter()
+        done = 0
+        async with reader.transaction(readonly=True):
+            cur = await reader.cursor(
+                "SELECT id, brand, plate_vats, plate_ref FROM tickets "
+                "WHERE id > $1 AND (plate_vats IS NOT NULL OR plate_ref IS NOT NULL) ORDER BY id",
+                last_id,
+            )
+            while True:
+                records = await cur.fetch(args.chunk)
+                if not records:
+                    break
+                changed = renormalize(records)
+                last_id = records[-1]["id"]
+                processed += len(records)
+                updated += len(changed)
+                done += len(records)
+                await apply_chunk(writer, args.name, changed, last_id, processed, updated, args.dry_run)
+                if args.verbose:
+                    for row in changed:
+                        logger.info("%s: %s / %s", *row)
+                rate = done / max(time.perf_counter() - t0, 1e-9)
+                logger.info("до id=%s: обработано %s, изменено %s (%.0f строк/с)", last_id, processed, updated, rate)
+                if args.limit and done >= args.limit:
+                    break
+        logger.info("Готово%s: обработано %s, изменено %s", " (dry-run)" if args.dry_run else "", processed, updated)
+    finally:
+        await reader.close()
+        await writer.close()
+
+
+def main() -> None:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    ap = argparse.ArgumentParser(description="Перенормализация госномеров в tickets")
+    ap.add_argument("--dsn", help="по умолчанию DATABASE_URL")
+    ap.add_argument("--name", default="plates", help="имя контрольной точки (своё на каждую смену правил)")
+    ap.add_argument("--chunk", type=int, default=1000)
+    ap.add_argument("--limit", type=int, default=0, help="остановиться после N строк (0 — до конца)")
+    ap.add_argument("--reset", action="store_true", help="начать сначала, забыв контрольную точку")
+    ap.add_argument("--dry-run", action="store_true", help="только посчитать изменения, ничего не писать")
+    ap.add_argument("--verbose", action="store_true", help="печатать каждую изменённую строку")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
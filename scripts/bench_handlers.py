@@ -0,0 +1,238 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# конфиг regular_bot читается при импорте — фейковые значения ставим до него
+os.environ.setdefault("BOT_TOKEN", "123456:FAKE")
+os.environ.setdefault("DATABASE_URL", "postgresql://fake")
+os.environ.setdefault("JIRA_BASE_URL", "https://jira.fake")
+os.environ.setdefault("JIRA_EMAIL", "bench@fake")
+os.environ.setdefault("JIRA_API_TOKEN", "fake")
+os.environ.setdefault("JIRA_PROJECT_KEY", "RA")
+os.environ.setdefault("STATUS_EDIT_DEBOUNCE_SEC", "0.05")
+
+import httpx  # noqa: E402
+from telegram import Update  # noqa: E402
+
+import regular_bot as rb  # noqa: E402
+from fake_services import BOT_USER, FakeBotRequest, MemoryStore, jira_transport  # noqa: E402
+
+# Нагрузочный прогон хэндлеров анкеты и статусов: N «водителей» одновременно проходят
+# /start → анкету → создание заявки (+ сабтаск RA) → все статусы → закрытие.
+# Bot API и Jira — фейки из fake_services.py, Store — в памяти (или Postgres по --dsn).
+#   python scripts/bench_handlers.py --drivers 50 --forms 4 --bot-latency-ms 30 --jira-latency-ms 150 --json out.json
+
+_update_ids = itertools.count(1)
+
+
+def _user(uid: int) -> Dict[str, Any]:
+    return {"id": uid, "is_bot": False, "first_name": f"Driver{uid}", "username": f"driver{uid}"}
+
+
+def _message_update(uid: int, message_id: int, text: str) -> Dict[str, Any]:
+    msg: Dict[str, Any] = {
+        "message_id": message_id,
+        "date": int(datetime.now(timezone.utc).timestamp()),
+        "chat": {"id": uid, "type": "private"},
+        "from": _user(uid),
+        "text": text,
+    }
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": msg}
+
+
+def _callback_update(uid: int, message_id: int, data: str) -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(uid),
+            "chat_instance": str(uid),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(datetime.now(timezone.utc).timestamp()),
+                "chat": {"id": uid, "type": "private"},
+                "from": BOT_USER,
+                "text": "…",
+            },
+        },
+    }
+
+
+def _pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))]
+
+
+class Driver:
+    def __init__(self, app, uid: int, latencies: Dict[str, List[float]], think: float):
+        self.app = app
+        self.uid = uid
+        self.latencies = latencies
+        self.think = think
+        self.message_ids = itertools.count(1)
+
+    async def _send(self, label: str, payload: Dict[str, Any]) -> None:
+        update = Update.de_json(payload, self.app.bot)
+        t0 = time.perf_counter()
+        await self.app.process_update(update)
+        self.latencies.setdefault(label, []).append(time.perf_counter() - t0)
+        if self.think:
+            await asyncio.sleep(self.think)
+
+    async def text(self, label: str, text: str) -> None:
+        await self._send(label, _message_update(self.uid, next(self.message_ids), text))
+
+    async def tap(self, data: str) -> None:
+        await self._send(f"callback:{data.split('|', 1)[0]}", _callback_update(self.uid, next(self.message_ids), data))
+
+    def ticket_id(self) -> str:
+        return self.app.user_data[self.uid]["draft"]["ticket"].id
+
+    async def fill_form(self) -> None:
+        await self.text("cmd_start", "/start")
+        await self.tap("set|incident_type|BREAK")
+        await self.tap("set|brand|SITRAK")
+        await self.text("text", f"a{self.uid % 1000:03d}bc 77")
+        await self.text("text", f"ab {self.uid % 10000:04d} 177")
+        await self.text("text", "М-11, 123 км")
+        await self.text("text", "Не заводится, ошибка ЭБУ")
+        await self.text("text", "Груз охлаждённый")
+
+    async def create_and_work(self) -> None:
+        await self.tap("summary|create")
+        t_id = self.ticket_id()
+        await self.tap(f"act|ra|{t_id}")
+        for key, *_ in rb.STATUS_FLOW:
+            await self.tap(f"st|{t_id}|{key}")
+        await self.tap(f"close|{t_id}")
+
+
+async def _build(args):
+    if args.dsn:
+        rb.store = rb.Store(args.dsn)
+        await rb.store.init()
+    else:
+        rb.store = MemoryStore(db_latency=args.db_latency_ms / 1000, jitter=args.db_latency_ms / 4000)
+    rb.invite_links._store = rb.store
+    jira_calls: Dict[str, int] = {}
+    rb._jira_client = httpx.AsyncClient(transport=jira_transport(
+        latency=args.jira_latency_ms / 1000, jitter=args.jira_latency_ms / 4000, calls=jira_calls,
+    ))
+    request = FakeBotRequest(latency=args.bot_latency_ms / 1000, jitter=args.bot_latency_ms / 4000)
+    app = rb.build_application(request=request)
+    await app.initialize()
+    await app.start()
+    return app, request, jira_calls
+
+
+async def _teardown(app) -> None:
+    await app.stop()
+    await app.shutdown()
+    await rb.close_jira_http()
+    await rb.store.close()
+
+
+async def run_load(args) -> Dict[str, Any]:
+    app, request, jira_calls = await _build(args)
+    latencies: Dict[str, List[float]] = {}
+    drivers = [Driver(app, 10_000 + i, latencies, args.think_ms / 1000) for i in range(args.drivers)]
+
+    async def one(d: Driver) -> None:
+        for _ in range(args.forms):
+            await d.fill_form()
+            await d.create_and_work()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(d) for d in drivers))
+    wall = time.perf_counter() - t0
+    await _teardown(app)
+
+    all_lat = [x for v in latencies.values() for x in v]
+    return {
+        "drivers": args.drivers,
+        "forms_per_driver": args.forms,
+        "updates": len(all_lat),
+        "wall_s": round(wall, 3),
+        "updates_per_s": round(len(all_lat) / wall, 1) if wall else 0.0,
+        "p50_ms": round(statistics.median(all_lat) * 1000, 2) if all_lat else 0.0,
+        "p99_ms": round(_pct(all_lat, 99) * 1000, 2),
+        "max_ms": round(max(all_lat, default=0.0) * 1000, 2),
+        "by_handler": {
+            label: {"n": len(v), "p50_ms": round(statistics.median(v) * 1000, 2), "p99_ms": round(_pct(v, 99) * 1000, 2)}
+            for label, v in sorted(latencies.items())
+        },
+        "bot_api_calls": dict(sorted(request.calls.items())),
+        "jira_calls": dict(sorted(jira_calls.items())),
+    }
+
+
+async def measure_draft_memory(args) -> Dict[str, Any]:
+    """Сколько памяти держит один заполненный, но не отправленный черновик."""
+    app, _, _ = await _build(argparse.Namespace(**{**vars(args), "dsn": None, "db_latency_ms": 0,
+                                                    "jira_latency_ms": 0, "bot_latency_ms": 0}))
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    drivers = [Driver(app, 500_000 + i, {}, 0.0) for i in range(args.memory_drafts)]
+    for d in drivers:
+        await d.fill_form()
+    # история ввода и строки заявок лежат в MemoryStore, а не в черновике — не считаем их
+    rb.store.input_history.clear()
+    rb.store.tickets.clear()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    resident = sum(1 for ud in app.user_data.values() if "ticket" in ud.get("draft", {}))
+    await _teardown(app)
+    return {"drafts": resident, "bytes_per_draft": round(used / max(resident, 1))}
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description="Нагрузочный бенчмарк хэндлеров regular_bot")
+    ap.add_argument("--drivers", type=int, default=20, help="одновременных водителей")
+    ap.add_argument("--forms", type=int, default=3, help="заявок на водителя")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="пауза между действиями водителя")
+    ap.add_argument("--bot-latency-ms", type=float, default=0.0)
+    ap.add_argument("--db-latency-ms", type=float, default=0.0, help="только для MemoryStore")
+    ap.add_argument("--jira-latency-ms", type=float, default=0.0)
+    ap.add_argument("--dsn", help="Postgres вместо MemoryStore (таблицы будут созданы)")
+    ap.add_argument("--memory-drafts", type=int, default=500, help="черновиков для замера памяти (0 — не мерить)")
+    ap.add_argument("--json", help="куда сохранить результаты")
+    args = ap.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    result = await run_load(args)
+    print(f"drivers={result['drivers']} updates={result['updates']} {result['updates_per_s']} upd/s "
+          f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms max={result['max_ms']}ms")
+    for label, st in result["by_handler"].items():
+        print(f"  {label:<18} n={st['n']:<6} p50={st['p50_ms']}ms p99={st['p99_ms']}ms")
+    if args.memory_drafts:
+        result["memory"] = await measure_draft_memory(args)
+        print(f"память: {result['memory']['bytes_per_draft']} байт на черновик ({result['memory']['drafts']} шт.)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
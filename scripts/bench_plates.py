@@ -0,0 +1,134 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plates  # noqa: E402
+
+# Микробенчмарк нормализации госномеров: прежняя реализация (join-генераторы + несколько
+# проходов) против plates.py (один str.translate) и пакетного API. Перед замером
+# сверяет, что результаты совпадают на всей выборке.
+#   python scripts/bench_plates.py --n 200000 --repeat 5
+
+_LAT = "ABEKMHOPCTYX"
+_CYR = "АВЕКМНОРСТУХ"
+
+
+def legacy_vats(text: str, *, brand: Optional[str]) -> Optional[str]:
+    if not text:
+        return None
+    s = "".join(ch for ch in (text or "").upper() if ch.isalnum()).translate(plates.LAT_TO_CYR)
+    rx = plates.PLATE_RE_3 if brand == "KIA_CEED" else plates.PLATE_RE_34
+    m = rx.match(s)
+    if not m:
+        return None
+    l1, d, l2, reg = m.groups()
+    return f"{l1}{d}{l2}{reg}"
+
+
+def legacy_ref(text: str) -> Optional[str]:
+    if not text:
+        return None
+    s = "".join(ch for ch in (text or "").upper() if ch.isalnum()).translate(plates.LAT_TO_CYR)
+    m = plates.REF_COMPACT_RE.match(s)
+    if not m:
+        letters = "".join(ch for ch in s if ch.isalpha())
+        digits = "".join(ch for ch in s if ch.isdigit())
+        if len(letters) < 2 or len(digits) < 6:
+            return None
+        s2 = f"{letters[:2]}{digits[:4]}{digits[4:7]}"
+        m = plates.REF_COMPACT_RE.match(s2)
+        if not m:
+            return None
+    l2, d4, reg = m.groups()
+    return f"{l2}{d4}{reg}"
+
+
+def _letter(rng: random.Random) -> str:
+    c = rng.choice(_LAT + _CYR)
+    return c.lower() if rng.random() < 0.3 else c
+
+
+def _digits(rng: random.Random, n: int) -> str:
+    return "".join(rng.choice("0123456789") for _ in range(n))
+
+
+def _sep(rng: random.Random) -> str:
+    return rng.choice(["", "", " ", "-", " | "])
+
+
+def gen_vats(rng: random.Random) -> str:
+    s = f"{_letter(rng)}{_sep(rng)}{_digits(rng, rng.choice((3, 4)))}{_sep(rng)}{_letter(rng)}{_letter(rng)}{_sep(rng)}{_digits(rng, rng.choice((2, 3)))}"
+    if rng.random() < 0.1:  # мусор и опечатки
+        s = s[: rng.randrange(len(s))] + rng.choice("#.,Z9ё") + s[rng.randrange(len(s)):]
+    return s
+
+
+def gen_ref(rng: random.Random) -> str:
+    s = f"{_letter(rng)}{_letter(rng)}{_sep(rng)}{_digits(rng, 4)}{_sep(rng)}{_digits(rng, rng.choice((2, 3)))}"
+    if rng.random() < 0.2:  # буквы вперемешку с цифрами — ветка с разбором
+        i = rng.randrange(1, len(s))
+        s = s[i:] + s[:i]
+    return s
+
+
+def _bench(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Бенчмарк нормализации госномеров")
+    ap.add_argument("--n", type=int, default=100_000, help="размер выборки")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="куда сохранить результаты")
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    vats = [(gen_vats(rng), rng.choice(("SITRAK", "KIA_CEED", None))) for _ in range(args.n)]
+    refs = [gen_ref(rng) for _ in range(args.n)]
+
+    expected_vats = [legacy_vats(t, brand=b) for t, b in vats]
+    expected_refs = [legacy_ref(t) for t in refs]
+    assert [plates.normalize_vats_plate(t, brand=b) for t, b in vats] == expected_vats
+    assert plates.normalize_vats_plates(vats) == expected_vats
+    assert [plates.normalize_ref_plate(t) for t in refs] == expected_refs
+    assert plates.normalize_ref_plates(refs) == expected_refs
+
+    cases: Dict[str, Callable[[], Any]] = {
+        "vats legacy": lambda: [legacy_vats(t, brand=b) for t, b in vats],
+        "vats single": lambda: [plates.normalize_vats_plate(t, brand=b) for t, b in vats],
+        "vats batch": lambda: plates.normalize_vats_plates(vats),
+        "ref legacy": lambda: [legacy_ref(t) for t in refs],
+        "ref single": lambda: [plates.normalize_ref_plate(t) for t in refs],
+        "ref batch": lambda: plates.normalize_ref_plates(refs),
+    }
+    results: List[Dict[str, Any]] = []
+    for name, fn in cases.items():
+        best = _bench(fn, args.repeat)
+        results.append({"case": name, "n": args.n, "best_s": round(best, 4), "ns_per_plate": round(best / args.n * 1e9)})
+    base = {r["case"].split()[0]: r["best_s"] for r in results if r["case"].endswith("legacy")}
+    for r in results:
+        kind = r["case"].split()[0]
+        r["speedup"] = round(base[kind] / r["best_s"], 2) if r["best_s"] else 0.0
+        print(f"{r['case']:<12} {r['ns_per_plate']:>6} ns/номер  x{r['speedup']}")
+    recognized = sum(v is not None for v in expected_vats), sum(v is not None for v in expected_refs)
+    print(f"распознано: ВАТС {recognized[0]}/{args.n}, реф {recognized[1]}/{args.n}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
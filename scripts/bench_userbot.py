@@ -0,0 +1,133 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_factory_adapter import ChatFactoryAdapter  # noqa: E402
+from fake_telethon import FakeTelegramClient, FaultRule, flood_wait  # noqa: E402
+from request_scheduler import RequestScheduler  # noqa: E402
+from userbot import ChatFactory, ChatPool, ShardedChatFactory  # noqa: E402
+
+BOT = "ra_bot"
+
+# Бенчмарк создания групп на FakeTelegramClient: пропускная способность и хвосты задержки
+# при разной конкурентности, размере пула и числе аккаунтов.
+#   python scripts/bench_userbot.py --chats 40 --concurrency 1,4,8 --latency-ms 80 --pool 0,20 --accounts 1,2
+
+
+def _pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))]
+
+
+async def _build(accounts: int, pool_size: int, args) -> tuple:
+    factories: List[ChatFactory] = []
+    clients: List[FakeTelegramClient] = []
+    intervals = {k: v * args.pace for k, v in RequestScheduler.DEFAULT_INTERVALS.items()}
+    for i in range(accounts):
+        client = FakeTelegramClient(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, bots=(BOT,), seed=i)
+        if args.flood_every:
+            client.inject("channels.CreateChannel", FaultRule(flood_wait(args.flood_sec), every=args.flood_every))
+        await client.connect()
+        factory = ChatFactory(client, scheduler=RequestScheduler(client, intervals=intervals, default_interval=0))
+        await factory.resolve_bot(BOT)
+        if pool_size:
+            factory.pool = ChatPool(factory, bot_username=BOT, size=-(-pool_size // accounts))
+            await factory.pool.start()
+        factories.append(factory)
+        clients.append(client)
+    root = factories[0] if accounts == 1 else ShardedChatFactory(factories)
+    # ждём, пока пул наполнится — меряем «тёплое» состояние
+    for f in factories:
+        if f.pool is not None:
+            while await f.pool.ready_count() < -(-pool_size // accounts):
+                await asyncio.sleep(0.01)
+    return root, clients
+
+
+async def _run_case(accounts: int, pool_size: int, concurrency: int, args) -> Dict[str, Any]:
+    root, clients = await _build(accounts, pool_size, args)
+    adapter = ChatFactoryAdapter(root, f"@{BOT}")
+    latencies: List[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await adapter.create_group_with_bot(f"bench #{i}")
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.chats)))
+    wall = time.perf_counter() - t0
+    await root.aclose()
+    calls: Dict[str, int] = {}
+    for c in clients:
+        for k, v in c.calls.items():
+            calls[k] = calls.get(k, 0) + v
+    return {
+        "accounts": accounts,
+        "pool": pool_size,
+        "concurrency": concurrency,
+        "chats": args.chats,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "chats_per_s": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else 0.0,
+        "p95_ms": round(_pct(latencies, 95) * 1000, 1),
+        "p99_ms": round(_pct(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 1),
+        "mtproto_calls": calls,
+    }
+
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description="Бенчмарк ChatFactory на FakeTelegramClient")
+    ap.add_argument("--chats", type=int, default=30)
+    ap.add_argument("--concurrency", type=_ints, default=[1, 4, 8])
+    ap.add_argument("--pool", type=_ints, default=[0])
+    ap.add_argument("--accounts", type=_ints, default=[1])
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="задержка одного MTProto-запроса")
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--pace", type=float, default=0.0,
+                    help="множитель к интервалам планировщика (1 — боевые значения, 0 — без темпа)")
+    ap.add_argument("--flood-every", type=int, default=0, help="каждый N-й CreateChannel — FloodWait")
+    ap.add_argument("--flood-sec", type=int, default=1)
+    ap.add_argument("--json", help="куда сохранить результаты")
+    args = ap.parse_args()
+
+    results = []
+    for accounts in args.accounts:
+        for pool_size in args.pool:
+            for conc in args.concurrency:
+                r = await _run_case(accounts, pool_size, conc, args)
+                results.append(r)
+                print(f"accounts={accounts} pool={pool_size:<3} conc={conc:<3} "
+                      f"{r['chats_per_s']:>7} chats/s  p50={r['p50_ms']}ms p95={r['p95_ms']}ms "
+                      f"p99={r['p99_ms']}ms max={r['max_ms']}ms errors={r['errors']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
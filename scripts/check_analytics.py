@@ -0,0 +1,83 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# конфиг regular_bot читается при импорте — фейковые значения ставим до него
+os.environ.setdefault("BOT_TOKEN", "123456:FAKE")
+os.environ.setdefault("DATABASE_URL", "postgresql://fake")
+
+import regular_bot as rb  # noqa: E402
+from analytics import STAGE_NAMES, StageRollup  # noqa: E402
+
+# Сквозная проверка аналитики этапов на живом Postgres: заявка с отметками статусов →
+# StageRollup.run_once() → StageRollup.report() по записанным агрегатам. Марка заявки
+# уникальная, после прогона заявка и её агрегаты удаляются. Запускать на тестовой базе:
+# run_once обработает и все остальные ещё не учтённые строки status_history.
+#   python scripts/check_analytics.py --dsn postgresql://localhost/ra_test
+# Выход 1, если отчёт не совпал с ожидаемым.
+
+# отметка → смещение от прибытия, сек
+MARKS = {"arrive": 0, "inspect": 600, "decision": 1500, "repair": 4200, "resume": 7800}
+EXPECTED = {"arrive_inspect": 600, "inspect_decision": 900, "decision_fix": 2700, "fix_resume": 3600, "total": 7800}
+
+
+async def main() -> int:
+    ap = argparse.ArgumentParser(description="Проверка StageRollup на Postgres")
+    ap.add_argument("--dsn", help="по умолчанию DATABASE_URL")
+    args = ap.parse_args()
+    dsn = args.dsn or os.getenv("DATABASE_URL", "")
+    if not dsn or dsn == "postgresql://fake":
+        raise SystemExit("Укажите --dsn или DATABASE_URL")
+
+    store = rb.Store(dsn)
+    await store.init()
+    rollup = StageRollup(lambda: store.pool, interval_sec=0, settle_sec=0)
+    brand = f"CHECK-{uuid.uuid4().hex[:8]}"
+    ticket_id = f"check-{uuid.uuid4().hex}"
+    arrive = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+    errors = []
+    try:
+        async with store.pool.acquire() as con:  # type: ignore[union-attr]
+            await con.execute(
+                "INSERT INTO tickets(id, user_id, created_at, incident_type, brand) VALUES ($1, 0, $2, 'BREAK', $3)",
+                ticket_id, arrive, brand,
+            )
+        for key, offset in MARKS.items():
+            await store.set_status_done(ticket_id, key, arrive + timedelta(seconds=offset))
+        processed = await rollup.run_once()
+        print(f"run_once: {processed} строк status_history")
+
+        since, until = arrive - timedelta(hours=1), arrive + timedelta(hours=4)
+        rows = await rollup.report(since, until, brand=brand)
+        got = {r["stage"]: r for r in rows}
+        for stage in STAGE_NAMES:
+            r = got.get(stage)
+            if r is None:
+                errors.append(f"{stage}: нет в отчёте")
+                continue
+            print(f"  {stage:<18} count={r['count']} mean={r['mean_sec']} p50={r['p50_sec']}")
+            if r["count"] != 1 or r["mean_sec"] != EXPECTED[stage] or r["brand"] != brand:
+                errors.append(f"{stage}: {r}")
+        flat = await rollup.report(since, until, by=(), brand=brand, stage="total")
+        if [(r["stage"], r["count"]) for r in flat] != [("total", 1)]:
+            errors.append(f"by=(): {flat}")
+    finally:
+        async with store.pool.acquire() as con:  # type: ignore[union-attr]
+            await con.execute("DELETE FROM tickets WHERE id = $1", ticket_id)
+            await con.execute("DELETE FROM stage_duration_hourly WHERE brand = $1", brand)
+        await store.close()
+
+    for e in errors:
+        print(f"ОШИБКА {e}")
+    print("OK" if not errors else f"{len(errors)} ошибок")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,53 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# конфиг regular_bot читается при импорте — фейковые значения ставим до него
+os.environ.setdefault("BOT_TOKEN", "123456:FAKE")
+os.environ.setdefault("DATABASE_URL", "postgresql://fake")
+
+import regular_bot as rb  # noqa: E402
+
+# Одновременный старт нескольких инстансов: --instances раз параллельно Store.init()
+# (создание таблиц, функций и триггеров), и так --rounds раундов. Без SCHEMA_LOCK часть
+# стартов падала с "tuple concurrently updated" / "deadlock detected".
+#   python scripts/check_schema.py --dsn postgresql://localhost/ra_test --instances 4 --rounds 10
+# Выход 1, если хоть один Store.init() упал.
+
+
+async def _start(dsn: str) -> None:
+    store = rb.Store(dsn)
+    try:
+        await store.init()
+    finally:
+        await store.close()
+
+
+async def main() -> int:
+    ap = argparse.ArgumentParser(description="Параллельный Store.init() на Postgres")
+    ap.add_argument("--dsn", help="по умолчанию DATABASE_URL")
+    ap.add_argument("--instances", type=int, default=4)
+    ap.add_argument("--rounds", type=int, default=10)
+    args = ap.parse_args()
+    dsn = args.dsn or os.getenv("DATABASE_URL", "")
+    if not dsn or dsn == "postgresql://fake":
+        raise SystemExit("Укажите --dsn или DATABASE_URL")
+
+    failed = 0
+    for _ in range(args.rounds):
+        results = await asyncio.gather(*(_start(dsn) for _ in range(args.instances)), return_exceptions=True)
+        for r in results:
+            if isinstance(r, BaseException):
+                failed += 1
+                print(f"ОШИБКА {type(r).__name__}: {r}")
+    total = args.instances * args.rounds
+    print(f"{total - failed}/{total} стартов без ошибок")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,112 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Бюджет времени старта: каждый модуль импортируется в чистом процессе --runs раз, медиана
+# сравнивается с --budget-ms. Заодно проверяем, что импорт не тянет тяжёлое, которое
+# должно грузиться только при запуске своего компонента (FastAPI/uvicorn — http_api, Telethon — юзербот).
+# Выход 1, если бюджет превышен или тяжёлый модуль загрузился.
+#   python scripts/check_startup.py --budget-ms 800 --runs 5
+
+# модуль → что не должно оказаться в sys.modules после его импорта
+DEFERRED = {
+    "regular_bot": ("fastapi", "starlette", "uvicorn", "telethon"),
+    "app": ("fastapi", "starlette", "uvicorn", "telethon"),
+}
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+__import__(sys.argv[1])
+ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({"ms": ms, "modules": sorted({m.split(".")[0] for m in sys.modules})}))
+"""
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def _env() -> Dict[str, str]:
+    # конфиг проверяется при импорте: обязательные значения — фейковые, если не заданы
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "123456:FAKE")
+    env.setdefault("DATABASE_URL", "postgresql://fake")
+    env["USE_USERBOT"] = "0"
+    return env
+
+
+def probe(module: str, *, importtime: bool = False) -> Tuple[Dict[str, Any], str]:
+    cmd = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", _PROBE, module]
+    proc = subprocess.run(cmd, cwd=ROOT, env=_env(), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"Импорт {module} упал:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def top_imports(stderr: str, n: int) -> List[Tuple[str, float]]:
+    """Самые дорогие импорты верхнего уровня (кумулятивно, мс) из вывода -X importtime."""
+    out = []
+    for line in stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        # второй уровень вложенности — модули, импортированные прямо из проверяемого
+        if m and len(m.group(3)) == 3:
+            out.append((m.group(4), int(m.group(2)) / 1000))
+    return sorted(out, key=lambda x: -x[1])[:n]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Проверка бюджета времени импорта regular_bot/app")
+    ap.add_argument("modules", nargs="*", default=list(DEFERRED), help="какие модули проверять")
+    ap.add_argument("--budget-ms", type=float, default=800.0, help="допустимая медиана времени импорта")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=10, help="сколько самых дорогих импортов показать")
+    ap.add_argument("--json", help="куда сохранить результаты")
+    args = ap.parse_args()
+
+    # первый прогон прогревает .pyc и файловый кэш — в замеры не идёт
+    for module in args.modules:
+        probe(module)
+
+    failed = False
+    results: Dict[str, Any] = {}
+    for module in args.modules:
+        times = []
+        loaded: List[str] = []
+        for _ in range(args.runs):
+            r, _stderr = probe(module)
+            times.append(r["ms"])
+            loaded = [m for m in DEFERRED.get(module, ()) if m in r["modules"]]
+        _r, stderr = probe(module, importtime=True)
+        median = statistics.median(times)
+        ok = median <= args.budget_ms and not loaded
+        failed |= not ok
+        results[module] = {
+            "median_ms": round(median, 1),
+            "min_ms": round(min(times), 1),
+            "budget_ms": args.budget_ms,
+            "eager_heavy_imports": loaded,
+            "top_imports_ms": dict((k, round(v, 1)) for k, v in top_imports(stderr, args.top)),
+            "ok": ok,
+        }
+        print(f"{'OK  ' if ok else 'FAIL'} import {module}: медиана {median:.0f}ms (мин {min(times):.0f}ms), "
+              f"бюджет {args.budget_ms:.0f}ms")
+        if loaded:
+            print(f"     загружено при импорте: {', '.join(loaded)}")
+        for name, ms in top_imports(stderr, args.top):
+            print(f"     {ms:8.1f}ms  {name}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
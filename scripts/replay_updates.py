@@ -0,0 +1,137 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import statistics
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+# bench_handlers ставит фейковое окружение до импорта regular_bot и собирает приложение на фейках
+from bench_handlers import _build, _pct, _teardown  # noqa: E402
+from telegram import Update  # noqa: E402
+
+from update_recorder import STALE, TICKET  # noqa: E402
+
+# Воспроизведение записи UPDATE_CAPTURE_PATH (update_recorder.py) на фейковых Bot API / Jira / Store.
+# Апдейты идут в исходном порядке и с исходными паузами, делёнными на --speed
+# (--speed 0 — без пауз). Обрабатываются по одному, как PTB по умолчанию, так что
+# прогон детерминирован. Отчёт: время обработки по видам апдейтов и отставание от расписания.
+#   python scripts/replay_updates.py capture.jsonl.gz --speed 10 --json replay.json
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                rec = json.loads(line)
+                yield rec["ts"], rec["update"]
+
+
+def _label(raw: Dict[str, Any]) -> str:
+    if "callback_query" in raw:
+        return "callback:" + (raw["callback_query"].get("data") or "").split("|", 1)[0]
+    if "message" in raw:
+        text = (raw["message"] or {}).get("text") or ""
+        return "command" if text.startswith("/") else "message"
+    return next((k for k in raw if k != "update_id"), "other")
+
+
+def _resolve(app, raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Подставляет в callback_data id текущего черновика водителя вместо {ticket}."""
+    q = raw.get("callback_query")
+    if not q:
+        return raw
+    data = q.get("data") or ""
+    if TICKET in data:
+        draft = app.user_data.get(q["from"]["id"], {}).get("draft", {})
+        ticket = draft.get("ticket")
+        data = data.replace(TICKET, ticket.id if ticket else "none")
+    if STALE in data:
+        data = data.replace(STALE, "stale000")
+    return {**raw, "callback_query": {**q, "data": data}}
+
+
+async def replay(args) -> Dict[str, Any]:
+    records = list(read_capture(args.capture))
+    if args.limit:
+        records = records[: args.limit]
+    if not records:
+        raise SystemExit("В записи нет апдейтов")
+    app, request, jira_calls = await _build(args)
+    latencies: Dict[str, List[float]] = {}
+    lags: List[float] = []
+    errors = 0
+    ts0 = records[0][0]
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    t0 = time.perf_counter()
+    for ts, raw in records:
+        if args.speed > 0:
+            due = start + max(0.0, ts - ts0) / args.speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(0.0, loop.time() - due))
+        update = Update.de_json(_resolve(app, raw), app.bot)
+        t = time.perf_counter()
+        try:
+            await app.process_update(update)
+        except Exception:
+            errors += 1
+            logging.exception("Апдейт %s упал при воспроизведении", raw.get("update_id"))
+        latencies.setdefault(_label(raw), []).append(time.perf_counter() - t)
+    wall = time.perf_counter() - t0
+    await _teardown(app)
+
+    all_lat = [x for v in latencies.values() for x in v]
+    return {
+        "capture": args.capture,
+        "speed": args.speed,
+        "updates": len(all_lat),
+        "users": len({(r.get("callback_query") or r.get("message") or {}).get("from", {}).get("id") for _, r in records}),
+        "captured_span_s": round(records[-1][0] - ts0, 3),
+        "wall_s": round(wall, 3),
+        "updates_per_s": round(len(all_lat) / wall, 1) if wall else 0.0,
+        "errors": errors,
+        "p50_ms": round(statistics.median(all_lat) * 1000, 2),
+        "p99_ms": round(_pct(all_lat, 99) * 1000, 2),
+        "max_lag_ms": round(max(lags, default=0.0) * 1000, 2),
+        "by_kind": {
+            k: {"n": len(v), "p50_ms": round(statistics.median(v) * 1000, 2), "p99_ms": round(_pct(v, 99) * 1000, 2)}
+            for k, v in sorted(latencies.items())
+        },
+        "bot_api_calls": dict(sorted(request.calls.items())),
+        "jira_calls": dict(sorted(jira_calls.items())),
+    }
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов на фейковых сервисах")
+    ap.add_argument("capture", help="gzip JSONL из UPDATE_CAPTURE_PATH")
+    ap.add_argument("--speed", type=float, default=1.0, help="ускорение (1 — как в записи, 0 — без пауз)")
+    ap.add_argument("--limit", type=int, default=0, help="только первые N апдейтов")
+    ap.add_argument("--bot-latency-ms", type=float, default=0.0)
+    ap.add_argument("--db-latency-ms", type=float, default=0.0, help="только для MemoryStore")
+    ap.add_argument("--jira-latency-ms", type=float, default=0.0)
+    ap.add_argument("--dsn", help="Postgres вместо MemoryStore")
+    ap.add_argument("--json", help="куда сохранить результаты")
+    args = ap.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    r = await replay(args)
+    print(f"{r['updates']} апдейтов, {r['users']} водителей: {r['updates_per_s']} upd/s, "
+          f"p50={r['p50_ms']}ms p99={r['p99_ms']}ms, отставание до {r['max_lag_ms']}ms, ошибок {r['errors']}")
+    for kind, st in r["by_kind"].items():
+        print(f"  {kind:<18} n={st['n']:<6} p50={st['p50_ms']}ms p99={st['p99_ms']}ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
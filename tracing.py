@@ -0,0 +1,165 @@
+# tracing.py
+"""
+Разбор задержки одного апдейта по участкам: Telegram Bot API, Postgres (Store), Jira.
+
+Хэндлер, обёрнутый traced_update(), открывает трассу в contextvar; span() внутри неё
+записывает участок (вид, имя, старт, длительность, ошибка). Если апдейт обработан
+дольше порога (configure(slow_ms)), трасса целиком уходит одной JSON-строкой в лог
+"ra.slow_update". Без порога трассы не создаются, span() возвращает общий пустой
+контекст — остаётся чтение contextvar на вызов.
+
+Задачи, запущенные из хэндлера (app.create_task), наследуют контекст: их участки,
+закончившиеся до конца апдейта, попадут в трассу, более поздние — отбрасываются.
+"""
+from __future__ import annotations
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import time
+from typing import Any, Callable, Iterable, List, Optional
+
+from telegram.request import HTTPXRequest
+
+slow_log = logging.getLogger("ra.slow_update")
+
+_slow_s: Optional[float] = None
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("ra_trace", default=None)
+
+
+def configure(slow_ms: float) -> None:
+    """slow_ms <= 0 — трассировка выключена."""
+    global _slow_s
+    _slow_s = slow_ms / 1000 if slow_ms and slow_ms > 0 else None
+
+
+def enabled() -> bool:
+    return _slow_s is not None
+
+
+class Trace:
+    __slots__ = ("handler", "action", "update_id", "user_id", "t0", "spans", "done")
+
+    def __init__(self, handler: str, action: str, update_id: Optional[int], user_id: Optional[int]):
+        self.handler = handler
+        self.action = action
+        self.update_id = update_id
+        self.user_id = user_id
+        self.t0 = time.perf_counter()
+        self.spans: List[tuple] = []  # (kind, name, start, duration, error)
+        self.done = False
+
+    def to_dict(self, total: float) -> dict:
+        by_kind: dict = {}
+        spans = []
+        for kind, name, start, dur, err in self.spans:
+            by_kind[kind] = by_kind.get(kind, 0.0) + dur
+            item = {"kind": kind, "name": name, "start_ms": round((start - self.t0) * 1000, 1), "ms": round(dur * 1000, 1)}
+            if err:
+                item["error"] = err
+            spans.append(item)
+        return {
+            "event": "slow_update",
+            "handler": self.handler,
+            "action": self.action,
+            "update_id": self.update_id,
+            "user_id": self.user_id,
+            "total_ms": round(total * 1000, 1),
+            # сумма по видам; при gather участки перекрываются и сумма может превысить total
+            "by_kind_ms": {k: round(v * 1000, 1) for k, v in by_kind.items()},
+            "spans": spans,
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "kind", "name", "t0")
+
+    def __init__(self, trace: Trace, kind: str, name: str):
+        self.trace = trace
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if not self.trace.done:
+            err = exc_type.__name__ if exc_type is not None else None
+            self.trace.spans.append((self.kind, self.name, self.t0, time.perf_counter() - self.t0, err))
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(kind: str, name: str):
+    """with span("db", "save_field"): ... — участок текущей трассы (вне трассы ничего не делает)."""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, kind, name)
+
+
+def traced_update(name: str, action: Optional[Callable[[Any], str]] = None):
+    """Декоратор хэндлера PTB: трасса на время обработки апдейта."""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(update, context, *args, **kwargs):
+            if _slow_s is None or _current.get() is not None:  # выключено или вложенный вызов (cmd_start из on_text)
+                return await fn(update, context, *args, **kwargs)
+            user = getattr(update, "effective_user", None)
+            trace = Trace(name, action(update) if action else "", getattr(update, "update_id", None), getattr(user, "id", None))
+            token = _current.set(trace)
+            try:
+                return await fn(update, context, *args, **kwargs)
+            finally:
+                _current.reset(token)
+                trace.done = True
+                total = time.perf_counter() - trace.t0
+                if _slow_s is not None and total >= _slow_s:
+                    slow_log.warning(json.dumps(trace.to_dict(total), ensure_ascii=False))
+        return wrapper
+    return deco
+
+
+def trace_methods(cls: type, kind: str, names: Optional[Iterable[str]] = None) -> type:
+    """Участок span(kind, <метод>) вокруг корутин-методов класса (names=None — все публичные)."""
+    if names is None:
+        names = [n for n, f in vars(cls).items() if not n.startswith("_") and inspect.iscoroutinefunction(f)]
+    for name in names:
+        setattr(cls, name, _traced_method(getattr(cls, name), kind, name))
+    return cls
+
+
+def _traced_method(fn, kind: str, name: str):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return await fn(*args, **kwargs)
+        with _Span(trace, kind, name):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+
+class TracedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, который пишет каждый вызов Bot API участком span("telegram", <метод>)."""
+
+    async def do_request(self, url: str, method: str, *args: Any, **kwargs: Any):
+        trace = _current.get()
+        if trace is None:
+            return await super().do_request(url, method, *args, **kwargs)
+        # url вида https://api.telegram.org/bot<token>/sendMessage — в трассу только имя метода
+        with _Span(trace, "telegram", url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
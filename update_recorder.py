@@ -0,0 +1,216 @@
+# update_recorder.py
+"""
+Запись входящих апдейтов для воспроизведения (scripts/replay_updates.py).
+
+Включается UPDATE_CAPTURE_PATH: каждый апдейт обезличивается и дописывается строкой
+JSON {"ts": <unix-время>, "update": {...}} в gzip-файл. Каждый запуск дописывает
+отдельный gzip-member, gzip.open читает их подряд.
+
+Обезличивание:
+- id пользователей и чатов заменяются стабильным HMAC (соль UPDATE_CAPTURE_SALT),
+  поэтому один водитель остаётся одним водителем на протяжении записи;
+- имена и username — заглушки;
+- в тексте буквы → «А»/«а», цифры → «5», пробелы и пунктуация остаются. Длина и форма
+  сохраняются, так что госномера по-прежнему проходят или не проходят проверку;
+- id заявки в callback_data → "{ticket}" (текущий черновик водителя) или "{stale}"
+  (кнопка старого сообщения). При воспроизведении подставляются реальные значения.
+"""
+from __future__ import annotations
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+TICKET = "{ticket}"
+STALE = "{stale}"
+
+# callback_data с id заявки: act|<действие>|<id>, st|<id>|<статус>, close|<id>
+_TICKET_CALLBACKS = (
+    re.compile(r"^(act\|[a-z]+\|)([a-z0-9]+)$"),
+    re.compile(r"^(st\|)([a-z0-9]+)(\|[a-z_]+)$"),
+    re.compile(r"^(close\|)([a-z0-9]+)$"),
+)
+# госномер из подсказок реестра: set|plate_vats|<номер>
+_PLATE_CALLBACK = re.compile(r"^(set\|plate_(?:vats|ref)\|)(.+)$")
+
+
+def mask_text(text: str) -> str:
+    if text.startswith("/"):
+        command, sep, rest = text.partition(" ")
+        return command + sep + mask_text(rest) if rest else command
+    out = []
+    for ch in text:
+        if ch.isdigit():
+            out.append("5")
+        elif ch.isalpha():
+            out.append("А" if ch.isupper() else "а")
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+class Anonymizer:
+    def __init__(self, salt: str):
+        self._key = salt.encode()
+
+    def id(self, value: int) -> int:
+        digest = hmac.new(self._key, str(value).encode(), hashlib.sha256).digest()
+        n = int.from_bytes(digest[:6], "big") % 10**12 + 1
+        # группы/каналы в Telegram — отрицательные, знак сохраняем
+        return -n if value < 0 else n
+
+    def token(self, value: str) -> str:
+        return hmac.new(self._key, value.encode(), hashlib.sha256).hexdigest()[:16]
+
+    def user(self, u: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not u:
+            return None
+        uid = self.id(u["id"])
+        out = {"id": uid, "is_bot": u.get("is_bot", False), "first_name": "Bot" if u.get("is_bot") else "Driver"}
+        if u.get("username"):
+            out["username"] = u["username"] if u.get("is_bot") else f"u{uid % 10**6}"
+        return out
+
+    def chat(self, c: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": self.id(c["id"]), "type": c.get("type", "private")}
+
+    def message(self, m: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not m:
+            return None
+        out: Dict[str, Any] = {"message_id": m["message_id"], "date": m["date"], "chat": self.chat(m["chat"])}
+        if m.get("from"):
+            out["from"] = self.user(m["from"])
+        if "text" in m:
+            out["text"] = mask_text(m["text"])
+            if m.get("entities"):
+                out["entities"] = [
+                    {"type": e["type"], "offset": e["offset"], "length": e["length"]} for e in m["entities"]
+                ]
+        return out
+
+    def callback_data(self, data: str, ticket_id: Optional[str]) -> str:
+        for rx in _TICKET_CALLBACKS:
+            m = rx.match(data)
+            if m:
+                groups = list(m.groups())
+                groups[1] = TICKET if groups[1] == ticket_id else STALE
+                return "".join(groups)
+        m = _PLATE_CALLBACK.match(data)
+        if m:
+            return m.group(1) + mask_text(m.group(2))
+        return data
+
+    def update(self, raw: Dict[str, Any], ticket_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Обезличенная копия апдейта; None — тип апдейта не записываем."""
+        out: Dict[str, Any] = {"update_id": raw["update_id"]}
+        if "message" in raw:
+            out["message"] = self.message(raw["message"])
+        elif "edited_message" in raw:
+            out["edited_message"] = self.message(raw["edited_message"])
+        elif "callback_query" in raw:
+            q = raw["callback_query"]
+            out["callback_query"] = {
+                "id": q["id"],
+                "from": self.user(q["from"]),
+                "chat_instance": self.token(q.get("chat_instance") or ""),
+                "data": self.callback_data(q.get("data") or "", ticket_id),
+            }
+            if q.get("message"):
+                out["callback_query"]["message"] = self.message(q["message"])
+        elif "my_chat_member" in raw:
+            cm = raw["my_chat_member"]
+            out["my_chat_member"] = {
+                "chat": self.chat(cm["chat"]),
+                "from": self.user(cm["from"]),
+                "date": cm["date"],
+                "old_chat_member": {"status": cm["old_chat_member"]["status"], "user": self.user(cm["old_chat_member"]["user"])},
+                "new_chat_member": {"status": cm["new_chat_member"]["status"], "user": self.user(cm["new_chat_member"]["user"])},
+            }
+        else:
+            return None
+        return out
+
+
+class UpdateRecorder:
+    """
+    Хэндлер для группы -1 (TypeHandler(Update, recorder.on_update)): апдейт не задерживается —
+    строка копится в буфере, фоновая задача раз в flush_sec сбрасывает буфер на диск в потоке.
+    """
+    def __init__(self, path: str, *, salt: str, flush_sec: float = 1.0):
+        self.path = path
+        self._anon = Anonymizer(salt)
+        self._flush_sec = flush_sec
+        self._buf: List[bytes] = []
+        self._file: Optional[gzip.GzipFile] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.recorded = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    async def on_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        try:
+            draft = (context.user_data or {}).get("draft", {}) if update.effective_user else {}
+            ticket = draft.get("ticket")
+            rec = self._anon.update(update.to_dict(), ticket.id if ticket else None)
+        except Exception:
+            logger.exception("UpdateRecorder: не удалось обезличить апдейт %s", update.update_id)
+            return
+        if rec is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "update": rec}, ensure_ascii=False, separators=(",", ":"))
+        self._buf.append(line.encode() + b"\n")
+        self.recorded += 1
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._file = gzip.open(self.path, "ab")
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._loop(), name="update-recorder")
+            logger.info("Запись апдейтов в %s", self.path)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        # не cancel: запись в потоке не прерывается, и досылать буфер параллельно с ней нельзя
+        self._stopping.set()
+        await self._task
+        self._task = None
+        file, self._file = self._file, None
+        if file is not None:
+            await asyncio.to_thread(file.close)
+
+    async def _loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self._flush_sec)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception("UpdateRecorder: ошибка записи")
+
+    async def _flush(self) -> None:
+        if not self._buf or self._file is None:
+            return
+        chunk, self._buf = b"".join(self._buf), []
+        file = self._file
+
+        def write() -> None:
+            file.write(chunk)
+            file.flush()
+
+        await asyncio.to_thread(write)
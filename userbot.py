@@ -1,12 +1,23 @@
 # userbot.py
 from __future__ import annotations
 import asyncio
-from dataclasses import dataclass
-from typing import Optional
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
 
 from telethon import TelegramClient
 from telethon.sessions import StringSession
-from telethon import functions, types, utils
+from telethon import errors, functions, types, utils
+
+from cluster import SCHEMA_LOCK
+from request_scheduler import PRIORITY_HIGH, PRIORITY_LOW, RequestScheduler, SchedulerBackoff
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class Settings:
@@ -14,49 +25,352 @@ class Settings:
     API_HASH: str
     USERBOT_SESSION: str
     MANAGED_BOT_USERNAME: str  # username PTB-бота, например "@my_ptb_bot"
+    CHAT_POOL_SIZE: int = 0    # сколько готовых групп держать в резерве (0 — без пула)
+    ENTITY_CACHE_PATH: str = ""  # JSON-файл с кэшем резолва username -> peer ("" — только в памяти)
+    USERBOT_SESSIONS: List[str] = field(default_factory=list)  # доп. аккаунты для шардирования
+    KEEPALIVE_SEC: float = 30.0  # период ping'а соединения юзербота
+
+    def all_sessions(self) -> List[str]:
+        sessions: List[str] = []
+        for s in [self.USERBOT_SESSION, *self.USERBOT_SESSIONS]:
+            s = (s or "").strip()
+            if s and s not in sessions:
+                sessions.append(s)
+        return sessions
+
+
+class EntityCache:
+    """
+    Кэш резолва username -> (user_id, access_hash). StringSession не сохраняет сущности
+    между запусками, поэтому храним нужные нам сами — в JSON-файле рядом с ботом.
+    """
+    def __init__(self, path: str = ""):
+        self._path = path
+        self._peers: Dict[str, Tuple[int, int]] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self._peers = {k: (int(v[0]), int(v[1])) for k, v in json.load(f).items()}
+            except (OSError, ValueError, TypeError, IndexError) as e:
+                logger.warning("Кэш сущностей %s не прочитан: %s", path, e)
+
+    def get(self, username: str) -> Optional[types.InputPeerUser]:
+        hit = self._peers.get(username.lower())
+        return types.InputPeerUser(user_id=hit[0], access_hash=hit[1]) if hit else None
+
+    def put(self, username: str, peer: types.InputPeerUser) -> None:
+        self._peers[username.lower()] = (peer.user_id, peer.access_hash)
+        if not self._path:
+            return
+        tmp = f"{self._path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._peers, f)
+            os.replace(tmp, self._path)
+        except OSError as e:
+            logger.warning("Кэш сущностей %s не сохранён: %s", self._path, e)
+
+class PartialChatError(RuntimeError):
+    """
+    Мегагруппа создана, но бот в неё не приглашён или не назначен админом, и удалить её не
+    удалось. Повтор на другом аккаунте породил бы дубль — такую ошибку не переадресуют.
+    """
+    def __init__(self, chat_id: int, cause: BaseException):
+        super().__init__(f"группа {chat_id} создана не до конца: {cause}")
+        self.chat_id = chat_id
+        self.cause = cause
+
+
+class SessionUnauthorized(ConnectionError):
+    """Сессия юзербота отозвана: без новой USERBOT_SESSION аккаунт больше не заработает."""
+
+
+class ConnectionSupervisor:
+    """
+    Держит соединение клиента тёплым: периодический ping, при обрыве — переподключение
+    с экспоненциальным бэкоффом и перепроверкой авторизации. Готовность публикуется
+    через событие ready, так что первый create_chat после сетевого сбоя не платит за реконнект.
+    Неавторизованная сессия — конечное состояние: надзор останавливается, а wait_ready()
+    сразу бросает SessionUnauthorized, не заставляя вызывающих ждать.
+    """
+    def __init__(self, client: TelegramClient, *, interval: float = 30.0, ping_timeout: float = 10.0,
+                 max_backoff: float = 60.0, ready_timeout: float = 30.0):
+        self._client = client
+        self._interval = interval
+        self._ping_timeout = ping_timeout
+        self._max_backoff = max_backoff
+        self._ready_timeout = ready_timeout
+        self._kick = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.ready = asyncio.Event()
+        self._revoked = asyncio.Event()
+        self.authorized = True
+        self.reconnects = 0
+
+    def start(self) -> None:
+        if self._client.is_connected():
+            self.ready.set()
+        self._task = asyncio.create_task(self._loop(), name="userbot-supervisor")
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def is_ready(self) -> bool:
+        return self.ready.is_set()
+
+    def kick(self) -> None:
+        """Запрос отвалился по сети — проверяем соединение сейчас, не дожидаясь интервала."""
+        self._kick.set()
+
+    async def wait_ready(self) -> None:
+        if self.ready.is_set():
+            return
+        if not self.authorized:
+            raise SessionUnauthorized("Сессия юзербота не авторизована — нужна новая USERBOT_SESSION")
+        waiters = [asyncio.ensure_future(self.ready.wait()), asyncio.ensure_future(self._revoked.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=self._ready_timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for w in waiters:
+                w.cancel()
+        if self.ready.is_set():
+            return
+        if not self.authorized:
+            raise SessionUnauthorized("Сессия юзербота не авторизована — нужна новая USERBOT_SESSION")
+        raise ConnectionError("Userbot не подключён к Telegram")
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._kick.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._kick.clear()
+            if await self._ping():
+                self.ready.set()
+                continue
+            self.ready.clear()
+            await self._reconnect()
+            if not self.authorized:
+                return
+
+    async def _ping(self) -> bool:
+        if not self._client.is_connected():
+            return False
+        try:
+            await asyncio.wait_for(
+                self._client(functions.PingRequest(ping_id=random.getrandbits(63))), self._ping_timeout
+            )
+            return True
+        except (ConnectionError, OSError, asyncio.TimeoutError, errors.RPCError) as e:
+            logger.warning("Ping юзербота не прошёл: %s", e)
+            return False
+
+    async def _reconnect(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                if self._client.is_connected():
+                    await self._client.disconnect()
+                await self._client.connect()
+                self.authorized = await self._client.is_user_authorized()
+                if self.authorized:
+                    self.reconnects += 1
+                    self.ready.set()
+                    logger.info("Юзербот переподключён")
+                    return
+                logger.error("Юзербот подключён, но сессия не авторизована — нужна новая USERBOT_SESSION")
+                self._revoked.set()
+                return
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                logger.warning("Переподключение юзербота не удалось: %s (повтор через %.0f с)", e, delay)
+            await asyncio.sleep(delay * (1 + random.uniform(0, 0.2)))
+            delay = min(delay * 2, self._max_backoff)
+
 
 class ChatFactory:
     """
-    Делает 3 действия:
+    Делает 3 действия (3 MTProto-запроса, peer бота берётся из кэша):
     1) Создаёт мегагруппу (supergroup)
     2) Приглашает в неё PTB-бота
     3) Выдаёт боту админку (invite_users=True, change_info=True)
     """
-    def __init__(self, client: TelegramClient):
+    # ошибки, после которых закэшированный peer бота считаем протухшим
+    _STALE_PEER_ERRORS = (
+        errors.PeerIdInvalidError,
+        errors.UserIdInvalidError,
+        errors.InputUserDeactivatedError,
+    )
+
+    # семейства методов, через которые проходит создание группы (для оценки бэкоффа)
+    _CREATE_FAMILIES = ("channels.CreateChannel", "channels.InviteToChannel", "channels.EditAdmin")
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        *,
+        entity_cache: Optional[EntityCache] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        supervisor: Optional[ConnectionSupervisor] = None,
+    ):
         self._client = client
+        self._entities = entity_cache or EntityCache()
+        self._scheduler = scheduler
+        self._supervisor = supervisor
+        self._account_id: Optional[int] = None
+        self.pool: Optional[ChatPool] = None
 
     async def aclose(self):
+        if self.pool is not None:
+            await self.pool.aclose()
+        if self._supervisor is not None:
+            await self._supervisor.aclose()
+        if self._scheduler is not None:
+            await self._scheduler.aclose()
         await self._client.disconnect()
 
-    async def create_chat(self, *, title: str, bot_username: str) -> int:
-        if bot_username.startswith("@"):
-            bot_username = bot_username[1:]
+    async def _call(self, request, *, priority: int = PRIORITY_HIGH, deadline: Optional[float] = None):
+        # FloodWait разбирает планировщик — автосон Telethon для этого запроса выключаем
+        fn = (lambda: self._client(request, flood_sleep_threshold=0)) if self._scheduler else (lambda: self._client(request))
+        return await self._run(RequestScheduler.family_of(request), fn, priority=priority, deadline=deadline)
+
+    async def _run(self, family: str, fn, *, priority: int = PRIORITY_HIGH, deadline: Optional[float] = None):
+        if self._supervisor is not None:
+            await self._supervisor.wait_ready()
+        try:
+            if self._scheduler is None:
+                return await fn()
+            timeout = None if deadline is None else max(0.0, deadline - asyncio.get_running_loop().time())
+            return await self._scheduler.run(family, fn, priority=priority, timeout=timeout)
+        except ConnectionError:
+            if self._supervisor is not None:
+                self._supervisor.kick()
+            raise
+
+    def is_ready(self) -> bool:
+        return self._supervisor is None or self._supervisor.is_ready()
+
+    def backoff_state(self) -> Dict[str, Dict[str, float]]:
+        return self._scheduler.state() if self._scheduler is not None else {}
+
+    def creation_backoff(self) -> float:
+        """Сколько секунд создание группы будет упираться в FloodWait (0 — не будет)."""
+        if self._scheduler is None:
+            return 0.0
+        return max(self._scheduler.backoff(f) for f in self._CREATE_FAMILIES)
 
-        # 1) создаём мегагруппу
-        create = await self._client(
+    async def create_chat(self, *, title: str, bot_username: str, timeout: Optional[float] = None) -> int:
+        """timeout — сколько ждать FloodWait, иначе SchedulerBackoff (None — ждать, сколько скажет Telegram)."""
+        channel = await self.create_channel(title=title, bot_username=bot_username, timeout=timeout)
+        # Bot API chat_id (-100...)
+        return utils.get_peer_id(channel)
+
+    async def take_chat(self, *, title: str, bot_username: str, timeout: Optional[float] = None) -> int:
+        """Берёт готовую группу из пула (если он есть и бот тот же), иначе создаёт новую."""
+        if self.pool is not None and self.pool.bot_username == bot_username.lstrip("@"):
+            return await self.pool.take(title, timeout=timeout)
+        return await self.create_chat(title=title, bot_username=bot_username, timeout=timeout)
+
+    @staticmethod
+    def _deadline(timeout: Optional[float]) -> Optional[float]:
+        # один срок на все запросы операции, а не timeout на каждый
+        return None if timeout is None else asyncio.get_running_loop().time() + timeout
+
+    async def account_id(self) -> int:
+        if self._account_id is None:
+            me = await self._run("users.GetUsers", lambda: self._client.get_me(input_peer=True))
+            self._account_id = me.user_id
+        return self._account_id
+
+    async def resolve_bot(
+        self, bot_username: str, *, refresh: bool = False, deadline: Optional[float] = None,
+    ) -> types.InputPeerUser:
+        """InputPeer бота: из кэша, а при refresh=True или промахе — одним запросом к Telegram."""
+        username = bot_username.lstrip("@")
+        if not refresh:
+            peer = self._entities.get(username)
+            if peer is not None:
+                return peer
+        peer = await self._run(
+            "contacts.ResolveUsername", lambda: self._client.get_input_entity(username), deadline=deadline,
+        )
+        if not isinstance(peer, types.InputPeerUser):
+            raise RuntimeError(f"@{username} — не пользователь/бот")
+        self._entities.put(username, peer)
+        return peer
+
+    async def rename_chat(self, channel: types.TypeInputChannel, title: str, *, timeout: Optional[float] = None) -> None:
+        await self._call(
+            functions.channels.EditTitleRequest(channel=channel, title=title), deadline=self._deadline(timeout),
+        )
+
+    async def chat_title(self, channel: types.TypeInputChannel) -> str:
+        res = await self._call(functions.channels.GetChannelsRequest(id=[channel]), priority=PRIORITY_LOW)
+        return res.chats[0].title
+
+    async def create_channel(
+        self, *, title: str, bot_username: str, priority: int = PRIORITY_HIGH, timeout: Optional[float] = None,
+    ) -> types.Channel:
+        deadline = self._deadline(timeout)
+        bot = await self.resolve_bot(bot_username, deadline=deadline)
+
+        # 1) создаём мегагруппу (ответ уже содержит channel с access_hash — GetFullChannel не нужен)
+        create = await self._call(
             functions.channels.CreateChannelRequest(
                 title=title,
                 about="",
                 megagroup=True,
                 broadcast=False,
                 forum=False,
-            )
+            ),
+            priority=priority,
+            deadline=deadline,
         )
         if not create.chats:
             raise RuntimeError("CreateChannel: пустой ответ chats")
         channel = create.chats[0]
+        try:
+            await self._setup_channel(channel, bot, bot_username, priority=priority, deadline=deadline)
+        except asyncio.CancelledError:
+            # вызывающий ушёл — недостроенную группу всё равно убираем
+            asyncio.create_task(self._drop_channel(channel), name="userbot-drop-channel")
+            raise
+        except Exception as e:
+            if not await self._drop_channel(channel):
+                raise PartialChatError(utils.get_peer_id(channel), e) from e
+            raise
+        return channel
 
-        # 2) сущности
-        _full = await self._client(functions.channels.GetFullChannelRequest(channel))
-        bot = await self._client.get_entity(bot_username)
+    async def _drop_channel(self, channel: types.Channel) -> bool:
+        """Удаляет недостроенную группу; False — не вышло (группа осталась у аккаунта)."""
+        try:
+            await self._call(functions.channels.DeleteChannelRequest(channel=channel))
+            return True
+        except Exception as e:
+            logger.error("Не удалось удалить недостроенную группу %s: %s", utils.get_peer_id(channel), e)
+            return False
 
-        # 3) приглашаем бота
-        await self._client(functions.channels.InviteToChannelRequest(
-            channel=channel,
-            users=[bot]
-        ))
+    async def _setup_channel(
+        self, channel: types.Channel, bot: types.InputPeerUser, bot_username: str, *,
+        priority: int, deadline: Optional[float],
+    ) -> None:
+        # 2) приглашаем бота; если закэшированный peer протух — резолвим заново и повторяем
+        try:
+            await self._call(functions.channels.InviteToChannelRequest(
+                channel=channel,
+                users=[bot]
+            ), priority=priority, deadline=deadline)
+        except self._STALE_PEER_ERRORS:
+            bot = await self.resolve_bot(bot_username, refresh=True, deadline=deadline)
+            await self._call(functions.channels.InviteToChannelRequest(
+                channel=channel,
+                users=[bot]
+            ), priority=priority, deadline=deadline)
 
-        # 4) повышаем бота до админа (даём права для инвайтов и смены title)
+        # 3) повышаем бота до админа (даём права для инвайтов и смены title)
         rights = types.ChatAdminRights(
             change_info=True,     # нужно для set_chat_title в regular_bot.py
             invite_users=True,    # нужно для create_chat_invite_link
@@ -70,29 +384,374 @@ class ChatFactory:
             manage_call=False,
             other=False,
         )
-        await self._client(functions.channels.EditAdminRequest(
+        await self._call(functions.channels.EditAdminRequest(
             channel=channel,
             user_id=bot,
             admin_rights=rights,
             rank=""
+        ), priority=priority, deadline=deadline)
+
+
+class ChatPool:
+    """
+    Резерв готовых мегагрупп: бот уже приглашён и назначен админом.
+    take() забирает группу и переименовывает её одним запросом, пул пополняется в фоне
+    (с учётом FloodWait). Если передан asyncpg-пул, резерв хранится в таблице chat_pool
+    и переживает рестарт; разбор между инстансами — через FOR UPDATE SKIP LOCKED.
+    """
+    PLACEHOLDER_TITLE = "Резерв"
+    # пока take() ждёт переименования (FloodWait может тянуться дольше STALE_TAKEN_SEC),
+    # он раз в TAKEN_HEARTBEAT_SEC обновляет taken_at. Строка, где taken_at старше
+    # STALE_TAKEN_SEC, — взявший её процесс упал между _pop и выдачей
+    TAKEN_HEARTBEAT_SEC = 60
+    STALE_TAKEN_SEC = 600
+
+    def __init__(self, factory: ChatFactory, *, bot_username: str, size: int, db: Any = None):
+        self._factory = factory
+        self.bot_username = bot_username.lstrip("@")
+        self._size = size
+        self._db = db
+        self._owner_id: Optional[int] = None
+        self._ready: Deque[Tuple[int, int, int]] = deque()  # (chat_id, channel_id, access_hash), если нет БД
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._owner_id = await self._factory.account_id()
+        if self._db is not None:
+            async with self._db.acquire() as con:
+                async with con.transaction():
+                    await con.execute("SELECT pg_advisory_xact_lock($1, $2)", *SCHEMA_LOCK)
+                    await con.execute("""
+                    CREATE TABLE IF NOT EXISTS chat_pool (
+                      chat_id     BIGINT PRIMARY KEY,
+                      channel_id  BIGINT NOT NULL,
+                      access_hash BIGINT NOT NULL,
+                      owner_id    BIGINT NOT NULL,
+                      created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+                      taken_at    TIMESTAMPTZ
+                    );
+                    """)
+        self._task = asyncio.create_task(self._refill_loop(), name="chat-pool-refill")
+        self._wakeup.set()
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def take(self, title: str, *, timeout: Optional[float] = None) -> int:
+        try:
+            while True:
+                item = await self._pop()
+                if item is None:
+                    break
+                chat_id, channel_id, access_hash = item
+                holding = asyncio.create_task(self._keep_taken(chat_id)) if self._db is not None else None
+                try:
+                    await self._factory.rename_chat(types.InputChannel(channel_id, access_hash), title, timeout=timeout)
+                except (errors.ChannelInvalidError, errors.ChannelPrivateError, errors.ChatAdminRequiredError) as e:
+                    # группу удалили или у аккаунта отобрали права — берём следующую
+                    logger.warning("Группа %s из пула непригодна: %s", chat_id, e)
+                    await self._forget(chat_id)
+                    continue
+                except BaseException:
+                    # FloodWait, бэкофф планировщика, обрыв связи: группа цела — возвращаем её в резерв
+                    await asyncio.shield(self._unpop(item))
+                    raise
+                finally:
+                    if holding is not None:
+                        holding.cancel()
+                await self._forget(chat_id)
+                return chat_id
+            return await self._factory.create_chat(title=title, bot_username=self.bot_username, timeout=timeout)
+        finally:
+            self._wakeup.set()
+
+    async def _pop(self) -> Optional[Tuple[int, int, int]]:
+        if self._db is None:
+            return self._ready.popleft() if self._ready else None
+        async with self._db.acquire() as con:
+            row = await con.fetchrow("""
+                UPDATE chat_pool SET taken_at = now()
+                WHERE chat_id = (
+                    SELECT chat_id FROM chat_pool
+                    WHERE taken_at IS NULL AND owner_id = $1
+                    ORDER BY created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING chat_id, channel_id, access_hash
+            """, self._owner_id)
+        return (row["chat_id"], row["channel_id"], row["access_hash"]) if row else None
+
+    async def _unpop(self, item: Tuple[int, int, int]) -> None:
+        if self._db is None:
+            self._ready.appendleft(item)
+            return
+        async with self._db.acquire() as con:
+            await con.execute("UPDATE chat_pool SET taken_at = NULL WHERE chat_id = $1", item[0])
+
+    async def _keep_taken(self, chat_id: int) -> None:
+        """Пульс взятой строки: пока он идёт, _reclaim_stale её не трогает."""
+        while True:
+            await asyncio.sleep(self.TAKEN_HEARTBEAT_SEC)
+            try:
+                async with self._db.acquire() as con:
+                    await con.execute(
+                        "UPDATE chat_pool SET taken_at = now() WHERE chat_id = $1 AND taken_at IS NOT NULL", chat_id
+                    )
+            except Exception as e:
+                logger.warning("Пул групп: не удалось продлить группу %s: %s", chat_id, e)
+
+    async def _forget(self, chat_id: int) -> None:
+        """Группа выдана заявке или непригодна — из резерва её убираем."""
+        if self._db is None:
+            return
+        async with self._db.acquire() as con:
+            await con.execute("DELETE FROM chat_pool WHERE chat_id = $1", chat_id)
+
+    async def _reclaim_stale(self) -> None:
+        """
+        Взятые строки без пульса дольше STALE_TAKEN_SEC: по названию группы видно, успели ли
+        её переименовать под заявку. Не успели — возвращаем в резерв, успели — она занята.
+        """
+        if self._db is None:
+            return
+        async with self._db.acquire() as con:
+            rows = await con.fetch("""
+                SELECT chat_id, channel_id, access_hash FROM chat_pool
+                WHERE taken_at IS NOT NULL AND taken_at < now() - make_interval(secs => $2) AND owner_id = $1
+                ORDER BY taken_at
+                LIMIT 20
+            """, self._owner_id, self.STALE_TAKEN_SEC)
+        for r in rows:
+            try:
+                title = await self._factory.chat_title(types.InputChannel(r["channel_id"], r["access_hash"]))
+            except (errors.ChannelInvalidError, errors.ChannelPrivateError) as e:
+                logger.warning("Группа %s из пула недоступна: %s", r["chat_id"], e)
+                await self._forget(r["chat_id"])
+                continue
+            if title == self.PLACEHOLDER_TITLE:
+                # пульс мог возобновиться, пока читали название, — тогда строку не трогаем
+                async with self._db.acquire() as con:
+                    done = await con.execute("""
+                        UPDATE chat_pool SET taken_at = NULL
+                        WHERE chat_id = $1 AND taken_at < now() - make_interval(secs => $2)
+                    """, r["chat_id"], self.STALE_TAKEN_SEC)
+                if done != "UPDATE 0":
+                    logger.info("Пул групп: возвращаем в резерв невыданную группу %s", r["chat_id"])
+            else:
+                await self._forget(r["chat_id"])
+
+    async def _push(self, channel: types.Channel) -> None:
+        item = (utils.get_peer_id(channel), channel.id, channel.access_hash)
+        if self._db is None:
+            self._ready.append(item)
+            return
+        async with self._db.acquire() as con:
+            await con.execute(
+                "INSERT INTO chat_pool(chat_id, channel_id, access_hash, owner_id) VALUES ($1,$2,$3,$4)",
+                *item, self._owner_id,
+            )
+
+    async def ready_count(self) -> int:
+        if self._db is None:
+            return len(self._ready)
+        async with self._db.acquire() as con:
+            return await con.fetchval(
+                "SELECT count(*) FROM chat_pool WHERE taken_at IS NULL AND owner_id = $1", self._owner_id
+            )
+
+    async def _refill_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self._reclaim_stale()
+                while await self.ready_count() < self._size:
+                    # резерв — фоновая работа: не лезем в FloodWait, который мешает живым заявкам
+                    wait = self._factory.creation_backoff()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    channel = await self._factory.create_channel(
+                        title=self.PLACEHOLDER_TITLE, bot_username=self.bot_username, priority=PRIORITY_LOW
+                    )
+                    await self._push(channel)
+            except errors.FloodWaitError as e:
+                logger.warning("Пул групп: FloodWait %s с, пополним позже", e.seconds)
+                await asyncio.sleep(e.seconds + 1)
+                self._wakeup.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Пул групп: не удалось создать резервную группу")
+                await asyncio.sleep(30)
+                self._wakeup.set()
+
+
+@dataclass
+class AccountHealth:
+    in_flight: int = 0
+    created: int = 0
+    failures: int = 0             # подряд идущие ошибки (не FloodWait)
+    last_flood_at: float = 0.0
+    disabled_until: float = 0.0
+
+
+class ShardedChatFactory:
+    """
+    Несколько аккаунтов-юзерботов за интерфейсом ChatFactory (take_chat/create_chat/aclose).
+    Группу создаёт наименее загруженный аккаунт без FloodWait; при FloodWait или ошибке
+    запрос уходит следующему, а сбоящий аккаунт временно выводится из ротации.
+    PartialChatError (группа осталась недостроенной) не переадресуется: иначе дубль.
+    """
+    MAX_FAILURES = 3
+    DISABLE_SEC = 60.0
+
+    def __init__(self, factories: List[ChatFactory]):
+        if not factories:
+            raise ValueError("Нужен хотя бы один ChatFactory")
+        self._shards = factories
+        self._health = [AccountHealth() for _ in factories]
+
+    async def aclose(self):
+        await asyncio.gather(*(f.aclose() for f in self._shards), return_exceptions=True)
+
+    def _order(self) -> List[int]:
+        now = time.monotonic()
+        alive = [i for i, h in enumerate(self._health) if h.disabled_until <= now]
+        candidates = alive or list(range(len(self._shards)))
+        return sorted(candidates, key=lambda i: (
+            not self._shards[i].is_ready(),
+            self._shards[i].creation_backoff() > 0,
+            self._health[i].in_flight,
+            self._health[i].last_flood_at,
         ))
 
-        # Bot API chat_id (-100...)
-        chat_id = utils.get_peer_id(channel)
-        return chat_id
+    async def _dispatch(self, op: str, **kwargs) -> int:
+        last_exc: Optional[BaseException] = None
+        for i in self._order():
+            health = self._health[i]
+            health.in_flight += 1
+            try:
+                chat_id = await getattr(self._shards[i], op)(**kwargs)
+            except (errors.FloodWaitError, SchedulerBackoff) as e:
+                health.last_flood_at = time.monotonic()
+                last_exc = e
+                logger.warning("Аккаунт #%s во FloodWait, пробуем следующий: %s", i, e)
+            except (errors.RPCError, ConnectionError, asyncio.TimeoutError) as e:
+                health.failures += 1
+                if health.failures >= self.MAX_FAILURES:
+                    health.disabled_until = time.monotonic() + self.DISABLE_SEC
+                last_exc = e
+                logger.warning("Аккаунт #%s: ошибка создания группы, пробуем следующий: %s", i, e)
+            else:
+                health.failures = 0
+                health.created += 1
+                return chat_id
+            finally:
+                health.in_flight -= 1
+        assert last_exc is not None
+        raise last_exc
 
+    async def create_chat(self, *, title: str, bot_username: str, timeout: Optional[float] = None) -> int:
+        return await self._dispatch("create_chat", title=title, bot_username=bot_username, timeout=timeout)
 
-async def build_chat_factory(settings: Settings) -> ChatFactory:
-    if not settings.USERBOT_SESSION:
-        raise RuntimeError("USERBOT_SESSION пуст. Сгенерируйте через скрипт и положите в .env")
+    async def take_chat(self, *, title: str, bot_username: str, timeout: Optional[float] = None) -> int:
+        return await self._dispatch("take_chat", title=title, bot_username=bot_username, timeout=timeout)
+
+    def creation_backoff(self) -> float:
+        return min(f.creation_backoff() for f in self._shards)
+
+    def is_ready(self) -> bool:
+        return any(f.is_ready() for f in self._shards)
+
+    def backoff_state(self) -> Dict[str, Dict[str, float]]:
+        return {
+            f"account{i}.{family}": st
+            for i, f in enumerate(self._shards)
+            for family, st in f.backoff_state().items()
+        }
 
+    def health(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "account": i,
+                "in_flight": h.in_flight,
+                "created": h.created,
+                "failures": h.failures,
+                "disabled": h.disabled_until > now,
+                "backoff": self._shards[i].creation_backoff(),
+                "ready": self._shards[i].is_ready(),
+            }
+            for i, h in enumerate(self._health)
+        ]
+
+
+def _entity_cache_path(base: str, index: int) -> str:
+    # access_hash бота у каждого аккаунта свой — кэш тоже раздельный
+    if not base or index == 0:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}.{index}{ext}"
+
+
+async def _build_one(settings: Settings, session: str, index: int, *, pool_size: int, db: Any) -> ChatFactory:
     client = TelegramClient(
-        StringSession(settings.USERBOT_SESSION),
+        StringSession(session),
         settings.API_ID,
         settings.API_HASH,
     )
     await client.connect()
-    if not await client.is_user_authorized():
-        raise RuntimeError("Userbot session не авторизована. Пересоздайте USERBOT_SESSION.")
+    try:
+        authorized = await client.is_user_authorized()
+    except BaseException:
+        await client.disconnect()
+        raise
+    if not authorized:
+        await client.disconnect()
+        raise RuntimeError(f"Userbot session #{index} не авторизована. Пересоздайте её.")
+
+    supervisor = ConnectionSupervisor(client, interval=settings.KEEPALIVE_SEC)
+    supervisor.start()
+    factory = ChatFactory(
+        client,
+        entity_cache=EntityCache(_entity_cache_path(settings.ENTITY_CACHE_PATH, index)),
+        scheduler=RequestScheduler(client),
+        supervisor=supervisor,
+    )
+    try:
+        # резолвим бота один раз на старте, дальше create_chat обходится без get_entity
+        await factory.resolve_bot(settings.MANAGED_BOT_USERNAME)
+        if pool_size > 0:
+            factory.pool = ChatPool(
+                factory, bot_username=settings.MANAGED_BOT_USERNAME, size=pool_size, db=db
+            )
+            await factory.pool.start()
+    except BaseException:
+        await factory.aclose()
+        raise
+    return factory
+
+
+async def build_chat_factory(settings: Settings, *, db: Any = None) -> Union[ChatFactory, ShardedChatFactory]:
+    sessions = settings.all_sessions()
+    if not sessions:
+        raise RuntimeError("USERBOT_SESSION пуст. Сгенерируйте через скрипт и положите в .env")
+
+    if len(sessions) == 1:
+        return await _build_one(settings, sessions[0], 0, pool_size=settings.CHAT_POOL_SIZE, db=db)
 
-    return ChatFactory(client)
+    # резерв групп делим между аккаунтами поровну (с округлением вверх)
+    per_account = -(-settings.CHAT_POOL_SIZE // len(sessions)) if settings.CHAT_POOL_SIZE > 0 else 0
+    factories: List[ChatFactory] = []
+    try:
+        for i, session in enumerate(sessions):
+            factories.append(await _build_one(settings, session, i, pool_size=per_account, db=db))
+    except BaseException:
+        await asyncio.gather(*(f.aclose() for f in factories), return_exceptions=True)
+        raise
+    return ShardedChatFactory(factories)